@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import struct
+import zlib
+from collections import deque
+from pathlib import Path
+
+ARCHIVE_MAGIC = b'DGAR\x01'
+FOOTER_MAGIC = b'DGAREND1'
+FOOTER = struct.Struct('<QQ8s')
+BLOCK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.aac', '.apk', '.avi', '.br', '.bz2', '.cab', '.docx', '.flac', '.gif', '.gz',
+    '.heic', '.jar', '.jpeg', '.jpg', '.lz4', '.lzma', '.m4a', '.m4v', '.mkv', '.mov', '.mp3',
+    '.mp4', '.odp', '.ods', '.odt', '.ogg', '.opus', '.png', '.pptx', '.rar', '.tgz', '.webm',
+    '.webp', '.xlsx', '.xz', '.zip', '.zst',
+}
+
+
+def _compress_block(data, level):
+    return zlib.compress(data, level)
+
+
+def is_compressed_type(path):
+    return Path(path).suffix.lower() in COMPRESSED_EXTENSIONS
+
+
+class _BlockBuffer:
+    def __init__(self, compress):
+        self.compress = compress
+        self.data = bytearray()
+        self.block_no = None
+
+
+class ArchiveWriter:
+    def __init__(self, path, workers=None, level=6, block_size=BLOCK_SIZE, throttle=None, initializer=None):
+        self.path = Path(path)
+        self.level = level
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.file = open(self.path, 'wb')
+        self.file.write(ARCHIVE_MAGIC)
+        self.offset = len(ARCHIVE_MAGIC)
+        self.blocks = []
+        self.files = []
+        self.pending = deque()
+        self.throttle = throttle
+        # multiprocessing costs a noticeable part of the start-up, so only archive runs load it
+        from concurrent.futures import ProcessPoolExecutor
+        
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=initializer)
+        self.buffers = {True: _BlockBuffer(True), False: _BlockBuffer(False)}
+        self.stats = {'files': 0, 'bytes_in': 0, 'bytes_out': 0, 'stored_files': 0}
+
+    def _current_block(self, buffer):
+        if buffer.block_no is None:
+            buffer.block_no = len(self.blocks)
+            self.blocks.append(None)
+        return buffer.block_no
+
+    def _seal(self, buffer):
+        if buffer.block_no is None:
+            return
+        data = bytes(buffer.data)
+        if buffer.compress:
+            work = self.pool.submit(_compress_block, data, self.level)
+        else:
+            work = data
+        self.pending.append((buffer.block_no, data, buffer.compress, work))
+        buffer.data = bytearray()
+        buffer.block_no = None
+        while len(self.pending) > self.workers * 2:
+            self._write_next()
+
+    def _write_next(self):
+        block_no, data, compressed, work = self.pending.popleft()
+        payload = work.result() if compressed else work
+        if compressed and len(payload) >= len(data):
+            compressed = False
+            payload = data
+        self.file.write(payload)
+        self.blocks[block_no] = [self.offset, len(payload), len(data), 'zlib' if compressed else 'none']
+        self.offset += len(payload)
+        self.stats['bytes_out'] += len(payload)
+
+    def add_file(self, src_path, rel_path, size, mtime_ns):
+        compress = not is_compressed_type(src_path)
+        buffer = self.buffers[compress]
+        segments = []
+        digest = hashlib.sha256()
+        with open(src_path, 'rb') as f:
+            while True:
+                room = self.block_size - len(buffer.data)
+                data = f.read(min(room, READ_SIZE))
+                if not data:
+                    break
+                if self.throttle is not None:
+                    self.throttle.wait_bytes(len(data))
+                block_no = self._current_block(buffer)
+                if segments and segments[-1][0] == block_no:
+                    segments[-1][2] += len(data)
+                else:
+                    segments.append([block_no, len(buffer.data), len(data)])
+                buffer.data += data
+                digest.update(data)
+                self.stats['bytes_in'] += len(data)
+                if len(buffer.data) >= self.block_size:
+                    self._seal(buffer)
+        self.files.append({
+            'path': rel_path,
+            'size': size,
+            'mtime_ns': mtime_ns,
+            'sha256': digest.hexdigest(),
+            'segments': segments,
+        })
+        self.stats['files'] += 1
+        if not compress:
+            self.stats['stored_files'] += 1
+
+    def close(self):
+        for buffer in self.buffers.values():
+            self._seal(buffer)
+        while self.pending:
+            self._write_next()
+        self.pool.shutdown()
+
+        index = zlib.compress(json.dumps({'blocks': self.blocks, 'files': self.files},
+                                         ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        self.file.write(index)
+        self.file.write(FOOTER.pack(self.offset, len(index), FOOTER_MAGIC))
+        self.file.close()
+
+    def abort(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.file.close()
+        self.path.unlink(missing_ok=True)
+
+
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"{self.path} no es un archivo de respaldo válido")
+            f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != FOOTER_MAGIC:
+                raise ValueError(f"El archivo {self.path} está incompleto o dañado")
+            f.seek(index_offset)
+            index = json.loads(zlib.decompress(f.read(index_length)))
+        self.blocks = index['blocks']
+        self.files = {entry['path']: entry for entry in index['files']}
+
+    def list(self):
+        return list(self.files)
+
+    def _read_block(self, f, block_no):
+        offset, length, raw_size, method = self.blocks[block_no]
+        f.seek(offset)
+        data = f.read(length)
+        if method == 'zlib':
+            data = zlib.decompress(data)
+        return data
+
+    def iter_data(self, rel_path):
+        with open(self.path, 'rb') as f:
+            for block_no, start, length in self.files[rel_path]['segments']:
+                yield self._read_block(f, block_no)[start:start + length]
+
+    def extract(self, rel_path, dest_file):
+        entry = self.files[rel_path]
+        dest_file = Path(dest_file)
+        dest_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(dest_file, 'wb') as out:
+            for data in self.iter_data(rel_path):
+                out.write(data)
+        os.utime(dest_file, ns=(entry['mtime_ns'], entry['mtime_ns']))
+
+    def extract_all(self, target_dir):
+        for rel_path in self.files:
+            self.extract(rel_path, Path(target_dir) / rel_path)
+        return len(self.files)
@@ -0,0 +1,87 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+CATALOG_FILE = "backup_catalog.db"
+
+
+def manifest_info(manifest, extra_bytes=0):
+    # what retention needs to know about a backup, taken once from its manifest
+    stored_bytes = sum(entry['size'] for entry in manifest.files.values()
+                       if entry.get('stored_in', manifest.snapshot) == manifest.snapshot and not entry.get('linked'))
+    depends_on = {entry['stored_in'] for entry in manifest.files.values() if entry.get('stored_in')}
+    depends_on.discard(manifest.snapshot)
+    return {
+        'total_bytes': manifest.total_bytes() + extra_bytes,
+        'stored_bytes': stored_bytes + extra_bytes,
+        'files': len(manifest.files),
+        'depends_on': sorted(depends_on),
+    }
+
+
+class BackupCatalog:
+    def __init__(self, db_file=CATALOG_FILE):
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS backups ("
+            " dest_key TEXT NOT NULL, name TEXT NOT NULL, recorded TEXT NOT NULL,"
+            " total_bytes INTEGER, stored_bytes INTEGER, files INTEGER, depends_on TEXT NOT NULL,"
+            " location TEXT, PRIMARY KEY (dest_key, name))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS verify_state (dest_key TEXT PRIMARY KEY, position INTEGER NOT NULL)"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def record(self, dest_key, name, total_bytes=None, stored_bytes=None, files=None, depends_on=(), location=None):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO backups (dest_key, name, recorded, total_bytes, stored_bytes, files,"
+                " depends_on, location) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (dest_key, name, datetime.now().isoformat(timespec='seconds'), total_bytes, stored_bytes, files,
+                 json.dumps(list(depends_on)), location))
+            self.db.commit()
+
+    def backups(self, dest_key):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT name, total_bytes, stored_bytes, files, depends_on, location FROM backups"
+                " WHERE dest_key = ?", (dest_key,)).fetchall()
+        return {name: {'total_bytes': total_bytes, 'stored_bytes': stored_bytes, 'files': files,
+                       'depends_on': json.loads(depends_on), 'location': location}
+                for name, total_bytes, stored_bytes, files, depends_on, location in rows}
+
+    def sync(self, dest_key, names, describe=None):
+        # match the catalog to what the destination actually holds: backups made before the
+        # catalog existed are described once (describe(name) -> dict or None), vanished ones dropped
+        names = set(names)
+        known = self.backups(dest_key)
+        self.remove(dest_key, [name for name in known if name not in names])
+        for name in sorted(names - set(known)):
+            info = describe(name) if describe else None
+            self.record(dest_key, name, **(info or {}))
+        return self.backups(dest_key)
+
+    def remove(self, dest_key, names):
+        with self.lock:
+            self.db.executemany("DELETE FROM backups WHERE dest_key = ? AND name = ?",
+                                [(dest_key, name) for name in names])
+            self.db.commit()
+
+    def verify_position(self, dest_key):
+        # where the sampled verification of a destination continues on its next run
+        with self.lock:
+            row = self.db.execute("SELECT position FROM verify_state WHERE dest_key = ?", (dest_key,)).fetchone()
+        return row[0] if row else 0
+
+    def set_verify_position(self, dest_key, position):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO verify_state (dest_key, position) VALUES (?, ?)",
+                            (dest_key, position))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,178 +1,524 @@
+import hashlib
 import os
 import shutil
 from pathlib import Path
 from datetime import datetime
 import threading
+from manifest import (BackupManifest, MANIFEST_NAME, find_latest_manifest,
+                      load_cached_manifest, save_cached_manifest)
+from chunk_store import ChunkRepository
+from archive_writer import ArchiveWriter, ArchiveReader
+from nas_transfer import NASTransfer, WRITE_SIZE
+from gdrive_uploader import DriveUploader, DEFAULT_CHUNK_SIZE, BATCH_LIMIT
+from dropbox_uploader import DropboxUploader, redirect_session, DEFAULT_CHUNK_SIZE as DROPBOX_CHUNK_SIZE
+from copy_engine import CopyPool, DEFAULT_WORKERS
+from content_hash import HashCache
+from pack_store import PackBuilder, PackReader, PACK_DIR, PACK_INDEX_NAME, DEFAULT_SMALL_FILE_LIMIT
+from fast_copy import FastCopier
+from scanner import SourceScanner, ProgressTracker
+from filters import FileFilter
+from run_journal import RunJournal, pending_backup
+from throttle import Throttle, lower_thread_priority, lower_process_priority
+from backup_catalog import BackupCatalog, manifest_info
+from retention import RetentionPolicy
+from verifier import Verifier, hash_chunks, hash_local_file, select_sample
+from run_metrics import RunMetrics, RunHistory, describe_run, write_textfile
+from run_profiler import RunProfiler
+
+FILE_BATCH = 200
+TRASH_DIR = ".diskguardian_trash"
+TRASH_SPLIT_DEPTH = 3
+
+
+def _metrics_key(dest_type, config):
+    # one series per destination in the run history and the textfile
+    if dest_type == "nas":
+        return f"nas_{config.get('server')}_{config.get('share')}"
+    if dest_type == "gdrive":
+        return f"gdrive_{config.get('folder_name')}"
+    if dest_type == "dropbox":
+        return f"dropbox_{config.get('folder_path')}"
+    return f"{dest_type}_{config.get('path')}"
+
 
 class BackupManager:
     def __init__(self, log_callback):
         self.log = log_callback
         self.stop_flag = False
+        self.copier = FastCopier()
+        self.watcher = None
+        self.file_filter = None
+        self.last_scanner = None
+        self.resume = False
+        self.throttle = Throttle()
+        self.metrics = RunMetrics()
+        self.profiler = RunProfiler()
         
     def stop(self):
         self.stop_flag = True
         
-    def backup(self, sources, dest_type, dest_config, progress_callback):
+    def _open_journal(self, key, backup_name):
+        journal = RunJournal(key)
+        backup_name = journal.open(backup_name, resume=self.resume)
+        if journal.resumed:
+            self.log(f"Reanudando la copia interrumpida {backup_name}: {len(journal.files)} archivos ya completados")
+        elif self.resume:
+            self.log("No hay ninguna copia interrumpida para este destino, se iniciará una nueva")
+        return journal, backup_name
+        
+    def _scanner(self, sources):
+        def on_error(path, e):
+            self.metrics.error()
+            self.log(f"Error leyendo {path}: {str(e)}")
+            
+        if self.watcher is not None and self.watcher.covers(sources):
+            scanner = self.watcher.scanner(sources, should_stop=lambda: self.stop_flag, on_error=on_error,
+                                           file_filter=self.file_filter, metrics=self.metrics)
+            self.log("Usando el índice de origen, sin recorrer las carpetas")
+        else:
+            scanner = SourceScanner(sources, should_stop=lambda: self.stop_flag, on_error=on_error,
+                                    file_filter=self.file_filter, on_start=self.throttle.worker_started,
+                                    metrics=self.metrics, profiler=self.profiler)
+        self.last_scanner = scanner
+        return scanner
+        
+    def _byte_limiter(self):
+        # components only take the slower chunked paths when bytes are actually limited
+        return self.throttle if self.throttle.limits_bytes else None
+        
+    def _finish_metrics(self, status, metrics_file):
+        scanner = self.last_scanner
+        self.metrics.finish(status, getattr(scanner, 'scan_seconds', None))
+        run = self.metrics.snapshot()
+        self.log(f"Ejecución {describe_run(run)}")
+        try:
+            history = RunHistory()
+            try:
+                history.record(run)
+                if metrics_file:
+                    write_textfile(metrics_file, history.latest(), history.latest('completed'))
+            finally:
+                history.close()
+        except Exception as e:
+            self.log(f"Advertencia guardando las métricas de la ejecución: {str(e)}")
+            
+    def _finish_profiler(self):
+        try:
+            summary = self.profiler.stop()
+        except Exception as e:
+            self.log(f"Advertencia guardando el perfil de rendimiento: {str(e)}")
+            return
+        if summary is None:
+            return
+        text = (f"Perfil de rendimiento guardado en {summary['dir']}: {summary['samples']} muestras "
+                f"(coste del muestreo {summary['sampler_overhead']:.1%}), {summary['spans']} fases")
+        if summary['peak_memory'] is not None:
+            text += f", pico de memoria trazada {summary['peak_memory'] / 1048576:.1f} MB"
+        self.log(text)
+        
+    def backup(self, sources, dest_type, dest_config, progress_callback, filters=None, resume=False, throttle=None,
+               retention=None, metrics_file=None, profiling=None):
+        args = (sources, dest_type, dest_config, progress_callback, filters, resume, throttle, retention, metrics_file,
+                profiling)
+        if not (throttle or {}).get('low_priority'):
+            return self._backup(*args)
+            
+        # a lowered priority belongs to the thread and, without privileges, cannot be
+        # raised again; the daemon's scheduler thread and the CLI's main thread outlive the
+        # run, so it gets a thread of its own that ends with it
+        outcome = {}
+        
+        def run():
+            try:
+                outcome['result'] = self._backup(*args)
+            except BaseException as e:
+                outcome['error'] = e
+                
+        thread = threading.Thread(target=run, name="backup-low-priority")
+        thread.start()
+        thread.join()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+        
+    def _backup(self, sources, dest_type, dest_config, progress_callback, filters, resume, throttle, retention,
+                metrics_file, profiling):
+        self.profiler = RunProfiler.from_config(profiling)
+        if not self.profiler.enabled:
+            return self._run_backup(sources, dest_type, dest_config, progress_callback, filters, resume, throttle,
+                                    retention, metrics_file)
+        try:
+            self.profiler.start(_metrics_key(dest_type, dest_config))
+        except Exception as e:
+            self.log(f"Advertencia: no se pudo iniciar el perfil de rendimiento: {str(e)}")
+            self.profiler = RunProfiler()
+            return self._run_backup(sources, dest_type, dest_config, progress_callback, filters, resume, throttle,
+                                    retention, metrics_file)
+        self.log(f"Perfil de rendimiento activado, se guardará en {self.profiler.output_dir}")
+        try:
+            with self.profiler.span('backup', dest_type=dest_type):
+                try:
+                    return self._run_backup(sources, dest_type, dest_config, progress_callback, filters, resume,
+                                            throttle, retention, metrics_file)
+                finally:
+                    self.profiler.phase(None)
+        finally:
+            self._finish_profiler()
+            
+    def _run_backup(self, sources, dest_type, dest_config, progress_callback, filters, resume, throttle, retention,
+                    metrics_file):
+        self.profiler.phase('prepare')
+        self.metrics = RunMetrics(dest_type, _metrics_key(dest_type, dest_config))
         self.stop_flag = False
+        self.resume = resume
+        self.file_filter = FileFilter.from_config(filters)
+        self.last_scanner = None
+        if self.file_filter.active:
+            self.log(f"Filtros activos: {len(self.file_filter.exclude)} exclusiones, "
+                     f"{len(self.file_filter.include)} inclusiones")
+        self._start_throttle(sources, throttle)
         
-        if dest_type == "local":
-            self._backup_to_local(sources, dest_config['path'], progress_callback)
-        elif dest_type == "nas":
-            self._backup_to_nas(sources, dest_config, progress_callback)
-        elif dest_type == "gdrive":
-            self._backup_to_gdrive(sources, dest_config, progress_callback)
-        elif dest_type == "dropbox":
-            self._backup_to_dropbox(sources, dest_config, progress_callback)
+        try:
+            if dest_type == "local":
+                self._backup_to_local(sources, dest_config, progress_callback)
+            elif dest_type == "nas":
+                self._backup_to_nas(sources, dest_config, progress_callback)
+            elif dest_type == "gdrive":
+                self._backup_to_gdrive(sources, dest_config, progress_callback)
+            elif dest_type == "dropbox":
+                self._backup_to_dropbox(sources, dest_config, progress_callback)
+            elif dest_type == "repository":
+                if resume:
+                    self.log("El repositorio no necesita reanudación: los fragmentos ya guardados no se vuelven a escribir")
+                self._backup_to_repository(sources, dest_config, progress_callback)
+            elif dest_type == "archive":
+                if resume:
+                    self.log("Un archivo comprimido no se puede reanudar, se creará uno nuevo")
+                self._backup_to_archive(sources, dest_config, progress_callback)
+        except BaseException:
+            self.metrics.error()
+            self._finish_metrics('failed', metrics_file)
+            raise
+        finally:
+            self.throttle.stop()
+        self._finish_metrics('stopped' if self.stop_flag else 'completed', metrics_file)
+            
+        if retention and not self.stop_flag:
+            self.profiler.phase('retention')
+            try:
+                self.prune(dest_type, dest_config, retention)
+            except Exception as e:
+                self.log(f"Advertencia aplicando la retención: {str(e)}")
             
-    def _backup_to_local(self, sources, dest_path, progress_callback):
+        if self.file_filter.active and self.last_scanner is not None and self.last_scanner.skipped:
+            self.log(f"{self.last_scanner.skipped} archivos o carpetas excluidos por los filtros")
+            
+    def _start_throttle(self, sources, config):
+        self.throttle = Throttle.from_config(config, should_stop=lambda: self.stop_flag, log=self.log)
+        if not self.throttle.active:
+            return
+        limits = []
+        if self.throttle.max_bytes_per_sec:
+            limits.append(f"{self.throttle.max_bytes_per_sec / 1048576:.1f} MB/s")
+        if self.throttle.files.rate:
+            limits.append(f"{self.throttle.files.rate:g} archivos/s")
+        if self.throttle.adaptive:
+            limits.append("ajuste automático según la carga del disco")
+        if limits:
+            self.log(f"Velocidad limitada: {', '.join(limits)}")
+        if self.throttle.low_priority:
+            # the thread running the backup reads files itself (repository, archive, packs);
+            # backup() starts it for the run, so the lower priority goes away with it
+            if lower_thread_priority():
+                self.log("Copia en prioridad baja de CPU y disco")
+            else:
+                self.log("La prioridad baja no está disponible en este sistema")
+        self.throttle.start(sources)
+        
+    def _backup_to_local(self, sources, dest_config, progress_callback):
+        dest_path = dest_config['path']
+        mode = dest_config.get('mode', 'full')
+        use_hash = dest_config.get('checksums', False)
+        
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_folder = Path(dest_path) / f"backup_{timestamp}"
+        dest_key = f"local_{Path(dest_path).resolve()}"
+        journal, backup_name = self._open_journal(dest_key, f"backup_{timestamp}")
+        backup_folder = Path(dest_path) / backup_name
         backup_folder.mkdir(parents=True, exist_ok=True)
         
         self.log(f"Creando copia de seguridad en: {backup_folder}")
         
-        total_files = sum(1 for source in sources for _ in Path(source).rglob('*') if Path(source).is_dir() or 1)
+        previous = None
+        if mode in ('incremental', 'hardlink'):
+            previous = find_latest_manifest(dest_path, exclude=backup_folder.name)
+            if previous:
+                self.log(f"Copia {'incremental' if mode == 'incremental' else 'con enlaces duros'} basada en: {previous.snapshot}")
+            else:
+                self.log("No hay copias anteriores con manifiesto, se realizará una copia completa")
+        manifest = BackupManifest(backup_folder.name, base=previous.snapshot if previous else None)
+        self.copier = FastCopier(self._byte_limiter())
+        
+        scanner = self._scanner(sources)
+        tracker = ProgressTracker(scanner, progress_callback, previous.total_bytes() if previous else None)
         processed = 0
+        stats = {'copied': 0, 'linked': 0, 'unchanged': 0, 'resumed': 0}
+        lock = threading.Lock()
         
-        for source in sources:
-            if self.stop_flag:
-                self.log("Copia de seguridad detenida por el usuario")
-                return
-                
-            source_path = Path(source)
+        def copy_one(entry):
+            nonlocal processed
             
-            if source_path.is_file():
-                dest_file = backup_folder / source_path.name
-                shutil.copy2(source_path, dest_file)
-                self.log(f"Copiado: {source_path.name}")
+            done = journal.completed(entry)
+            if done is not None:
+                manifest.files[entry.rel_path] = done['manifest']
+                result = 'resumed'
+            else:
+                self.throttle.wait_file()
+                result = self._copy_local_file(entry, backup_folder / entry.rel_path, dest_path, manifest, previous, mode, use_hash)
+                journal.file_done(entry, manifest=manifest.files[entry.rel_path])
+            if result == 'copied':
+                self.metrics.transferred(entry.size)
+            else:
+                self.metrics.skipped(entry.size)
+            with lock:
+                stats[result] += 1
                 processed += 1
-                progress_callback(int((processed / max(total_files, 1)) * 100))
-            elif source_path.is_dir():
-                folder_name = source_path.name
-                dest_folder = backup_folder / folder_name
+                count = processed
+            tracker.add(entry.size)
+            if count % 10 == 0:
+                self.log(f"Progreso: {count} archivos procesados")
                 
-                for root, dirs, files in os.walk(source_path):
+        def on_error(entry, e):
+            self.metrics.error()
+            self.log(f"Error copiando {entry.path}: {str(e)}")
+            tracker.add(entry.size)
+            
+        pool = CopyPool(dest_config.get('workers', DEFAULT_WORKERS), should_stop=lambda: self.stop_flag, on_error=on_error,
+                        on_start=self.throttle.worker_started)
+        
+        self.profiler.phase('transfer')
+        try:
+            with pool:
+                for entry in scanner:
                     if self.stop_flag:
-                        return
-                        
-                    rel_path = Path(root).relative_to(source_path)
-                    current_dest = dest_folder / rel_path
-                    current_dest.mkdir(parents=True, exist_ok=True)
-                    
-                    for file in files:
-                        if self.stop_flag:
-                            return
-                            
-                        src_file = Path(root) / file
-                        dst_file = current_dest / file
-                        
-                        try:
-                            shutil.copy2(src_file, dst_file)
-                            processed += 1
-                            if processed % 10 == 0:
-                                progress_callback(int((processed / max(total_files, 1)) * 100))
-                                self.log(f"Progreso: {processed} archivos copiados")
-                        except Exception as e:
-                            self.log(f"Error copiando {src_file}: {str(e)}")
-                            
+                        break
+                    if entry.is_dir:
+                        (backup_folder / entry.rel_path).mkdir(parents=True, exist_ok=True)
+                    else:
+                        pool.submit(entry, copy_one, entry)
+        finally:
+            self.profiler.phase('finalize')
+            manifest.save(backup_folder)
+            journal.close()
+            
+        if self.stop_flag:
+            self.log("Copia de seguridad detenida por el usuario; puede reanudarse más tarde")
+            return
+            
+        journal.finish()
+        self._catalog_backup(dest_key, manifest)
         progress_callback(100, "Copia de seguridad completada")
-        self.log(f"Copia de seguridad completada: {processed} archivos respaldados")
+        self.log(f"Copia de seguridad completada: {processed} archivos respaldados "
+                 f"({stats['copied']} copiados, {stats['linked']} enlazados, {stats['unchanged']} sin cambios, "
+                 f"{stats['resumed']} ya completados antes de la interrupción)")
+        if stats['copied']:
+            self.log(f"Métodos de copia utilizados: {self.copier.summary()}")
         
-    def _backup_to_nas(self, sources, config, progress_callback):
-        from smbclient import register_session, open_file, mkdir
-        from smbclient.shutil import copy2
+    def _copy_local_file(self, entry, dst_file, dest_path, manifest, previous, mode, use_hash):
+        rel_key = entry.rel_path
         
+        if previous is not None and previous.is_unchanged(rel_key, entry, use_hash):
+            previous_entry = previous.get(rel_key)
+            if mode != 'hardlink':
+                manifest.record_unchanged(rel_key, previous_entry, entry)
+                return 'unchanged'
+                
+            try:
+                os.link(previous.locate(dest_path, rel_key), dst_file)
+                recorded = manifest.record_unchanged(rel_key, previous_entry, entry)
+                recorded['stored_in'] = manifest.snapshot
+                # the data belongs to an older backup as well, so retention does not count it twice
+                recorded['linked'] = True
+                return 'linked'
+            except OSError as e:
+                self.log(f"No se pudo enlazar {rel_key}, se copiará: {str(e)}")
+                
+        digest = hashlib.sha256() if use_hash else None
+        with self.metrics.timer('write'):
+            self.copier.copy(entry.path, dst_file, digest)
+        manifest.record_copied(rel_key, entry, digest.hexdigest() if digest else None)
+        return 'copied'
+        
+    def _backup_to_nas(self, sources, config, progress_callback):
         server = config['server']
         share = config['share']
         username = config.get('username', 'guest')
         password = config.get('password', '')
         
+        transfer = NASTransfer(server, username, password, config.get('write_size', WRITE_SIZE),
+                               throttle=self._byte_limiter())
         try:
-            register_session(server, username=username, password=password)
+            transfer.connect()
         except Exception as e:
             self.log(f"Error conectando al NAS: {str(e)}")
             raise Exception(f"No se pudo conectar al NAS {server}. Verifica el servidor, usuario y contraseña.")
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        nas_path = f"\\\\{server}\\{share}\\backup_{timestamp}"
+        journal, backup_name = self._open_journal(f"nas_{server}_{share}", f"backup_{timestamp}")
+        nas_path = f"\\\\{server}\\{share}\\{backup_name}"
         
         self.log(f"Conectando a NAS: {server}\\{share}")
         self.log(f"Creando carpeta de respaldo: {nas_path}")
         
         try:
-            mkdir(nas_path)
+            transfer.makedirs(nas_path)
         except Exception as e:
             self.log(f"Error creando carpeta base en NAS: {str(e)}")
+            transfer.close()
             raise Exception(f"No se pudo crear la carpeta de respaldo en el NAS. Verifica los permisos.")
         
-        total_files = sum(1 for source in sources for _ in Path(source).rglob('*') if Path(source).is_dir() or 1)
+        share_path = f"\\\\{server}\\{share}"
+        cache_key = f"nas_{server}_{share}"
+        
+        previous = None
+        if config.get('mode', 'full') == 'incremental':
+            previous = self._load_nas_manifest(transfer, share_path, backup_name, cache_key)
+        manifest = BackupManifest(backup_name, base=previous.snapshot if previous else None)
+        
+        scanner = self._scanner(sources)
+        tracker = ProgressTracker(scanner, progress_callback, previous.total_bytes() if previous else None)
         processed = 0
+        server_copied = 0
+        resumed = 0
+        lock = threading.Lock()
         
-        for source in sources:
-            if self.stop_flag:
-                self.log("Copia de seguridad detenida")
+        def copy_one(entry, dst_file):
+            nonlocal processed, server_copied, resumed
+            
+            done = journal.completed(entry)
+            if done is not None:
+                manifest.files[entry.rel_path] = done['manifest']
+                self.metrics.skipped(entry.size)
+                with lock:
+                    processed += 1
+                    resumed += 1
+                tracker.add(entry.size)
                 return
                 
-            source_path = Path(source)
-            dest_name = source_path.name
-            dest_path = f"{nas_path}\\{dest_name}"
-            
-            self.log(f"Copiando {source} a {dest_path}")
+            self.throttle.wait_file()
+            copied_remotely = False
+            if previous is not None and previous.is_unchanged(entry.rel_path, entry):
+                prev_file = f"{share_path}\\{previous.snapshot}\\{entry.rel_path}".replace('/', '\\')
+                try:
+                    with self.metrics.timer('remote'):
+                        transfer.server_copy(prev_file, dst_file)
+                    recorded = manifest.record_unchanged(entry.rel_path, previous.get(entry.rel_path), entry)
+                    recorded['stored_in'] = backup_name
+                    recorded.pop('mtime_resolution_ns', None)
+                    copied_remotely = True
+                except Exception as e:
+                    self.log(f"Copia en el servidor no disponible para {entry.rel_path}, se enviará: {str(e)}")
+                    
+            if copied_remotely:
+                self.metrics.skipped(entry.size)
+            else:
+                with self.metrics.timer('write'):
+                    sha256 = transfer.copy_file(entry.path, dst_file, entry.size)
+                manifest.record_copied(entry.rel_path, entry, sha256)
+                self.metrics.transferred(entry.size)
+            journal.file_done(entry, manifest=manifest.files[entry.rel_path])
+                
+            with lock:
+                processed += 1
+                server_copied += copied_remotely
+                count = processed
+            tracker.add(entry.size)
+            if count % 10 == 0:
+                self.log(f"Progreso: {count} archivos copiados")
+                
+        def on_error(entry, e):
+            self.metrics.error()
+            self.log(f"Error copiando {entry.path.name}: {str(e)}")
+            tracker.add(entry.size)
             
-            try:
-                if source_path.is_file():
-                    try:
-                        mkdir(nas_path)
-                    except:
-                        pass
-                    copy2(str(source_path), dest_path)
-                    processed += 1
-                    progress_callback(int((processed / max(total_files, 1)) * 100))
-                elif source_path.is_dir():
-                    for root, dirs, files in os.walk(source_path):
-                        if self.stop_flag:
-                            return
-                            
-                        rel_path = Path(root).relative_to(source_path.parent)
-                        current_dest = f"{nas_path}\\{rel_path}".replace('/', '\\')
+        pool = CopyPool(config.get('workers', DEFAULT_WORKERS), should_stop=lambda: self.stop_flag, on_error=on_error,
+                        on_start=self.throttle.worker_started)
+        
+        self.profiler.phase('transfer')
+        try:
+            with pool:
+                for entry in scanner:
+                    if self.stop_flag:
+                        break
                         
+                    current_dest = f"{nas_path}\\{entry.rel_path}".replace('/', '\\')
+                    
+                    if entry.is_dir:
+                        if '/' not in entry.rel_path:
+                            self.log(f"Copiando {entry.path} a {current_dest}")
                         try:
-                            mkdir(current_dest)
+                            transfer.makedirs(current_dest)
                         except Exception as e:
-                            if "STATUS_OBJECT_NAME_COLLISION" not in str(e):
-                                self.log(f"Advertencia creando directorio {current_dest}: {str(e)}")
+                            self.log(f"Advertencia creando directorio {current_dest}: {str(e)}")
+                    else:
+                        pool.submit(entry, copy_one, entry, current_dest)
                         
-                        for file in files:
-                            if self.stop_flag:
-                                return
-                                
-                            src_file = Path(root) / file
-                            dst_file = f"{current_dest}\\{file}"
-                            
-                            try:
-                                copy2(str(src_file), dst_file)
-                                processed += 1
-                                if processed % 10 == 0:
-                                    progress_callback(int((processed / max(total_files, 1)) * 100))
-                                    self.log(f"Progreso: {processed} archivos copiados")
-                            except Exception as e:
-                                self.log(f"Error copiando {file}: {str(e)}")
-                                
+            self.profiler.phase('finalize')
+            try:
+                transfer.write_file(f"{nas_path}\\{MANIFEST_NAME}", manifest.to_json().encode('utf-8'))
+                if not self.stop_flag:
+                    save_cached_manifest(cache_key, manifest)
             except Exception as e:
-                self.log(f"Error en copia a NAS: {str(e)}")
-                raise
-                
+                self.log(f"Advertencia guardando el manifiesto en el NAS: {str(e)}")
+        finally:
+            transfer.close()
+            journal.close()
+            
+        if self.stop_flag:
+            self.log("Copia de seguridad detenida; puede reanudarse más tarde")
+            return
+            
+        journal.finish()
+        self._catalog_backup(cache_key, manifest)
         progress_callback(100, "Copia de seguridad en NAS completada")
-        self.log(f"Respaldo en NAS completado: {processed} archivos")
+        self.log(f"Respaldo en NAS completado: {processed} archivos "
+                 f"({processed - server_copied - resumed} enviados, {server_copied} copiados en el servidor sin cambios, "
+                 f"{resumed} ya completados antes de la interrupción)")
         
-    def _backup_to_gdrive(self, sources, config, progress_callback):
-        from google.auth.transport.requests import Request
-        from google.oauth2.credentials import Credentials
-        from google_auth_oauthlib.flow import InstalledAppFlow
-        from googleapiclient.discovery import build
-        from googleapiclient.http import MediaFileUpload
+    def _load_nas_manifest(self, transfer, share_path, backup_name, cache_key):
+        backups = transfer.list_backups(share_path, exclude=backup_name)
+        if not backups:
+            self.log("No hay copias anteriores en el NAS, se realizará una copia completa")
+            return None
+        latest = backups[-1]
+        
+        cached = load_cached_manifest(cache_key)
+        if cached is not None and cached.snapshot == latest:
+            self.log(f"Copia incremental basada en: {latest} (manifiesto en caché local)")
+            return cached
+            
+        try:
+            manifest = BackupManifest.from_json(transfer.read_file(f"{share_path}\\{latest}\\{MANIFEST_NAME}"))
+            self.log(f"Copia incremental basada en: {latest}")
+            return manifest
+        except Exception:
+            pass
+            
+        self.log(f"Listando la copia anterior {latest} en el NAS...")
+        files = transfer.list_tree(f"{share_path}\\{latest}", skip={MANIFEST_NAME})
+        for entry in files.values():
+            # SMB timestamps have 100 ns resolution
+            entry['mtime_resolution_ns'] = 100
+            entry['stored_in'] = latest
+        self.log(f"Copia incremental basada en: {latest} ({len(files)} archivos listados)")
+        return BackupManifest(latest, files=files)
+        
+    def _gdrive_credentials(self, config):
         import pickle
         
+        if config.get('api_endpoint'):
+            from google.auth.credentials import AnonymousCredentials
+            return AnonymousCredentials()
+            
         SCOPES = ['https://www.googleapis.com/auth/drive.file']
         
         creds = None
@@ -183,9 +529,15 @@ class BackupManager:
                 creds = pickle.load(token)
                 
         if not creds or not creds.valid:
+            # requests and the OAuth flow cost about 100 ms to import, and a saved token
+            # usually needs neither
             if creds and creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request
+                
                 creds.refresh(Request())
             else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                
                 flow = InstalledAppFlow.from_client_secrets_file(
                     config['credentials_path'], SCOPES)
                 creds = flow.run_local_server(port=0)
@@ -193,131 +545,1041 @@ class BackupManager:
             with open(token_file, 'wb') as token:
                 pickle.dump(creds, token)
                 
-        service = build('drive', 'v3', credentials=creds)
-        
-        folder_name = f"{config['folder_name']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        return creds
         
-        file_metadata = {
-            'name': folder_name,
-            'mimeType': 'application/vnd.google-apps.folder'
-        }
-        folder = service.files().create(body=file_metadata, fields='id').execute()
-        folder_id = folder.get('id')
+    def _backup_to_gdrive(self, sources, config, progress_callback):
+        creds = self._gdrive_credentials(config)
         
-        self.log(f"Carpeta creada en Google Drive: {folder_name}")
+        folder_name = f"{config['folder_name']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        cache_key = f"gdrive_{config['folder_name']}"
+        journal, folder_name = self._open_journal(cache_key, folder_name)
+        incremental = config.get('mode', 'full') == 'incremental'
         
-        total_files = sum(1 for source in sources for _ in Path(source).rglob('*') if _.is_file())
+        scanner = self._scanner(sources)
+        tracker = ProgressTracker(scanner, progress_callback)
         processed = 0
+        server_copied = 0
+        lock = threading.Lock()
+        queued_files = []
+        manifest = BackupManifest(folder_name)
+        hash_cache = HashCache() if incremental else None
         
-        def upload_folder(local_path, parent_id):
-            nonlocal processed
+        def record(entry, remote_rel, response, copied):
+            nonlocal processed, server_copied
             
-            for item in Path(local_path).iterdir():
-                if self.stop_flag:
+            sha256 = response.get('sha256')
+            if sha256 is None and copied and previous is not None:
+                # a server-side copy holds the same data as the file of the previous backup
+                sha256 = (previous.get(remote_rel) or {}).get('sha256')
+            manifest.files[remote_rel] = {
+                'size': entry.size,
+                'mtime_ns': entry.mtime_ns,
+                'md5': response.get('md5Checksum'),
+                'sha256': sha256,
+                'id': response['id'],
+                'stored_in': folder_name,
+            }
+            journal.file_done(entry, key=remote_rel, manifest=manifest.files[remote_rel])
+            if hash_cache is not None and response.get('md5Checksum'):
+                hash_cache.store(entry, 'md5', response['md5Checksum'])
+            if copied:
+                self.metrics.skipped(entry.size)
+            else:
+                self.metrics.transferred(entry.size)
+            with lock:
+                processed += 1
+                server_copied += copied
+                count = processed
+            if count % 5 == 0:
+                self.log(f"Subidos {count}/{scanner.files_found} archivos")
+                
+        def on_copied(item, error, response):
+            entry, remote_rel = item
+            if error is not None:
+                self.metrics.error()
+                self.log(f"Error copiando {entry.path.name} en Google Drive: {error}")
+                return
+            record(entry, remote_rel, response, True)
+            
+        uploader = DriveUploader(creds, chunk_size=config.get('chunk_size', DEFAULT_CHUNK_SIZE),
+                                 api_endpoint=config.get('api_endpoint'), log=self.log, on_copied=on_copied,
+                                 throttle=self._byte_limiter(), metrics=self.metrics)
+        
+        previous = None
+        if incremental:
+            backups = {}
+            
+            def list_backups():
+                backups.update(uploader.list_backups(config['folder_name'], exclude=folder_name))
+                return list(backups)
+                
+            previous = self._load_cloud_manifest(cache_key, folder_name, list_backups,
+                                                 lambda name: uploader.list_tree(backups[name]))
+            if previous:
+                manifest.base = previous.snapshot
+                tracker.expected_bytes = previous.total_bytes()
+                
+        folder_id = journal.folders.get('')
+        if folder_id is None:
+            folder_id = uploader.create_folder(folder_name)
+            journal.folder_done('', folder_id)
+            self.log(f"Carpeta creada en Google Drive: {folder_name}")
+            
+        packs = None
+        pack_limit = config.get('pack_threshold', DEFAULT_SMALL_FILE_LIMIT)
+        if config.get('pack_small_files'):
+            pack_folder_id = journal.folders.get(PACK_DIR)
+            if pack_folder_id is None:
+                pack_folder_id = uploader.create_folder(PACK_DIR, folder_id)
+                journal.folder_done(PACK_DIR, pack_folder_id)
+            
+            def upload_pack(name, data, members):
+                nonlocal processed
+                
+                try:
+                    response = uploader.upload_bytes(data, name, pack_folder_id)
+                except Exception as e:
+                    self.metrics.error()
+                    self.log(f"Error subiendo el paquete {name} ({len(members)} archivos): {str(e)}")
+                else:
+                    self.metrics.transferred(len(data), files=len(members))
+                    packs.record(name, len(data), response['id'], members)
+                    journal.pack_done(name, len(data), response['id'], members)
+                    with lock:
+                        processed += len(members)
+                    self.log(f"Paquete {name} subido ({len(members)} archivos)")
+                tracker.add(len(data))
+                
+            packs = PackBuilder(lambda name, data, members: pool.submit(name, upload_pack, name, data, members))
+            for name, done in journal.packs.items():
+                packs.restore(name, done['size'], done['location'], done['members'])
+                
+        new_folders = []
+        
+        def add_folder(rel_path, name, parent_rel):
+            # folders created by an interrupted run are reused instead of created twice
+            if rel_path in journal.folders:
+                uploader.folder_ids[rel_path] = journal.folders[rel_path]
+            else:
+                uploader.add_folder(rel_path, name, parent_rel)
+                new_folders.append(rel_path)
+                
+        def ensure_folder(rel_path):
+            if rel_path and rel_path not in uploader.folder_ids:
+                parent_rel, _, name = rel_path.rpartition('/')
+                ensure_folder(parent_rel)
+                add_folder(rel_path, name, parent_rel)
+                
+        def upload_one(entry, parent_id):
+            # the top-level source folder maps onto the backup folder itself, so paths
+            # in the manifest are relative to it, matching what list_tree returns
+            remote_rel = entry.rel_path.partition('/')[2]
+            self.throttle.wait_file()
+            if previous is not None:
+                prev = previous.get(remote_rel)
+                if (prev and prev['size'] == entry.size and prev.get('md5') and prev.get('id')
+                        and hash_cache.get(entry, 'md5') == prev['md5']):
+                    uploader.queue_copy((entry, remote_rel), prev['id'], entry.path.name, parent_id)
+                    tracker.add(entry.size)
                     return
+            response = uploader.upload_file(
+                entry.path, entry.path.name, parent_id, entry.size, session=journal.session(entry, key=remote_rel),
+                on_progress=lambda uri, offset: journal.session_progress(entry, key=remote_rel, uri=uri, offset=offset))
+            record(entry, remote_rel, response, False)
+            tracker.add(entry.size)
+            
+        def on_error(entry, e):
+            self.metrics.error()
+            self.log(f"Error subiendo {entry.path.name}: {str(e)}")
+            tracker.add(entry.size)
+            
+        def flush():
+            uploader.flush_folders()
+            for rel_path in new_folders:
+                journal.folder_done(rel_path, uploader.folder_ids[rel_path])
+            new_folders.clear()
+            for entry, parent_id in queued_files:
+                pool.submit(entry, upload_one, entry, parent_id)
+            queued_files.clear()
+            
+        pool = CopyPool(config.get('workers', DEFAULT_WORKERS), should_stop=lambda: self.stop_flag, on_error=on_error,
+                        on_start=self.throttle.worker_started)
+        
+        self.profiler.phase('transfer')
+        try:
+            with pool:
+                for entry in scanner:
+                    if self.stop_flag:
+                        break
+                        
+                    parent_rel, _, name = entry.rel_path.rpartition('/')
+                    remote_rel = entry.rel_path.partition('/')[2]
                     
-                if item.is_file():
-                    file_metadata = {
-                        'name': item.name,
-                        'parents': [parent_id]
-                    }
-                    
-                    media = MediaFileUpload(str(item), resumable=True)
-                    
-                    try:
-                        service.files().create(
-                            body=file_metadata,
-                            media_body=media,
-                            fields='id'
-                        ).execute()
+                    if entry.is_dir:
+                        if not parent_rel:
+                            uploader.folder_ids[entry.rel_path] = folder_id
+                        elif packs is not None:
+                            # folders are created only when a large file needs one; the
+                            # pack index keeps the full tree for restores
+                            packs.dirs.append(remote_rel)
+                        else:
+                            add_folder(entry.rel_path, name, parent_rel)
+                    elif journal.completed(entry, key=remote_rel):
+                        done = journal.files[remote_rel]
+                        if 'manifest' in done:
+                            manifest.files[remote_rel] = done['manifest']
+                        self.metrics.skipped(entry.size)
+                        with lock:
+                            processed += 1
+                        tracker.add(entry.size)
+                    elif packs is not None and entry.size < pack_limit:
+                        self.throttle.wait_file()
+                        packs.add(remote_rel, entry)
+                    else:
+                        if packs is not None:
+                            ensure_folder(parent_rel)
+                        queued_files.append((entry, uploader.folder_ids.get(parent_rel, folder_id)))
                         
-                        processed += 1
-                        if processed % 5 == 0:
-                            progress_callback(int((processed / max(total_files, 1)) * 100))
-                            self.log(f"Subidos {processed}/{total_files} archivos")
-                    except Exception as e:
-                        self.log(f"Error subiendo {item.name}: {str(e)}")
+                    if len(queued_files) >= FILE_BATCH or len(uploader.pending_folders) >= BATCH_LIMIT:
+                        flush()
                         
-                elif item.is_dir():
-                    subfolder_metadata = {
-                        'name': item.name,
-                        'mimeType': 'application/vnd.google-apps.folder',
-                        'parents': [parent_id]
-                    }
-                    subfolder = service.files().create(body=subfolder_metadata, fields='id').execute()
-                    upload_folder(item, subfolder.get('id'))
+                if not self.stop_flag:
+                    if packs is not None:
+                        packs.flush()
+                    flush()
                     
-        for source in sources:
+            self.profiler.phase('finalize')
             if self.stop_flag:
-                break
-            upload_folder(source, folder_id)
+                self.log("Copia de seguridad detenida por el usuario; puede reanudarse más tarde")
+                return
+                
+            uploader.flush_copies()
+            
+            if packs is not None:
+                uploader.upload_bytes(packs.to_json(), PACK_INDEX_NAME, folder_id)
+                self.log(f"{len(packs.files)} archivos pequeños subidos en {len(packs.packs)} paquetes")
+            # the manifest travels with the backup so it can be verified from any machine
+            uploader.upload_bytes(manifest.to_json().encode('utf-8'), MANIFEST_NAME, folder_id)
+        finally:
+            if hash_cache is not None:
+                hash_cache.close()
+            journal.close()
+            
+        journal.finish()
+        if incremental:
+            save_cached_manifest(cache_key, manifest)
+        self._catalog_backup(cache_key, manifest, location=folder_id,
+                             extra_bytes=sum(pack['size'] for pack in packs.packs.values()) if packs else 0)
             
         progress_callback(100, "Copia en Google Drive completada")
-        self.log(f"Respaldo en Google Drive completado: {processed} archivos")
+        self.log(f"Respaldo en Google Drive completado: {processed} archivos "
+                 f"({processed - server_copied} subidos, {server_copied} copiados en el servidor sin cambios, "
+                 f"{uploader.api_calls} llamadas a la API)")
         
-    def _backup_to_dropbox(self, sources, config, progress_callback):
+    def _dropbox_client(self, config):
         import dropbox
-        from dropbox.files import WriteMode
         
-        dbx = dropbox.Dropbox(config['token'])
+        if config.get('api_base_url'):
+            return dropbox.Dropbox(config['token'], session=redirect_session(config['api_base_url']))
+        return dropbox.Dropbox(config['token'])
+        
+    def _backup_to_dropbox(self, sources, config, progress_callback):
+        dbx = self._dropbox_client(config)
         
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        base_path = f"{config['folder_path']}/backup_{timestamp}"
+        cache_key = f"dropbox_{config['folder_path']}"
+        journal, backup_name = self._open_journal(cache_key, f"backup_{timestamp}")
+        base_path = f"{config['folder_path']}/{backup_name}"
+        incremental = config.get('mode', 'full') == 'incremental'
         
         self.log(f"Iniciando respaldo en Dropbox: {base_path}")
         
-        total_files = sum(1 for source in sources for _ in Path(source).rglob('*') if _.is_file())
+        scanner = self._scanner(sources)
+        tracker = ProgressTracker(scanner, progress_callback)
         processed = 0
+        server_copied = 0
+        lock = threading.Lock()
+        folders = set()
+        non_empty = set()
+        manifest = BackupManifest(backup_name)
+        hash_cache = HashCache() if incremental else None
+        checksums = {}
         
-        def upload_folder(local_path, dropbox_path):
-            nonlocal processed
+        def on_hashed(item, sha256):
+            checksums[item[0].rel_path] = sha256
             
-            for item in Path(local_path).iterdir():
-                if self.stop_flag:
+        def on_committed(item, error, metadata):
+            nonlocal processed, server_copied
+            
+            entry, copied = item
+            sha256 = checksums.pop(entry.rel_path, None)
+            if error is not None:
+                self.metrics.error()
+                self.log(f"Error subiendo {entry.path.name}: {error}")
+                return
+            if copied and previous is not None:
+                sha256 = (previous.get(entry.rel_path) or {}).get('sha256')
+            manifest.files[entry.rel_path] = {
+                'size': entry.size,
+                'mtime_ns': entry.mtime_ns,
+                'content_hash': metadata.content_hash,
+                'sha256': sha256,
+                'stored_in': backup_name,
+            }
+            journal.file_done(entry, manifest=manifest.files[entry.rel_path])
+            if hash_cache is not None:
+                hash_cache.store(entry, 'dropbox', metadata.content_hash)
+            if copied:
+                self.metrics.skipped(entry.size)
+            else:
+                self.metrics.transferred(entry.size)
+            with lock:
+                processed += 1
+                server_copied += copied
+                count = processed
+            if count % 5 == 0:
+                self.log(f"Subidos {count}/{scanner.files_found} archivos")
+                
+        uploader = DropboxUploader(dbx, chunk_size=config.get('chunk_size', DROPBOX_CHUNK_SIZE), on_committed=on_committed,
+                                   throttle=self._byte_limiter(), on_hashed=on_hashed, metrics=self.metrics)
+        
+        previous = None
+        if incremental:
+            previous = self._load_cloud_manifest(
+                cache_key, backup_name,
+                lambda: uploader.list_backups(config['folder_path'], exclude=backup_name),
+                lambda name: uploader.list_tree(f"{config['folder_path']}/{name}"))
+            if previous:
+                manifest.base = previous.snapshot
+                tracker.expected_bytes = previous.total_bytes()
+                
+        def upload_one(entry):
+            self.throttle.wait_file()
+            if previous is not None:
+                prev = previous.get(entry.rel_path)
+                if (prev and prev['size'] == entry.size and prev.get('content_hash')
+                        and hash_cache.get(entry, 'dropbox') == prev['content_hash']):
+                    uploader.queue_copy((entry, True), f"{config['folder_path']}/{previous.snapshot}/{entry.rel_path}",
+                                        f"{base_path}/{entry.rel_path}")
+                    tracker.add(entry.size)
                     return
-                    
-                item_dropbox_path = f"{dropbox_path}/{item.name}"
-                
-                if item.is_file():
-                    try:
-                        with open(item, 'rb') as f:
-                            dbx.files_upload(
-                                f.read(),
-                                item_dropbox_path,
-                                mode=WriteMode('overwrite')
-                            )
+            uploader.upload((entry, False), entry.path, f"{base_path}/{entry.rel_path}", entry.size, entry.mtime_ns,
+                            session=journal.session(entry),
+                            on_progress=lambda session_id, offset: journal.session_progress(
+                                entry, session_id=session_id, offset=offset))
+            tracker.add(entry.size)
+            
+        packs = None
+        pack_limit = config.get('pack_threshold', DEFAULT_SMALL_FILE_LIMIT)
+        if config.get('pack_small_files'):
+            def upload_pack(name, data, members):
+                nonlocal processed
+                
+                pack_path = f"{base_path}/{PACK_DIR}/{name}"
+                try:
+                    uploader.upload_bytes(data, pack_path)
+                except Exception as e:
+                    self.metrics.error()
+                    self.log(f"Error subiendo el paquete {name} ({len(members)} archivos): {str(e)}")
+                else:
+                    self.metrics.transferred(len(data), files=len(members))
+                    packs.record(name, len(data), pack_path, members)
+                    journal.pack_done(name, len(data), pack_path, members)
+                    with lock:
+                        processed += len(members)
+                    self.log(f"Paquete {name} subido ({len(members)} archivos)")
+                tracker.add(len(data))
+                
+            packs = PackBuilder(lambda name, data, members: pool.submit(name, upload_pack, name, data, members))
+            for name, done in journal.packs.items():
+                packs.restore(name, done['size'], done['location'], done['members'])
+                
+        def on_error(entry, e):
+            self.metrics.error()
+            self.log(f"Error subiendo {entry.path.name}: {str(e)}")
+            tracker.add(entry.size)
+            
+        pool = CopyPool(config.get('workers', DEFAULT_WORKERS), should_stop=lambda: self.stop_flag, on_error=on_error,
+                        on_start=self.throttle.worker_started)
+        
+        self.profiler.phase('transfer')
+        try:
+            with pool:
+                for entry in scanner:
+                    if self.stop_flag:
+                        break
                         
-                        processed += 1
-                        if processed % 5 == 0:
-                            progress_callback(int((processed / max(total_files, 1)) * 100))
-                            self.log(f"Subidos {processed}/{total_files} archivos")
-                    except Exception as e:
-                        self.log(f"Error subiendo {item.name}: {str(e)}")
+                    if entry.is_dir:
+                        if packs is not None:
+                            packs.dirs.append(entry.rel_path)
+                        else:
+                            folders.add(entry.rel_path)
+                    elif journal.completed(entry):
+                        done = journal.files[entry.rel_path]
+                        if 'manifest' in done:
+                            manifest.files[entry.rel_path] = done['manifest']
+                        non_empty.add(entry.rel_path.rpartition('/')[0])
+                        self.metrics.skipped(entry.size)
+                        with lock:
+                            processed += 1
+                        tracker.add(entry.size)
+                    elif packs is not None and entry.size < pack_limit:
+                        self.throttle.wait_file()
+                        packs.add(entry.rel_path, entry)
+                    else:
+                        non_empty.add(entry.rel_path.rpartition('/')[0])
+                        pool.submit(entry, upload_one, entry)
                         
-                elif item.is_dir():
-                    try:
-                        dbx.files_create_folder_v2(item_dropbox_path)
-                    except:
-                        pass
-                    upload_folder(item, item_dropbox_path)
+                if packs is not None and not self.stop_flag:
+                    packs.flush()
                     
-        for source in sources:
+            self.profiler.phase('finalize')
             if self.stop_flag:
-                break
+                self.log("Copia de seguridad detenida por el usuario; puede reanudarse más tarde")
+                return
                 
-            source_path = Path(source)
-            dest_path = f"{base_path}/{source_path.name}"
+            uploader.flush()
             
-            if source_path.is_file():
-                with open(source_path, 'rb') as f:
-                    dbx.files_upload(f.read(), dest_path, mode=WriteMode('overwrite'))
+            if packs is not None:
+                uploader.upload_bytes(packs.to_json(), f"{base_path}/{PACK_INDEX_NAME}")
+                self.log(f"{len(packs.files)} archivos pequeños subidos en {len(packs.packs)} paquetes")
+            uploader.upload_bytes(manifest.to_json().encode('utf-8'), f"{base_path}/{MANIFEST_NAME}")
+        finally:
+            if hash_cache is not None:
+                hash_cache.close()
+            journal.close()
+            
+        # uploads create their parent folders, so only empty folders need an explicit call
+        empty_folders = [f"{base_path}/{rel_path}" for rel_path in folders - non_empty]
+        if empty_folders:
+            try:
+                uploader.create_folders(empty_folders)
+            except Exception as e:
+                self.log(f"Advertencia creando carpetas vacías en Dropbox: {str(e)}")
+                
+        journal.finish()
+        if incremental:
+            save_cached_manifest(cache_key, manifest)
+        self._catalog_backup(cache_key, manifest, location=base_path,
+                             extra_bytes=sum(pack['size'] for pack in packs.packs.values()) if packs else 0)
+            
+        progress_callback(100, "Copia en Dropbox completada")
+        self.log(f"Respaldo en Dropbox completado: {processed} archivos "
+                 f"({processed - server_copied} subidos, {server_copied} copiados en el servidor sin cambios, "
+                 f"{uploader.api_calls} llamadas a la API)")
+        
+    def restore_packed(self, dest_type, config, backup_name, target_dir, rel_paths=None):
+        if dest_type == "gdrive":
+            uploader = DriveUploader(self._gdrive_credentials(config), api_endpoint=config.get('api_endpoint'))
+            folder_id = uploader.list_backups(config['folder_name']).get(backup_name)
+            index_id = uploader.find_file(PACK_INDEX_NAME, folder_id) if folder_id else None
+            if index_id is None:
+                raise FileNotFoundError(f"La copia {backup_name} no contiene archivos empaquetados")
+            index = uploader.download(index_id)
+        elif dest_type == "dropbox":
+            uploader = DropboxUploader(self._dropbox_client(config))
+            index = uploader.download(f"{config['folder_path']}/{backup_name}/{PACK_INDEX_NAME}")
+        else:
+            raise ValueError(f"El destino {dest_type} no usa paquetes")
+            
+        reader = PackReader.from_json(index, uploader.read_range, uploader.download)
+        count = reader.extract_all(target_dir, rel_paths)
+        self.log(f"Restaurados {count} archivos empaquetados de {backup_name}")
+        return count
+        
+    def _load_cloud_manifest(self, cache_key, backup_name, list_backups, list_tree):
+        backups = list_backups()
+        if not backups:
+            self.log("No hay copias anteriores en la nube, se realizará una copia completa")
+            return None
+        latest = backups[-1]
+        
+        cached = load_cached_manifest(cache_key)
+        if cached is not None and cached.snapshot == latest:
+            self.log(f"Copia incremental basada en: {latest} (manifiesto en caché local)")
+            return cached
+            
+        self.log(f"Listando la copia anterior {latest}...")
+        files = list_tree(latest)
+        files.pop(MANIFEST_NAME, None)
+        files.pop(PACK_INDEX_NAME, None)
+        for entry in files.values():
+            entry['stored_in'] = latest
+        self.log(f"Copia incremental basada en: {latest} ({len(files)} archivos listados)")
+        return BackupManifest(latest, files=files)
+        
+    def _backup_to_repository(self, sources, config, progress_callback):
+        repo = ChunkRepository.open_or_init(config['path'])
+        repo.throttle = self._byte_limiter()
+        if config.get('workers'):
+            # compression is CPU work, so more processes than CPUs do not help
+            repo.workers = min(config['workers'], repo.workers)
+        repo.initializer = lower_process_priority if self.throttle.low_priority else None
+        try:
+            self._store_in_repository(repo, sources, progress_callback)
+        finally:
+            repo.close()
+            
+    def _store_in_repository(self, repo, sources, progress_callback):
+        snapshot_name = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        
+        self.log(f"Creando instantánea {snapshot_name} en el repositorio: {repo.path}")
+        
+        parent = repo.latest_snapshot()
+        parent_files = parent['files'] if parent else {}
+        if parent:
+            self.log(f"Instantánea anterior: {parent['name']}")
+        
+        scanner = self._scanner(sources)
+        tracker = ProgressTracker(scanner, progress_callback,
+                                  sum(entry['size'] for entry in parent_files.values()))
+        processed = 0
+        files = {}
+        
+        self.profiler.phase('transfer')
+        for entry in scanner:
+            if self.stop_flag:
+                self.log("Copia de seguridad detenida por el usuario")
+                repo.flush()
+                return
+            if entry.is_dir:
+                continue
+                
+            try:
+                self.throttle.wait_file()
+                with self.metrics.timer('write'):
+                    files[entry.rel_path], stored = repo.store_file(entry, parent_files.get(entry.rel_path))
+                if stored:
+                    self.metrics.transferred(entry.size)
+                else:
+                    self.metrics.skipped(entry.size)
                 processed += 1
-            elif source_path.is_dir():
+                if processed % 10 == 0:
+                    self.log(f"Progreso: {processed} archivos procesados")
+            except Exception as e:
+                self.metrics.error()
+                self.log(f"Error copiando {entry.path}: {str(e)}")
+            tracker.add(entry.size)
+            
+        self.profiler.phase('finalize')
+        repo.save_snapshot(snapshot_name, sources, files)
+        
+        stats = repo.stats
+        progress_callback(100, "Copia en repositorio completada")
+        self.log(f"Respaldo en repositorio completado: {processed} archivos, "
+                 f"{stats['new_chunks']} bloques nuevos ({stats['new_bytes'] / 1048576:.1f} MB), "
+                 f"{stats['duplicate_chunks']} bloques deduplicados, "
+                 f"{stats['stored_bytes'] / 1048576:.1f} MB escritos")
+        
+    def _backup_to_archive(self, sources, config, progress_callback):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_file = Path(config['path']) / f"backup_{timestamp}.dgar"
+        partial_file = archive_file.with_name(archive_file.name + '.partial')
+        archive_file.parent.mkdir(parents=True, exist_ok=True)
+        
+        self.log(f"Creando archivo de respaldo: {archive_file}")
+        
+        writer = ArchiveWriter(partial_file, workers=config.get('workers'), level=config.get('compression_level', 6),
+                               throttle=self._byte_limiter(),
+                               initializer=lower_process_priority if self.throttle.low_priority else None)
+        scanner = self._scanner(sources)
+        tracker = ProgressTracker(scanner, progress_callback)
+        processed = 0
+        
+        self.profiler.phase('transfer')
+        try:
+            for entry in scanner:
+                if self.stop_flag:
+                    break
+                if entry.is_dir:
+                    continue
+                    
                 try:
-                    dbx.files_create_folder_v2(dest_path)
-                except:
+                    self.throttle.wait_file()
+                    with self.metrics.timer('write'):
+                        writer.add_file(entry.path, entry.rel_path, entry.size, entry.mtime_ns)
+                    self.metrics.transferred(entry.size)
+                    processed += 1
+                    if processed % 10 == 0:
+                        self.log(f"Progreso: {processed} archivos procesados")
+                except Exception as e:
+                    self.metrics.error()
+                    self.log(f"Error copiando {entry.path}: {str(e)}")
+                tracker.add(entry.size)
+        except BaseException:
+            writer.abort()
+            raise
+            
+        self.profiler.phase('finalize')
+        if self.stop_flag:
+            writer.abort()
+            self.log("Copia de seguridad detenida por el usuario")
+            return
+            
+        writer.close()
+        os.replace(partial_file, archive_file)
+        
+        stats = writer.stats
+        progress_callback(100, "Archivo de respaldo completado")
+        self.log(f"Archivo de respaldo completado: {processed} archivos, "
+                 f"{stats['bytes_in'] / 1048576:.1f} MB leídos, {stats['bytes_out'] / 1048576:.1f} MB escritos "
+                 f"({stats['stored_files']} archivos ya comprimidos guardados sin recomprimir)")
+        
+    def _catalog_backup(self, dest_key, manifest, location=None, extra_bytes=0):
+        try:
+            catalog = BackupCatalog()
+            try:
+                catalog.record(dest_key, manifest.snapshot, location=location, **manifest_info(manifest, extra_bytes))
+            finally:
+                catalog.close()
+        except Exception as e:
+            self.log(f"Advertencia guardando la copia en el catálogo: {str(e)}")
+            
+    def _catalog_sync(self, dest_key, names, describe=None):
+        catalog = BackupCatalog()
+        try:
+            return catalog.sync(dest_key, names, describe)
+        finally:
+            catalog.close()
+            
+    def _catalog_forget(self, dest_key, names):
+        catalog = BackupCatalog()
+        try:
+            catalog.remove(dest_key, names)
+        finally:
+            catalog.close()
+            
+    def _plan_prune(self, policy, backups, dest_key=None):
+        pending = pending_backup(dest_key) if dest_key else None
+        if pending in backups:
+            self.log(f"{pending} pertenece a una copia interrumpida y se conserva")
+        remove = policy.plan(backups, protected=[pending] if pending else ())
+        if len(remove) == 1:
+            self.log(f"Se eliminará {remove[0]} ({len(backups) - 1} copias conservadas)")
+        elif remove:
+            self.log(f"Se eliminarán {len(remove)} de {len(backups)} copias (de {remove[0]} a {remove[-1]})")
+        else:
+            self.log(f"No hay copias que eliminar ({len(backups)} conservadas)")
+        return remove
+        
+    def prune(self, dest_type, config, retention, dry_run=False):
+        policy = RetentionPolicy.from_config(retention)
+        if not policy.active:
+            return []
+        self.log(f"Aplicando retención: {policy.describe()}")
+        
+        if dest_type == "local":
+            removed = self._prune_local(config, policy, dry_run)
+        elif dest_type == "nas":
+            removed = self._prune_nas(config, policy, dry_run)
+        elif dest_type == "gdrive":
+            removed = self._prune_gdrive(config, policy, dry_run)
+        elif dest_type == "dropbox":
+            removed = self._prune_dropbox(config, policy, dry_run)
+        elif dest_type == "repository":
+            removed = self._prune_repository(config, policy, dry_run)
+        elif dest_type == "archive":
+            removed = self._prune_archive(config, policy, dry_run)
+        else:
+            return []
+            
+        if removed and not dry_run:
+            self.log(f"Retención aplicada: {len(removed)} copias eliminadas")
+        return removed
+        
+    def _empty_trash(self, folders, list_dir, remove_tree, remove_file, remove_dir, workers=None):
+        workers = workers or DEFAULT_WORKERS
+        
+        def on_error(path, e):
+            self.log(f"Error eliminando {path}: {str(e)}")
+            
+        # the trees are split a few levels down so that even a single large backup is
+        # removed by several workers at once
+        expanded = []
+        files = []
+        level = list(folders)
+        for _ in range(TRASH_SPLIT_DEPTH):
+            if len(level) >= workers * 4:
+                break
+            next_level = []
+            for folder in level:
+                try:
+                    children = list_dir(folder)
+                except OSError as e:
+                    on_error(folder, e)
+                    continue
+                expanded.append(folder)
+                for path, is_dir in children:
+                    (next_level if is_dir else files).append(path)
+            level = next_level
+            
+        with CopyPool(workers, on_error=on_error, on_start=self.throttle.worker_started) as pool:
+            for path in level:
+                pool.submit(path, remove_tree, path)
+            for path in files:
+                pool.submit(path, remove_file, path)
+        for folder in reversed(expanded):
+            try:
+                remove_dir(folder)
+            except OSError as e:
+                on_error(folder, e)
+                
+    def _prune_local(self, config, policy, dry_run):
+        dest_path = Path(config['path'])
+        if not dest_path.is_dir():
+            return []
+        dest_key = f"local_{dest_path.resolve()}"
+        names = [p.name for p in dest_path.iterdir() if p.is_dir() and p.name.startswith('backup_')]
+        
+        def describe(name):
+            # backups from before the catalog are read once, from their manifest only
+            try:
+                return manifest_info(BackupManifest.load(dest_path / name))
+            except (OSError, ValueError, KeyError):
+                return None
+                
+        remove = self._plan_prune(policy, self._catalog_sync(dest_key, names, describe), dest_key)
+        if dry_run:
+            return remove
+            
+        trash = dest_path / TRASH_DIR
+        if remove:
+            trash.mkdir(exist_ok=True)
+        removed = []
+        for name in remove:
+            # a rename takes the backup out of sight at once, and hard links into newer
+            # backups keep their data; an interrupted deletion is finished by the next prune
+            try:
+                os.replace(dest_path / name, trash / name)
+                removed.append(name)
+            except OSError as e:
+                self.log(f"Error eliminando {name}: {str(e)}")
+        self._catalog_forget(dest_key, removed)
+        
+        if trash.is_dir():
+            self._empty_trash([p for p in trash.iterdir()],
+                              lambda folder: [(e.path, e.is_dir(follow_symlinks=False)) for e in os.scandir(folder)],
+                              shutil.rmtree, os.remove, os.rmdir, config.get('workers'))
+            try:
+                trash.rmdir()
+            except OSError:
+                pass
+        return removed
+        
+    def _prune_nas(self, config, policy, dry_run):
+        server = config['server']
+        share = config['share']
+        share_path = f"\\\\{server}\\{share}"
+        dest_key = f"nas_{server}_{share}"
+        transfer = NASTransfer(server, config.get('username', 'guest'), config.get('password', ''))
+        
+        def describe(name):
+            try:
+                return manifest_info(BackupManifest.from_json(
+                    transfer.read_file(f"{share_path}\\{name}\\{MANIFEST_NAME}")))
+            except Exception:
+                return None
+                
+        try:
+            names = transfer.list_backups(share_path)
+            remove = self._plan_prune(policy, self._catalog_sync(dest_key, names, describe), dest_key)
+            if dry_run:
+                return remove
+                
+            trash = f"{share_path}\\{TRASH_DIR}"
+            if remove:
+                transfer.makedirs(trash)
+            removed = []
+            for name in remove:
+                try:
+                    transfer.rename(f"{share_path}\\{name}", f"{trash}\\{name}")
+                    removed.append(name)
+                except Exception as e:
+                    self.log(f"Error eliminando {name}: {str(e)}")
+            self._catalog_forget(dest_key, removed)
+            
+            try:
+                folders = [path for path, is_dir in transfer.list_dir(trash) if is_dir]
+            except OSError:
+                folders = None
+            if folders is not None:
+                self._empty_trash(folders, transfer.list_dir, transfer.remove_tree, transfer.remove_file,
+                                  transfer.remove_dir, config.get('workers'))
+                try:
+                    transfer.remove_dir(trash)
+                except OSError:
                     pass
-                upload_folder(source_path, dest_path)
+            return removed
+        finally:
+            transfer.close()
+            
+    def _prune_gdrive(self, config, policy, dry_run):
+        uploader = DriveUploader(self._gdrive_credentials(config), api_endpoint=config.get('api_endpoint'), log=self.log)
+        dest_key = f"gdrive_{config['folder_name']}"
+        folders = uploader.list_backups(config['folder_name'])
+        
+        remove = self._plan_prune(policy, self._catalog_sync(dest_key, folders, lambda name: {'location': folders[name]}),
+                                  dest_key)
+        if dry_run or not remove:
+            return remove
+            
+        failed = uploader.delete_files([folders[name] for name in remove])
+        for file_id, error in failed:
+            self.log(f"Error eliminando la carpeta {file_id} de Google Drive: {error}")
+        failed_ids = {file_id for file_id, _ in failed}
+        removed = [name for name in remove if folders[name] not in failed_ids]
+        self._catalog_forget(dest_key, removed)
+        return removed
+        
+    def _prune_dropbox(self, config, policy, dry_run):
+        uploader = DropboxUploader(self._dropbox_client(config))
+        folder_path = config['folder_path']
+        dest_key = f"dropbox_{folder_path}"
+        names = uploader.list_backups(folder_path)
+        
+        remove = self._plan_prune(
+            policy, self._catalog_sync(dest_key, names, lambda name: {'location': f"{folder_path}/{name}"}), dest_key)
+        if dry_run or not remove:
+            return remove
+            
+        failed = uploader.delete_batch([f"{folder_path}/{name}" for name in remove])
+        for path, error in failed:
+            self.log(f"Error eliminando {path} de Dropbox: {error}")
+        failed_paths = {path for path, _ in failed}
+        removed = [name for name in remove if f"{folder_path}/{name}" not in failed_paths]
+        self._catalog_forget(dest_key, removed)
+        return removed
+        
+    def _prune_repository(self, config, policy, dry_run):
+        if not (Path(config['path']) / 'config.json').exists():
+            return []
+        repo = ChunkRepository(config['path'])
+        if policy.max_total_bytes:
+            self.log("El límite de tamaño no se aplica al repositorio: sus instantáneas comparten los datos")
+        remove = self._plan_prune(policy, {name: {} for name in repo.list_snapshots()})
+        if dry_run or not remove:
+            return remove
+            
+        repo.forget(remove)
+        stats = repo.prune()
+        self.log(f"Repositorio depurado: {stats['deleted_packs']} paquetes eliminados, "
+                 f"{stats['repacked_packs']} reescritos, {stats['freed_bytes'] / 1048576:.1f} MB liberados")
+        return remove
+        
+    def _prune_archive(self, config, policy, dry_run):
+        archive_dir = Path(config['path'])
+        if not archive_dir.is_dir():
+            return []
+        archives = {p.name: {'stored_bytes': p.stat().st_size} for p in archive_dir.glob('backup_*.dgar')}
+        remove = self._plan_prune(policy, archives)
+        if dry_run:
+            return remove
+            
+        removed = []
+        for name in remove:
+            try:
+                (archive_dir / name).unlink()
+                removed.append(name)
+            except OSError as e:
+                self.log(f"Error eliminando {name}: {str(e)}")
+        return removed
+        
+    def verify(self, dest_type, config, backup_name=None, sample=None):
+        # re-hashes the stored copies against the checksums recorded during the backup;
+        # sample (e.g. 0.01) checks only that fraction, continuing where the last run stopped
+        self.stop_flag = False
+        targets = {
+            "local": self._verify_local,
+            "nas": self._verify_nas,
+            "gdrive": self._verify_gdrive,
+            "dropbox": self._verify_dropbox,
+            "repository": self._verify_repository,
+            "archive": self._verify_archive,
+        }
+        if dest_type not in targets:
+            return None
+        target = targets[dest_type](config, backup_name)
+        if target is None:
+            self.log("No se encontró ninguna copia con checksums que verificar")
+            return None
+        dest_key, name, expected, compute, close = target
+        
+        try:
+            total = len(expected)
+            position = None
+            if sample and sample < 1:
+                catalog = BackupCatalog()
+                try:
+                    selected, position = select_sample(expected, sample, catalog.verify_position(dest_key))
+                finally:
+                    catalog.close()
+                expected = {rel_path: expected[rel_path] for rel_path in selected}
+                self.log(f"Verificando {len(expected)} de {total} archivos de {name} (muestra del {sample * 100:g}%)")
+            else:
+                self.log(f"Verificando los {total} archivos de {name}")
                 
-        progress_callback(100, "Copia en Dropbox completada")
-        self.log(f"Respaldo en Dropbox completado: {processed} archivos")
+            verifier = Verifier(config.get('workers', DEFAULT_WORKERS), should_stop=lambda: self.stop_flag, log=self.log)
+            stats, problems = verifier.run(expected, compute)
+        finally:
+            close()
+            
+        if self.stop_flag:
+            self.log(f"Verificación detenida por el usuario ({stats['checked']} archivos comprobados)")
+            return stats
+        if position is not None:
+            # the next sampled run picks up the following slice of the backup
+            catalog = BackupCatalog()
+            try:
+                catalog.set_verify_position(dest_key, position)
+            finally:
+                catalog.close()
+                
+        self.log(f"Verificación de {name} completada: {stats['ok']} correctos, {stats['mismatched']} con checksum "
+                 f"distinto, {stats['missing']} ausentes, {stats['errors']} con errores")
+        if stats['unverifiable']:
+            self.log(f"{stats['unverifiable']} archivos no tienen checksum registrado y no se pudieron verificar")
+        if problems:
+            self.log(f"La copia {name} tiene {len(problems)} archivos dañados o ausentes")
+        return stats
+        
+    def _verify_local(self, config, backup_name):
+        dest_path = Path(config['path'])
+        dest_key = f"local_{dest_path.resolve()}"
+        if backup_name is None:
+            # a backup that was interrupted is still incomplete
+            manifest = find_latest_manifest(dest_path, exclude=pending_backup(dest_key))
+        else:
+            manifest = BackupManifest.load(dest_path / backup_name)
+        if manifest is None:
+            return None
+        expected = {rel_path: entry.get('sha256') for rel_path, entry in manifest.files.items()}
+        return (dest_key, manifest.snapshot, expected,
+                lambda rel_path: hash_local_file(manifest.locate(dest_path, rel_path)), lambda: None)
+                
+    def _verify_nas(self, config, backup_name):
+        server = config['server']
+        share = config['share']
+        share_path = f"\\\\{server}\\{share}"
+        dest_key = f"nas_{server}_{share}"
+        transfer = NASTransfer(server, config.get('username', 'guest'), config.get('password', ''))
+        transfer.connect()
+        
+        if backup_name is not None:
+            names = [backup_name]
+        else:
+            pending = pending_backup(dest_key)
+            names = [name for name in reversed(transfer.list_backups(share_path)) if name != pending]
+        manifest = None
+        for name in names:
+            try:
+                manifest = BackupManifest.from_json(transfer.read_file(f"{share_path}\\{name}\\{MANIFEST_NAME}"))
+                break
+            except Exception:
+                continue
+        if manifest is None:
+            transfer.close()
+            return None
+            
+        def compute(rel_path):
+            entry = manifest.files[rel_path]
+            path = f"{share_path}\\{entry.get('stored_in', manifest.snapshot)}\\{rel_path}"
+            return transfer.hash_file(path.replace('/', '\\'))
+            
+        expected = {rel_path: entry.get('sha256') for rel_path, entry in manifest.files.items()}
+        return dest_key, manifest.snapshot, expected, compute, transfer.close
+        
+    def _packed_compute(self, index, fetch, expected, compute):
+        # files inside packs are checked against the checksums kept in the pack index
+        reader = PackReader.from_json(index, fetch)
+        expected.update((rel_path, member.get('sha256')) for rel_path, member in reader.files.items())
+        
+        def compute_packed(rel_path):
+            if rel_path in reader.files:
+                return hashlib.sha256(reader.read(rel_path)).hexdigest()
+            return compute(rel_path)
+            
+        return compute_packed
+        
+    def _verify_gdrive(self, config, backup_name):
+        uploader = DriveUploader(self._gdrive_credentials(config), api_endpoint=config.get('api_endpoint'), log=self.log)
+        dest_key = f"gdrive_{config['folder_name']}"
+        folders = uploader.list_backups(config['folder_name'])
+        if backup_name is None:
+            pending = pending_backup(dest_key)
+            names = sorted((name for name in folders if name != pending), reverse=True)
+            backup_name = names[0] if names else None
+        if backup_name not in folders:
+            return None
+        folder_id = folders[backup_name]
+        
+        manifest_id = uploader.find_file(MANIFEST_NAME, folder_id)
+        if manifest_id is None:
+            self.log(f"La copia {backup_name} es anterior a los checksums y no se puede verificar")
+            return None
+        manifest = BackupManifest.from_json(uploader.download(manifest_id))
+        expected = {rel_path: entry.get('sha256') for rel_path, entry in manifest.files.items()}
+        
+        def compute(rel_path):
+            return uploader.hash_file(manifest.files[rel_path]['id'])
+            
+        index_id = uploader.find_file(PACK_INDEX_NAME, folder_id)
+        if index_id is not None:
+            compute = self._packed_compute(uploader.download(index_id), uploader.read_range, expected, compute)
+        return dest_key, backup_name, expected, compute, lambda: None
+        
+    def _verify_dropbox(self, config, backup_name):
+        uploader = DropboxUploader(self._dropbox_client(config))
+        folder_path = config['folder_path']
+        dest_key = f"dropbox_{folder_path}"
+        if backup_name is None:
+            pending = pending_backup(dest_key)
+            names = [name for name in uploader.list_backups(folder_path) if name != pending]
+            backup_name = names[-1] if names else None
+        if backup_name is None:
+            return None
+        base_path = f"{folder_path}/{backup_name}"
+        
+        try:
+            manifest = BackupManifest.from_json(uploader.download(f"{base_path}/{MANIFEST_NAME}"))
+        except Exception:
+            self.log(f"La copia {backup_name} es anterior a los checksums y no se puede verificar")
+            return None
+        expected = {rel_path: entry.get('sha256') for rel_path, entry in manifest.files.items()}
+        
+        def compute(rel_path):
+            return uploader.hash_file(f"{base_path}/{rel_path}")
+            
+        try:
+            index = uploader.download(f"{base_path}/{PACK_INDEX_NAME}")
+        except Exception:
+            index = None
+        if index is not None:
+            compute = self._packed_compute(index, uploader.read_range, expected, compute)
+        return dest_key, backup_name, expected, compute, lambda: None
+        
+    def _verify_repository(self, config, backup_name):
+        if not (Path(config['path']) / 'config.json').exists():
+            return None
+        repo = ChunkRepository(config['path'])
+        snapshot = repo.load_snapshot(backup_name) if backup_name else repo.latest_snapshot()
+        if snapshot is None:
+            return None
+        files = snapshot['files']
+        expected = {rel_path: entry.get('sha256') for rel_path, entry in files.items()}
+        return (f"repository_{Path(config['path']).resolve()}", snapshot['name'], expected,
+                lambda rel_path: hash_chunks(repo.read_chunk(chunk_id) for chunk_id in files[rel_path]['chunks']),
+                lambda: None)
+                
+    def _verify_archive(self, config, backup_name):
+        archive_dir = Path(config['path'])
+        if backup_name is None:
+            archives = sorted(archive_dir.glob('backup_*.dgar')) if archive_dir.is_dir() else []
+            if not archives:
+                return None
+            archive_file = archives[-1]
+        else:
+            archive_file = archive_dir / backup_name
+        reader = ArchiveReader(archive_file)
+        expected = {rel_path: entry.get('sha256') for rel_path, entry in reader.files.items()}
+        return (f"archive_{archive_dir.resolve()}", archive_file.name, expected,
+                lambda rel_path: hash_chunks(reader.iter_data(rel_path)), lambda: None)
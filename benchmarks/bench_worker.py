@@ -0,0 +1,64 @@
+# Runs one backup for run_benchmarks.py in its own process, so the peak memory and the
+# local caches (hash cache, manifests, journal, catalog in the working directory) belong
+# to that run alone. Usage: python -m benchmarks.bench_worker spec.json result.json
+import time
+
+# before the application modules are imported, as in cli.py, so the time to the first
+# copy includes loading them
+STARTED = time.perf_counter()
+
+import json
+import resource
+import sys
+from pathlib import Path
+
+from backup_manager import BackupManager
+
+
+def _peak_rss_bytes():
+    # on Linux ru_maxrss survives exec, so a child reports at least the size of the
+    # process that started it; the high-water mark of this process's own memory is in
+    # /proc instead
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run(spec):
+    errors = 0
+    with open('benchmark.log', 'a', encoding='utf-8') as log_file:
+        def log(message):
+            nonlocal errors
+            if message.startswith('Error') or message.startswith('Advertencia'):
+                errors += 1
+            log_file.write(message + '\n')
+
+        manager = BackupManager(log)
+        log(f"--- {spec['backend']} ({spec['phase']}) ---")
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        manager.backup([spec['source']], spec['backend'], spec['dest_config'], lambda *args: None,
+                       profiling=spec.get('profiling'))
+        seconds = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+
+    first_file_at = manager.metrics.first_file_at
+    return {'seconds': seconds, 'cpu_seconds': cpu_seconds, 'peak_rss_bytes': _peak_rss_bytes(), 'errors': errors,
+            'first_copy_seconds': first_file_at - STARTED if first_file_at is not None else None}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    spec = json.loads(Path(argv[0]).read_text(encoding='utf-8'))
+    Path(argv[1]).write_text(json.dumps(run(spec)), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
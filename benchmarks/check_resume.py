@@ -0,0 +1,127 @@
+# Checks that an interrupted pack-mode backup (Drive, Dropbox) can be resumed: packs
+# built by a real PackBuilder are journaled, the journal is loaded again as a resume
+# would, and the files and packs it hands back must match what was stored, checksums
+# included. Journals from before the checksums were kept must still load. Exits with 1
+# on any failure.
+#
+#   python -m benchmarks.check_resume
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from pack_store import PackBuilder
+from run_journal import RunJournal
+from scanner import ScanEntry
+
+FAILURES = []
+
+
+def _expect(label, actual, expected):
+    if actual == expected:
+        print(f"  ok    {label}")
+    else:
+        FAILURES.append(label)
+        print(f"  FALLO {label}\n        obtenido: {actual}\n        esperado: {expected}")
+
+
+def _entry(path):
+    st = path.stat()
+    return ScanEntry(path, path.name, False, st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+def _resumed(key):
+    journal = RunJournal(key)
+    try:
+        journal.open('backup_nuevo', resume=True)
+    except ValueError as e:
+        return journal, e
+    journal.close()
+    return journal, None
+
+
+def check_pack_resume(work_dir):
+    print("Reanudar una copia con paquetes")
+    source = work_dir / 'origen'
+    source.mkdir()
+    contents = {f"f{i}.txt": f"archivo pequeño {i}\n".encode('utf-8') * (i + 1) for i in range(5)}
+    for name, data in contents.items():
+        (source / name).write_bytes(data)
+
+    journal = RunJournal('gdrive_paquetes')
+    journal.open('Copias_20240101_020000')
+
+    def on_pack(name, data, members):
+        # as the upload workers do once a pack is stored
+        builder.record(name, len(data), f"id-{name}", members)
+        journal.pack_done(name, len(data), f"id-{name}", members)
+
+    builder = PackBuilder(on_pack, pack_size=64)
+    for name in sorted(contents):
+        builder.add(f"origen/{name}", _entry(source / name))
+    builder.flush()
+    # the run dies here: the journal has the packs, the pack index was never uploaded
+    journal.close()
+
+    resumed, error = _resumed('gdrive_paquetes')
+    _expect("el diario se carga sin errores", repr(error) if error else None, None)
+    _expect("se continúa la copia interrumpida", (resumed.resumed, resumed.backup_name),
+            (True, 'Copias_20240101_020000'))
+    _expect("todos los archivos empaquetados cuentan como completados",
+            sorted(resumed.files), sorted(f"origen/{name}" for name in contents))
+    _expect("cada archivo conserva su suma sha256",
+            {rel: record.get('sha256') for rel, record in resumed.files.items()},
+            {f"origen/{name}": hashlib.sha256(data).hexdigest() for name, data in contents.items()})
+    entry = _entry(source / 'f0.txt')
+    _expect("un archivo sin cambios no se vuelve a subir", resumed.completed(entry, key='origen/f0.txt') is not None,
+            True)
+
+    restored = PackBuilder(lambda *args: None)
+    for name, done in resumed.packs.items():
+        restored.restore(name, done['size'], done['location'], done['members'])
+    _expect("el índice de paquetes reconstruido coincide con el original",
+            (restored.packs, restored.files, restored.pack_count), (builder.packs, builder.files, builder.pack_count))
+    resumed.finish()
+
+
+def check_old_journal():
+    print("Diario anterior a las sumas de comprobación")
+    journal = RunJournal('gdrive_antiguo')
+    journal.open('Copias_20240101_020000')
+    journal.close()
+    # four fields per member, as journals were written before
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'type': 'pack', 'name': 'pack_00001.dgp', 'size': 3, 'location': 'id-1',
+                            'members': [['origen/a.txt', 0, 3, 1]]}) + '\n')
+    resumed, error = _resumed('gdrive_antiguo')
+    _expect("el diario antiguo se carga sin errores", repr(error) if error else None, None)
+    _expect("los archivos antiguos quedan sin suma",
+            resumed.files.get('origen/a.txt'),
+            {'rel': 'origen/a.txt', 'size': 3, 'mtime_ns': 1, 'pack': 'pack_00001.dgp', 'sha256': None})
+    resumed.finish()
+
+
+def main(argv=None):
+    # the journal lives in the working directory, as in bench_worker
+    previous_cwd = os.getcwd()
+    work_dir = Path(tempfile.mkdtemp(prefix='diskguardian_resume_'))
+    try:
+        os.chdir(work_dir)
+        check_pack_resume(work_dir)
+        check_old_journal()
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if FAILURES:
+        print(f"\n{len(FAILURES)} comprobaciones fallidas")
+        return 1
+    print("\nTodas las comprobaciones de reanudación son correctas")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
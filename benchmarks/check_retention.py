@@ -0,0 +1,221 @@
+# Checks that retention only deletes what it should: the keep_daily/weekly/monthly
+# periods, the bases incremental backups still read from, the backup an interrupted run
+# left behind and the max-size cutoff, first on hand-written catalogs and then by pruning
+# real hardlink and incremental backups in a temporary folder. Exits with 1 on any failure.
+#
+#   python -m benchmarks.check_retention
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from retention import RetentionPolicy
+
+FAILURES = []
+
+
+def _expect(label, actual, expected):
+    if actual == expected:
+        print(f"  ok    {label}")
+    else:
+        FAILURES.append(label)
+        print(f"  FALLO {label}\n        obtenido: {actual}\n        esperado: {expected}")
+
+
+def _catalog(*specs):
+    # (timestamp, stored_bytes, depends_on) -> the dict the catalog hands to plan()
+    return {f"backup_{when}": {'stored_bytes': size, 'total_bytes': size,
+                               'depends_on': [f"backup_{base}" for base in bases]}
+            for when, size, bases in specs}
+
+
+def _names(*stamps):
+    return [f"backup_{when}" for when in stamps]
+
+
+def check_periods():
+    print("Periodos diarios, semanales y mensuales")
+    backups = _catalog(
+        ('20240331_140000', 1, ()),   # domingo, semana ISO 13
+        ('20240331_020000', 1, ()),
+        ('20240330_020000', 1, ()),
+        ('20240329_020000', 1, ()),
+        ('20240324_020000', 1, ()),   # semana 12
+        ('20240317_020000', 1, ()),   # semana 11
+        ('20240229_020000', 1, ()),
+        ('20240210_020000', 1, ()),
+        ('20240131_020000', 1, ()),
+        ('20231231_020000', 1, ()),
+    )
+    _expect("keep_daily=3 conserva la última copia de cada uno de los 3 últimos días",
+            RetentionPolicy(keep_daily=3).plan(backups),
+            _names('20231231_020000', '20240131_020000', '20240210_020000', '20240229_020000',
+                   '20240317_020000', '20240324_020000', '20240331_020000'))
+    _expect("keep_weekly=2 conserva la última copia de cada una de las 2 últimas semanas ISO",
+            RetentionPolicy(keep_weekly=2).plan(backups),
+            _names('20231231_020000', '20240131_020000', '20240210_020000', '20240229_020000',
+                   '20240317_020000', '20240329_020000', '20240330_020000', '20240331_020000'))
+    _expect("keep_monthly=3 conserva la última copia de cada uno de los 3 últimos meses",
+            RetentionPolicy(keep_monthly=3).plan(backups),
+            _names('20231231_020000', '20240210_020000', '20240317_020000', '20240324_020000',
+                   '20240329_020000', '20240330_020000', '20240331_020000'))
+    _expect("los periodos se suman",
+            RetentionPolicy(keep_daily=3, keep_weekly=2, keep_monthly=3).plan(backups),
+            _names('20231231_020000', '20240210_020000', '20240317_020000', '20240331_020000'))
+    _expect("keep_last=2 conserva las 2 más recientes",
+            RetentionPolicy(keep_last=2).plan(backups)[-2:], _names('20240329_020000', '20240330_020000'))
+    backups['backup_manual'] = {'stored_bytes': 1, 'depends_on': []}
+    _expect("una copia sin fecha en el nombre no se elimina nunca",
+            'backup_manual' in RetentionPolicy(keep_last=1).plan(backups), False)
+
+
+def check_bases():
+    print("Bases de las copias incrementales")
+    backups = _catalog(
+        ('20240104_020000', 5, ('20240103_020000', '20240101_020000')),
+        ('20240103_020000', 5, ('20240101_020000',)),
+        ('20240102_020000', 5, ()),
+        ('20240101_020000', 50, ()),
+        ('20231231_020000', 50, ()),
+    )
+    _expect("la cadena de la copia conservada se mantiene entera",
+            RetentionPolicy(keep_last=1).plan(backups), _names('20231231_020000', '20240102_020000'))
+    backups['backup_20240105_020000'] = {'stored_bytes': 5, 'depends_on': ['backup_20240104_020000']}
+    _expect("las dependencias se siguen de forma transitiva",
+            RetentionPolicy(keep_last=1).plan(backups), _names('20231231_020000', '20240102_020000'))
+    backups['backup_20240105_020000']['depends_on'].append('backup_20231201_020000')
+    _expect("una base que ya no existe no impide aplicar la retención",
+            RetentionPolicy(keep_last=1).plan(backups), _names('20231231_020000', '20240102_020000'))
+
+
+def check_pending():
+    print("Copia interrumpida")
+    backups = _catalog(
+        ('20240104_020000', 1, ()),
+        ('20240103_020000', 1, ('20240101_020000',)),
+        ('20240102_020000', 1, ()),
+        ('20240101_020000', 1, ()),
+    )
+    _expect("la copia pendiente y su base se conservan",
+            RetentionPolicy(keep_last=1).plan(backups, protected=['backup_20240103_020000']),
+            _names('20240102_020000'))
+    _expect("el límite de tamaño tampoco elimina la copia pendiente",
+            RetentionPolicy(max_total_bytes=1).plan(backups, protected=['backup_20240102_020000']),
+            _names('20240101_020000', '20240103_020000'))
+    _expect("una copia pendiente que no está en el destino no cambia nada",
+            RetentionPolicy(keep_last=1).plan(backups, protected=['backup_20240201_020000']),
+            _names('20240101_020000', '20240102_020000', '20240103_020000'))
+
+
+def check_max_size():
+    print("Límite de tamaño")
+    backups = _catalog(*((f"202401{day:02d}_020000", 10, ()) for day in range(1, 6)))
+    _expect("se eliminan las más antiguas hasta quedar por debajo del límite",
+            RetentionPolicy(max_total_bytes=25).plan(backups),
+            _names('20240101_020000', '20240102_020000', '20240103_020000'))
+    _expect("un límite exacto no elimina de más",
+            RetentionPolicy(max_total_bytes=30).plan(backups), _names('20240101_020000', '20240102_020000'))
+    _expect("la copia más reciente se conserva aunque supere el límite sola",
+            RetentionPolicy(max_total_bytes=5).plan(backups)[-1], 'backup_20240104_020000')
+    _expect("el límite se aplica después de los recuentos",
+            RetentionPolicy(keep_last=4, max_total_bytes=25).plan(backups),
+            _names('20240101_020000', '20240102_020000', '20240103_020000'))
+    backups = _catalog(
+        ('20240104_020000', 10, ('20240101_020000',)),
+        ('20240103_020000', 10, ()),
+        ('20240102_020000', 10, ()),
+        ('20240101_020000', 100, ()),
+    )
+    _expect("la base de una copia conservada no se elimina para liberar espacio",
+            RetentionPolicy(max_total_bytes=50).plan(backups), _names('20240102_020000', '20240103_020000'))
+    backups['backup_20240104_020000']['stored_bytes'] = None
+    _expect("sin stored_bytes se cuenta el tamaño total",
+            RetentionPolicy(max_total_bytes=115).plan(backups), _names('20240102_020000', '20240103_020000'))
+
+
+def _backup(manager, source, dest, mode):
+    # backup names carry the second they started, so two runs need a second between them
+    time.sleep(1.1)
+    manager.backup([str(source)], 'local', {'path': str(dest), 'mode': mode}, lambda *args: None)
+
+
+def _restores(dest, name, source):
+    # every file the backup lists can still be read, with the content it had at the time
+    from manifest import BackupManifest
+    manifest = BackupManifest.load(dest / name)
+    for rel_path, entry in manifest.files.items():
+        path = manifest.locate(dest, rel_path)
+        if path is None or not path.is_file() or path.stat().st_size != entry['size']:
+            return f"{rel_path} no está en {path}"
+        if path.read_bytes() != source.get(rel_path, path.read_bytes()):
+            return f"{rel_path} ha cambiado"
+    return True
+
+
+def check_local(work_dir):
+    print("Copias locales reales (enlaces duros, enlaces duros, incremental)")
+    from backup_manager import BackupManager
+    from run_journal import RunJournal
+
+    source = work_dir / 'origen'
+    dest = work_dir / 'destino'
+    (source / 'sub').mkdir(parents=True)
+    (source / 'fijo.txt').write_bytes(b'igual en todas las copias\n')
+    (source / 'sub' / 'cambia.txt').write_bytes(b'primera version\n')
+    messages = []
+    manager = BackupManager(messages.append)
+
+    _backup(manager, source, dest, 'hardlink')
+    _backup(manager, source, dest, 'hardlink')
+    (source / 'sub' / 'cambia.txt').write_bytes(b'segunda version, mas larga\n')
+    _backup(manager, source, dest, 'incremental')
+    names = sorted(p.name for p in dest.iterdir() if p.name.startswith('backup_'))
+    if len(names) != 3:
+        _expect("se crean tres copias", names, ['3 copias'])
+        return
+    newest = {f"{source.name}/fijo.txt": (source / 'fijo.txt').read_bytes(),
+              f"{source.name}/sub/cambia.txt": (source / 'sub' / 'cambia.txt').read_bytes()}
+
+    # an interrupted run that was writing into the oldest backup
+    journal = RunJournal(f"local_{dest.resolve()}")
+    journal.open(names[0])
+    journal.close()
+    removed = manager.prune('local', {'path': str(dest)}, {'keep_last': 1})
+    _expect("la copia interrumpida se conserva", (removed, (dest / names[0]).is_dir()), ([], True))
+
+    journal.finish()
+    removed = manager.prune('local', {'path': str(dest)}, {'keep_last': 1})
+    _expect("sin copia interrumpida se elimina la más antigua que nadie usa", removed, [names[0]])
+    _expect("la incremental conserva su base",
+            sorted(p.name for p in dest.iterdir()), [names[1], names[2]])
+    _expect("la copia conservada se puede restaurar entera", _restores(dest, names[2], newest), True)
+    errors = [message for message in messages if message.startswith('Error')]
+    _expect("sin errores en el registro", errors, [])
+
+
+def main(argv=None):
+    check_periods()
+    check_bases()
+    check_pending()
+    check_max_size()
+    # the catalog, journal and caches live in the working directory, as in bench_worker
+    previous_cwd = os.getcwd()
+    work_dir = Path(tempfile.mkdtemp(prefix='diskguardian_retention_'))
+    try:
+        os.chdir(work_dir)
+        check_local(work_dir)
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if FAILURES:
+        print(f"\n{len(FAILURES)} comprobaciones fallidas")
+        return 1
+    print("\nTodas las comprobaciones de retención son correctas")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
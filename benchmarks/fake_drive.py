@@ -0,0 +1,320 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.fake_server import FakeServer
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+PAGE_SIZE = 1000
+# a quoted string of the q parameter, where \\ and \' stand for a backslash and a quote
+LITERAL = r"'((?:[^'\\]|\\.)*)'"
+
+
+def _unquote(text):
+    return re.sub(r"\\(.)", r"\1", text)
+
+
+def _query_clauses(q):
+    # the clauses joined by 'and'; the quoted strings are set aside first, since a name
+    # may contain ' and ' too
+    literals = []
+
+    def hide(match):
+        literals.append(match.group(0))
+        return f"\0{len(literals) - 1}\0"
+
+    hidden = re.sub(LITERAL, hide, q)
+    return [re.sub(r"\0(\d+)\0", lambda match: literals[int(match.group(1))], clause).strip()
+            for clause in hidden.split(' and ') if clause.strip()]
+
+
+def _split_head(data):
+    # headers and body of a MIME part or HTTP message, whichever line ending it uses
+    found = [(data.find(separator), separator) for separator in (b'\r\n\r\n', b'\n\n') if separator in data]
+    if not found:
+        return data, b''
+    index, separator = min(found)
+    return data[:index], data[index + len(separator):]
+
+
+def _parse_headers(head):
+    # long values (Content-ID in batches) are folded over several lines
+    headers = {}
+    name = None
+    for line in head.decode('utf-8').splitlines():
+        if line[:1] in (' ', '\t') and name is not None:
+            headers[name] += ' ' + line.strip()
+            continue
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        headers[name] = value.strip()
+    return headers
+
+
+def _split_multipart(content_type, body):
+    # parts of a multipart body as (headers, content); the payloads are binary, so no
+    # email parser: it could touch the line endings inside them
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode('ascii')
+    parts = []
+    for chunk in body.split(b'--' + boundary)[1:]:
+        if chunk.startswith(b'--'):
+            break
+        chunk = chunk[2:] if chunk.startswith(b'\r\n') else chunk[1:]
+        if chunk.endswith(b'\r\n'):
+            chunk = chunk[:-2]
+        elif chunk.endswith(b'\n'):
+            chunk = chunk[:-1]
+        head, content = _split_head(chunk)
+        parts.append((_parse_headers(head), content))
+    return parts
+
+
+class FakeDrive(FakeServer):
+    # the part of Drive v3 the DriveUploader uses: generated ids, folder and file
+    # creation (multipart and resumable uploads), listing with the queries the
+    # uploader sends, media downloads with ranges, copies, deletes and batches.
+    # Point dest_config['api_endpoint'] at url + '/drive/v3/'.
+    def __init__(self, latency_ms=0, storage=None):
+        super().__init__(latency_ms, storage)
+        self.files = {'root': {'id': 'root', 'name': 'root', 'mimeType': FOLDER_MIME, 'parents': []}}
+        # listing a folder must not scan every file, or large trees slow down the fake itself
+        self.children = {}
+        self.sessions = {}
+
+    def _add(self, meta):
+        with self.lock:
+            self.files[meta['id']] = meta
+            for parent in meta['parents']:
+                self.children.setdefault(parent, set()).add(meta['id'])
+
+    def _new_id(self):
+        return uuid.uuid4().hex
+
+    def _blob(self, file_id):
+        return self.storage / file_id
+
+    def _resource(self, meta):
+        resource = {'kind': 'drive#file', 'id': meta['id'], 'name': meta['name'], 'mimeType': meta['mimeType'],
+                    'parents': meta['parents']}
+        if meta['mimeType'] != FOLDER_MIME:
+            resource['size'] = str(meta.get('size', 0))
+            resource['md5Checksum'] = meta.get('md5Checksum')
+        return resource
+
+    def _store(self, metadata, path=None, data=None):
+        file_id = metadata.get('id') or self._new_id()
+        meta = {'id': file_id, 'name': metadata.get('name', 'Untitled'),
+                'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+                'parents': metadata.get('parents') or ['root']}
+        if meta['mimeType'] != FOLDER_MIME:
+            blob = self._blob(file_id)
+            if path is not None:
+                os.replace(path, blob)
+            else:
+                blob.write_bytes(data or b'')
+            digest = hashlib.md5()
+            with open(blob, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            meta['size'] = blob.stat().st_size
+            meta['md5Checksum'] = digest.hexdigest()
+        self._add(meta)
+        return self._resource(meta)
+
+    def handle(self, handler):
+        url = urlsplit(handler.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        path = url.path
+        if path.startswith('/batch/'):
+            self._batch(handler)
+        elif path.startswith('/upload/drive/v3/files'):
+            self._upload(handler, path, query)
+        elif path.startswith('/drive/v3/'):
+            status, body, headers = self._api(handler.command, path[len('/drive/v3/'):], query, handler.data,
+                                              handler.headers.get('Content-Type', ''))
+            if isinstance(body, os.PathLike):
+                handler.reply_file(body)
+            else:
+                handler.reply(status, body, headers=headers)
+        else:
+            handler.reply(404, {'error': {'code': 404, 'message': 'Not Found'}})
+
+    def _api(self, method, path, query, data, content_type):
+        # returns (status, body, headers); a Path body is a file to send
+        if path == 'files/generateIds':
+            self.count('generate_ids')
+            count = int(query.get('count', 10))
+            return 200, {'kind': 'drive#generatedIds', 'space': 'drive',
+                         'ids': [self._new_id() for _ in range(count)]}, None
+        if path == 'files' and method == 'POST':
+            self.count('create')
+            return 200, self._store(json.loads(data or b'{}')), None
+        if path == 'files' and method == 'GET':
+            self.count('list')
+            return 200, self._list(query), None
+
+        match = re.fullmatch(r'files/([^/]+)(/copy)?', path)
+        if match is None:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}, None
+        file_id, copy = match.groups()
+        with self.lock:
+            meta = self.files.get(file_id)
+        if meta is None:
+            self.count('not_found')
+            return 404, {'error': {'code': 404, 'message': f'File not found: {file_id}.'}}, None
+        if copy:
+            self.count('copy')
+            body = json.loads(data or b'{}')
+            new_id = self._new_id()
+            # a copy on the server costs no transfer: share the blob
+            try:
+                os.link(self._blob(file_id), self._blob(new_id))
+            except OSError:
+                shutil.copyfile(self._blob(file_id), self._blob(new_id))
+            new_meta = dict(meta, id=new_id, name=body.get('name', meta['name']),
+                            parents=body.get('parents') or meta['parents'])
+            self._add(new_meta)
+            return 200, self._resource(new_meta), None
+        if method == 'DELETE':
+            self.count('delete')
+            self._delete(file_id)
+            return 204, b'', None
+        if query.get('alt') == 'media':
+            self.count('download')
+            return 200, self._blob(file_id), None
+        self.count('get')
+        return 200, self._resource(meta), None
+
+    def _delete(self, file_id):
+        with self.lock:
+            pending = [file_id]
+            while pending:
+                current = pending.pop()
+                meta = self.files.pop(current, None)
+                if meta is None:
+                    continue
+                for parent in meta['parents']:
+                    self.children.get(parent, set()).discard(current)
+                pending.extend(self.children.pop(current, ()))
+                if meta['mimeType'] != FOLDER_MIME:
+                    self._blob(current).unlink(missing_ok=True)
+
+    def _list(self, query):
+        clauses = _query_clauses(query.get('q', ''))
+        parents = [re.fullmatch(rf"{LITERAL} in parents", clause) for clause in clauses]
+        parents = [_unquote(match.group(1)) for match in parents if match]
+        with self.lock:
+            if parents:
+                candidates = [self.files[file_id] for file_id in self.children.get(parents[0], ())]
+            else:
+                candidates = list(self.files.values())
+        matches = sorted(candidates, key=lambda meta: (meta['name'], meta['id']))
+        for clause in clauses:
+            if clause == 'trashed = false':
+                continue
+            parent = re.fullmatch(rf"{LITERAL} in parents", clause)
+            name_is = re.fullmatch(rf"name = {LITERAL}", clause)
+            name_has = re.fullmatch(rf"name contains {LITERAL}", clause)
+            mime = re.fullmatch(rf"mimeType = {LITERAL}", clause)
+            if parent:
+                matches = [meta for meta in matches if _unquote(parent.group(1)) in meta['parents']]
+            elif name_is:
+                matches = [meta for meta in matches if meta['name'] == _unquote(name_is.group(1))]
+            elif name_has:
+                matches = [meta for meta in matches if _unquote(name_has.group(1)) in meta['name']]
+            elif mime:
+                matches = [meta for meta in matches if meta['mimeType'] == _unquote(mime.group(1))]
+            else:
+                raise ValueError(f"consulta no soportada: {clause}")
+        start = int(query.get('pageToken') or 0)
+        size = min(int(query.get('pageSize') or 100), PAGE_SIZE)
+        result = {'kind': 'drive#fileList', 'files': [self._resource(meta) for meta in matches[start:start + size]]}
+        if start + size < len(matches):
+            result['nextPageToken'] = str(start + size)
+        return result
+
+    def _upload(self, handler, path, query):
+        upload_type = query.get('uploadType')
+        if handler.command == 'POST' and upload_type == 'multipart':
+            self.count('upload_multipart')
+            parts = _split_multipart(handler.headers['Content-Type'], handler.data)
+            metadata = json.loads(parts[0][1] or b'{}')
+            handler.reply(200, self._store(metadata, data=parts[1][1] if len(parts) > 1 else b''))
+        elif handler.command == 'POST' and upload_type == 'media':
+            self.count('upload_media')
+            handler.reply(200, self._store({}, data=handler.data))
+        elif handler.command == 'POST' and upload_type == 'resumable':
+            self.count('upload_start')
+            session_id = self._new_id()
+            with self.lock:
+                self.sessions[session_id] = {'metadata': json.loads(handler.data or b'{}'), 'received': 0,
+                                             'path': self.storage / f"upload_{session_id}"}
+            self.sessions[session_id]['path'].touch()
+            handler.reply(200, headers={'Location': f"{self.url}/upload/drive/v3/files?uploadType=resumable"
+                                                    f"&upload_id={session_id}"})
+        elif handler.command == 'PUT' and 'upload_id' in query:
+            self._upload_chunk(handler, query['upload_id'])
+        else:
+            handler.reply(400, {'error': {'code': 400, 'message': 'Bad upload request'}})
+
+    def _upload_chunk(self, handler, session_id):
+        self.count('upload_chunk')
+        session = self.sessions.get(session_id)
+        if session is None:
+            handler.reply(404, {'error': {'code': 404, 'message': 'Upload session not found'}})
+            return
+        content_range = handler.headers.get('Content-Range', '')
+        match = re.fullmatch(r'bytes (\*|(\d+)-(\d+))/(\*|\d+)', content_range.strip())
+        if match is None:
+            handler.reply(400, {'error': {'code': 400, 'message': 'Bad Content-Range'}})
+            return
+        _, first, _, total = match.groups()
+        if first is not None:
+            first = int(first)
+            if first > session['received']:
+                handler.reply(400, {'error': {'code': 400, 'message': 'Chunk skips data'}})
+                return
+            # bytes already received (a retried chunk) are skipped
+            skip = session['received'] - first
+            with open(session['path'], 'ab') as f:
+                f.write(handler.data[skip:])
+            session['received'] = max(session['received'], first + len(handler.data))
+        if total != '*' and session['received'] >= int(total):
+            with self.lock:
+                self.sessions.pop(session_id, None)
+            handler.reply(200, self._store(session['metadata'], path=session['path']))
+        elif session['received']:
+            handler.reply(308, headers={'Range': f"bytes=0-{session['received'] - 1}"})
+        else:
+            handler.reply(308)
+
+    def _batch(self, handler):
+        # each part is a whole HTTP request; the answers go back in the same order
+        self.count('batch')
+        boundary = f"batch_{self._new_id()}"
+        out = []
+        for headers, content in _split_multipart(handler.headers['Content-Type'], handler.data):
+            self.count('batch_part')
+            request_line, _, rest = content.partition(b'\n')
+            method, target, _ = request_line.decode('ascii').strip().split(' ', 2)
+            head, body = _split_head(rest)
+            sub_type = _parse_headers(head).get('content-type', '')
+            url = urlsplit(target)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            sub_path = url.path[len('/drive/v3/'):] if url.path.startswith('/drive/v3/') else url.path.lstrip('/')
+            try:
+                status, result, _ = self._api(method, sub_path, query, body, sub_type)
+            except Exception as e:
+                status, result = 500, {'error': {'code': 500, 'message': str(e)}}
+            payload = json.dumps(result).encode('utf-8') if isinstance(result, (dict, list)) else b''
+            content_id = headers.get('content-id', '').strip('<>')
+            out.append(f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                       f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+                       f"Content-Type: application/json; charset=UTF-8\r\nContent-Length: {len(payload)}\r\n\r\n"
+                       .encode('utf-8') + payload + b"\r\n")
+        out.append(f"--{boundary}--\r\n".encode('ascii'))
+        handler.reply(200, b''.join(out), content_type=f"multipart/mixed; boundary={boundary}")
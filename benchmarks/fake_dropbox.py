@@ -0,0 +1,354 @@
+import hashlib
+import os
+import uuid
+from datetime import datetime, timezone
+
+from dropbox import files, stone_serializers
+
+from benchmarks.fake_server import FakeServer
+
+PAGE_SIZE = 2000
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def content_hash(path):
+    # Dropbox content hash: SHA-256 of the SHA-256 digests of every 4 MB block
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(hashlib.sha256(block).digest())
+    return digest.hexdigest()
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+class _RouteError(Exception):
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
+class FakeDropbox(FakeServer):
+    # the part of the Dropbox v2 API the DropboxUploader uses: upload sessions and
+    # their batch commits, single uploads, downloads with ranges, folder listings,
+    # and the batch copy, delete and folder creation calls. Requests and replies go
+    # through the SDK's own route table and serializers, so the wire format is the
+    # real one. Batches always complete at once, so no async job is ever returned.
+    # Point dest_config['api_base_url'] at url.
+    def __init__(self, latency_ms=0, storage=None):
+        super().__init__(latency_ms, storage)
+        # path_lower -> entry; children: parent path_lower -> child paths_lower
+        self.entries = {}
+        self.children = {}
+        self.sessions = {}
+        self.cursors = {}
+        (self.storage / 'blobs').mkdir(exist_ok=True)
+        (self.storage / 'sessions').mkdir(exist_ok=True)
+
+    def handle(self, handler):
+        name = handler.path.split('?', 1)[0]
+        if not name.startswith('/2/files/'):
+            handler.reply(404, b'Unknown route', content_type='text/plain')
+            return
+        name = name[len('/2/files/'):]
+        key = name
+        if name.endswith('_v2'):
+            key = f"{name[:-3]}:2"
+        route = files.ROUTES.get(key)
+        method = getattr(self, '_' + name.replace('/', '_'), None)
+        if route is None or method is None:
+            handler.reply(404, b'Unknown route', content_type='text/plain')
+            return
+        self.count(name)
+
+        style = route.attrs.get('style') or 'rpc'
+        raw_arg = handler.headers.get('Dropbox-API-Arg') if style != 'rpc' else handler.data
+        arg = stone_serializers.json_decode(route.arg_type, raw_arg or 'null')
+        try:
+            if style == 'upload':
+                result = method(arg, handler.data)
+            else:
+                result = method(arg)
+        except _RouteError as e:
+            error = stone_serializers.json_compat_obj_encode(route.error_type, e.error)
+            handler.reply(409, {'error_summary': f"{error.get('.tag', 'other')}/...", 'error': error})
+            return
+
+        if style == 'download':
+            metadata, blob = result
+            handler.reply_file(blob, headers={
+                'Dropbox-API-Result': stone_serializers.json_encode(route.result_type, metadata)})
+        else:
+            handler.reply(200, stone_serializers.json_encode(route.result_type, result).encode('utf-8'))
+
+    # tree
+
+    def _blob(self, entry):
+        return self.storage / 'blobs' / entry['id'][3:]
+
+    def _get(self, path):
+        with self.lock:
+            return self.entries.get(path.lower())
+
+    def _link(self, entry):
+        # with self.lock held
+        lower = entry['path'].lower()
+        self.entries[lower] = entry
+        self.children.setdefault(lower.rpartition('/')[0], set()).add(lower)
+
+    def _make_folders(self, path):
+        # Dropbox creates the missing parents of anything written; with self.lock held
+        created = None
+        parts = path.split('/')
+        for end in range(2, len(parts) + 1):
+            folder = '/'.join(parts[:end])
+            entry = self.entries.get(folder.lower())
+            if entry is None:
+                created = {'tag': 'folder', 'path': folder, 'id': f"id:{uuid.uuid4().hex}"}
+                self._link(created)
+            elif entry['tag'] != 'folder':
+                raise _RouteError(None)
+        return created
+
+    def _put_file(self, path, source, client_modified=None, copy=False):
+        # source is a file moved (or, for copies, hard-linked) into the blob store
+        entry = {'tag': 'file', 'path': path, 'id': f"id:{uuid.uuid4().hex}", 'rev': uuid.uuid4().hex[:16],
+                 'size': os.path.getsize(source), 'hash': None,
+                 'client_modified': client_modified or _now(), 'server_modified': _now()}
+        blob = self._blob(entry)
+        if copy:
+            os.link(source, blob)
+        else:
+            os.replace(source, blob)
+        entry['hash'] = content_hash(blob)
+        with self.lock:
+            existing = self.entries.get(path.lower())
+            if existing is not None and existing['tag'] == 'folder':
+                blob.unlink()
+                raise _RouteError(None)
+            self._make_folders(path.rpartition('/')[0])
+            self._link(entry)
+        if existing is not None:
+            self._blob(existing).unlink(missing_ok=True)
+        return entry
+
+    def _subtree(self, lower):
+        # with self.lock held; the entry itself first, then its descendants, parents first
+        found = []
+        pending = [lower]
+        while pending:
+            current = pending.pop()
+            found.append(current)
+            pending.extend(sorted(self.children.get(current, ()), reverse=True))
+        return found
+
+    def _metadata(self, entry):
+        name = entry['path'].rpartition('/')[2]
+        if entry['tag'] == 'folder':
+            return files.FolderMetadata(name=name, id=entry['id'], path_lower=entry['path'].lower(),
+                                        path_display=entry['path'])
+        return files.FileMetadata(name=name, id=entry['id'], client_modified=entry['client_modified'],
+                                  server_modified=entry['server_modified'], rev=entry['rev'], size=entry['size'],
+                                  path_lower=entry['path'].lower(), path_display=entry['path'],
+                                  content_hash=entry['hash'])
+
+    # upload sessions
+
+    def _session_file(self, session_id):
+        return self.storage / 'sessions' / session_id
+
+    def _append(self, cursor, data, close=False):
+        session = self.sessions.get(cursor.session_id)
+        if session is None:
+            raise _RouteError(files.UploadSessionLookupError.not_found)
+        if session['closed'] and data:
+            raise _RouteError(files.UploadSessionLookupError.closed)
+        if cursor.offset != session['offset']:
+            raise _RouteError(files.UploadSessionLookupError.incorrect_offset(
+                files.UploadSessionOffsetError(correct_offset=session['offset'])))
+        with open(self._session_file(cursor.session_id), 'ab') as f:
+            f.write(data)
+        session['offset'] += len(data)
+        session['closed'] = session['closed'] or close
+        return session
+
+    def _commit(self, cursor, commit, data=b''):
+        try:
+            self._append(cursor, data, close=True)
+        except _RouteError as e:
+            raise _RouteError(files.UploadSessionFinishError.lookup_failed(e.error))
+        self.sessions.pop(cursor.session_id)
+        # the uploader always overwrites, so the write mode is not looked at
+        try:
+            entry = self._put_file(commit.path, self._session_file(cursor.session_id), commit.client_modified)
+        except _RouteError:
+            raise _RouteError(files.UploadSessionFinishError.path(
+                files.UploadWriteFailed(reason=files.WriteError.conflict(files.WriteConflictError.folder),
+                                        upload_session_id=cursor.session_id)))
+        return self._metadata(entry)
+
+    def _upload_session_start(self, arg, data):
+        session_id = uuid.uuid4().hex
+        self._session_file(session_id).write_bytes(data)
+        self.sessions[session_id] = {'offset': len(data), 'closed': bool(arg.close)}
+        return files.UploadSessionStartResult(session_id=session_id)
+
+    def _upload_session_append_v2(self, arg, data):
+        try:
+            self._append(arg.cursor, data, arg.close)
+        except _RouteError as e:
+            error = e.error
+            if error.is_incorrect_offset():
+                error = files.UploadSessionAppendError.incorrect_offset(error.get_incorrect_offset())
+            elif error.is_closed():
+                error = files.UploadSessionAppendError.closed
+            else:
+                error = files.UploadSessionAppendError.not_found
+            raise _RouteError(error)
+        return None
+
+    def _upload_session_finish(self, arg, data):
+        return self._commit(arg.cursor, arg.commit, data)
+
+    def _upload_session_finish_batch_v2(self, arg):
+        self.count('finish_batch_entry', len(arg.entries))
+        entries = []
+        for finish in arg.entries:
+            try:
+                entries.append(files.UploadSessionFinishBatchResultEntry.success(
+                    self._commit(finish.cursor, finish.commit)))
+            except _RouteError as e:
+                entries.append(files.UploadSessionFinishBatchResultEntry.failure(e.error))
+        return files.UploadSessionFinishBatchResult(entries=entries)
+
+    def _upload(self, arg, data):
+        temp = self._session_file(uuid.uuid4().hex)
+        temp.write_bytes(data)
+        try:
+            entry = self._put_file(arg.path, temp, arg.client_modified)
+        except _RouteError:
+            temp.unlink(missing_ok=True)
+            raise _RouteError(files.UploadError.path(files.UploadWriteFailed(
+                reason=files.WriteError.conflict(files.WriteConflictError.folder), upload_session_id='')))
+        return self._metadata(entry)
+
+    # reads
+
+    def _download(self, arg):
+        entry = self._get(arg.path)
+        if entry is None:
+            raise _RouteError(files.DownloadError.path(files.LookupError.not_found))
+        if entry['tag'] != 'file':
+            raise _RouteError(files.DownloadError.path(files.LookupError.not_file))
+        return self._metadata(entry), self._blob(entry)
+
+    def _page(self, pending):
+        with self.lock:
+            entries = [self._metadata(self.entries[lower]) for lower in pending[:PAGE_SIZE]
+                       if lower in self.entries]
+        pending = pending[PAGE_SIZE:]
+        cursor = uuid.uuid4().hex
+        if pending:
+            self.cursors[cursor] = pending
+        return files.ListFolderResult(entries=entries, cursor=cursor, has_more=bool(pending))
+
+    def _list_folder(self, arg):
+        lower = arg.path.lower().rstrip('/')
+        with self.lock:
+            if lower and lower not in self.entries:
+                raise _RouteError(files.ListFolderError.path(files.LookupError.not_found))
+            if lower and self.entries[lower]['tag'] != 'folder':
+                raise _RouteError(files.ListFolderError.path(files.LookupError.not_folder))
+            if arg.recursive:
+                pending = self._subtree(lower)[1:]
+            else:
+                pending = sorted(self.children.get(lower, ()))
+        return self._page(pending)
+
+    def _list_folder_continue(self, arg):
+        pending = self.cursors.pop(arg.cursor, None)
+        if pending is None:
+            raise _RouteError(files.ListFolderContinueError.reset)
+        return self._page(pending)
+
+    # batches
+
+    def _copy_one(self, from_path, to_path):
+        with self.lock:
+            source = self.entries.get(from_path.lower())
+            if source is None:
+                raise _RouteError(files.RelocationError.from_lookup(files.LookupError.not_found))
+            if to_path.lower() in self.entries:
+                raise _RouteError(files.RelocationError.to(files.WriteError.conflict(files.WriteConflictError.file)))
+            subtree = [self.entries[lower] for lower in self._subtree(from_path.lower())]
+        created = None
+        try:
+            for entry in subtree:
+                path = to_path + entry['path'][len(source['path']):]
+                if entry['tag'] == 'folder':
+                    with self.lock:
+                        folder = self._make_folders(path)
+                    created = created or folder
+                else:
+                    copied = self._put_file(path, self._blob(entry), entry['client_modified'], copy=True)
+                    created = created or copied
+        except _RouteError:
+            raise _RouteError(files.RelocationError.to(files.WriteError.conflict(files.WriteConflictError.file)))
+        return self._metadata(created or self._get(to_path))
+
+    def _copy_batch_v2(self, arg):
+        self.count('copy_entry', len(arg.entries))
+        entries = []
+        for relocation in arg.entries:
+            try:
+                entries.append(files.RelocationBatchResultEntry.success(
+                    self._copy_one(relocation.from_path, relocation.to_path)))
+            except _RouteError as e:
+                entries.append(files.RelocationBatchResultEntry.failure(
+                    files.RelocationBatchErrorEntry.relocation_error(e.error)))
+        return files.RelocationBatchV2Launch.complete(files.RelocationBatchV2Result(entries=entries))
+
+    def _create_folder_batch(self, arg):
+        self.count('create_folder_entry', len(arg.paths))
+        entries = []
+        for path in arg.paths:
+            with self.lock:
+                existing = self.entries.get(path.lower())
+                if existing is None:
+                    try:
+                        existing = self._make_folders(path)
+                    except _RouteError:
+                        existing = None
+            if existing is None or existing['tag'] != 'folder':
+                entries.append(files.CreateFolderBatchResultEntry.failure(
+                    files.CreateFolderEntryError.path(files.WriteError.conflict(files.WriteConflictError.file))))
+            else:
+                entries.append(files.CreateFolderBatchResultEntry.success(
+                    files.CreateFolderEntryResult(metadata=self._metadata(existing))))
+        return files.CreateFolderBatchLaunch.complete(files.CreateFolderBatchResult(entries=entries))
+
+    def _delete_batch(self, arg):
+        self.count('delete_entry', len(arg.entries))
+        entries = []
+        for delete in arg.entries:
+            lower = delete.path.lower()
+            with self.lock:
+                entry = self.entries.get(lower)
+                removed = []
+                if entry is not None:
+                    for child in self._subtree(lower):
+                        removed.append(self.entries.pop(child))
+                        self.children.pop(child, None)
+                    self.children.get(lower.rpartition('/')[0], set()).discard(lower)
+            if entry is None:
+                entries.append(files.DeleteBatchResultEntry.failure(
+                    files.DeleteError.path_lookup(files.LookupError.not_found)))
+                continue
+            for child in removed:
+                if child['tag'] == 'file':
+                    self._blob(child).unlink(missing_ok=True)
+            entries.append(files.DeleteBatchResultEntry.success(
+                files.DeleteBatchResultData(metadata=self._metadata(entry))))
+        return files.DeleteBatchLaunch.complete(files.DeleteBatchResult(entries=entries))
@@ -0,0 +1,132 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, as the real services, so clients reuse their connections
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self):
+        self.server.fake.dispatch(self)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def reply(self, status, body=b'', content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_file(self, path, headers=None):
+        # whole file or the single range asked for, streamed from disk
+        size = path.stat().st_size
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        headers = dict(headers or {})
+        if range_header and range_header.startswith('bytes=') and size:
+            first, _, last = range_header[6:].partition('-')
+            start = int(first) if first else max(size - int(last), 0)
+            end = min(int(last), size - 1) if first and last else size - 1
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        length = max(end - start + 1, 0)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while length > 0:
+                data = f.read(min(length, 1024 * 1024))
+                if not data:
+                    break
+                self.wfile.write(data)
+                length -= len(data)
+
+
+class FakeServer:
+    # base of the fake cloud services: a threaded HTTP server on localhost that waits
+    # latency_ms before answering each request and counts requests by kind; file
+    # contents are kept on disk under storage
+    def __init__(self, latency_ms=0, storage=None):
+        self.latency = latency_ms / 1000
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self._own_storage = storage is None
+        self.storage = Path(storage or tempfile.mkdtemp(prefix='fake_cloud_'))
+        self.storage.mkdir(parents=True, exist_ok=True)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._own_storage:
+            shutil.rmtree(self.storage, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def count(self, kind, n=1):
+        with self.lock:
+            self.counts[kind] += n
+
+    def reset_counts(self):
+        with self.lock:
+            counts, self.counts = dict(self.counts), Counter()
+        return counts
+
+    def dispatch(self, handler):
+        # the body is always read, so an error reply does not break the kept-alive connection
+        handler.data = handler.body()
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            self.handle(handler)
+        except Exception as e:
+            self.count('server_error')
+            handler.reply(500, {'error': {'message': str(e)}})
+
+    def handle(self, handler):
+        raise NotImplementedError
@@ -0,0 +1,96 @@
+# Stand-in for the smbclient package used by the NAS backend in benchmarks: UNC paths
+# \\server\share\... are mapped to FAKE_SMB_ROOT/server/share/... on the local disk, and
+# every call (including each read and write) waits FAKE_SMB_LATENCY_MS to model the
+# round trip to a real server.
+import os
+import time
+
+ROOT = os.environ.get('FAKE_SMB_ROOT', os.path.join(os.getcwd(), 'fake_smb_root'))
+LATENCY = float(os.environ.get('FAKE_SMB_LATENCY_MS', '0')) / 1000
+
+
+def _wait():
+    if LATENCY:
+        time.sleep(LATENCY)
+
+
+def _local(path):
+    return os.path.join(ROOT, *[part for part in str(path).replace('/', '\\').split('\\') if part])
+
+
+class _RemoteFile:
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, size=-1):
+        _wait()
+        return self._f.read(size)
+
+    def readinto(self, buffer):
+        _wait()
+        return self._f.readinto(buffer)
+
+    def write(self, data):
+        _wait()
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._f.close()
+        return False
+
+
+def register_session(server, username=None, password=None, connection_cache=None, **kwargs):
+    _wait()
+    if connection_cache is not None:
+        connection_cache[server] = True
+
+
+def reset_connection_cache(fail_on_error=True, connection_cache=None):
+    if connection_cache is not None:
+        connection_cache.clear()
+
+
+def open_file(path, mode='r', buffering=-1, **kwargs):
+    _wait()
+    return _RemoteFile(open(_local(path), mode, buffering=buffering))
+
+
+def mkdir(path, **kwargs):
+    _wait()
+    os.mkdir(_local(path))
+
+
+def makedirs(path, exist_ok=False, **kwargs):
+    _wait()
+    os.makedirs(_local(path), exist_ok=exist_ok)
+
+
+def scandir(path, **kwargs):
+    _wait()
+    return os.scandir(_local(path))
+
+
+def stat(path, **kwargs):
+    _wait()
+    return os.stat(_local(path))
+
+
+def remove(path, **kwargs):
+    _wait()
+    os.remove(_local(path))
+
+
+def rmdir(path, **kwargs):
+    _wait()
+    os.rmdir(_local(path))
+
+
+def rename(src, dst, **kwargs):
+    _wait()
+    os.rename(_local(src), _local(dst))
@@ -0,0 +1,30 @@
+import shutil
+
+from smbclient import _local, _wait
+
+
+def _path(path):
+    # arguments that are not UNC paths are local files, as with the real package
+    path = str(path)
+    return _local(path) if path.startswith('\\\\') else path
+
+
+def copystat(src, dst, **kwargs):
+    _wait()
+    shutil.copystat(_path(src), _path(dst))
+
+
+def copyfile(src, dst, **kwargs):
+    # a server-side copy: one round trip whatever the size
+    _wait()
+    shutil.copyfile(_path(src), _path(dst))
+
+
+def copy2(src, dst, **kwargs):
+    _wait()
+    shutil.copy2(_path(src), _path(dst))
+
+
+def rmtree(path, **kwargs):
+    _wait()
+    shutil.rmtree(_path(path))
@@ -0,0 +1,282 @@
+# Backup throughput benchmarks against local stand-ins for every backend: a temporary
+# folder (local, repository, archive), the fake smbclient shim or a real SMB server (nas)
+# and fake Drive and Dropbox HTTP servers with configurable latency. Each backend runs a
+# full backup and then an incremental one over the same synthetic tree; files/s, MB/s,
+# peak RSS and the requests seen by the fake servers are written as JSON, and can be
+# compared against a previous result to catch regressions.
+#
+#   python -m benchmarks.run_benchmarks --profile mixed --scale 0.01 --output actual.json
+#   python -m benchmarks.run_benchmarks --compare anterior.json --output actual.json
+#   python -m benchmarks.run_benchmarks --scale 0.002 --compare benchmarks/baseline.json
+#   python -m benchmarks.run_benchmarks --backends gdrive --profiling   (perfiles en runs/<destino>/profiles)
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.tree_gen import PROFILES, generate_tree
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FAKE_SMB_PATH = Path(__file__).resolve().parent / 'fake_smb'
+BACKENDS = ('local', 'nas', 'gdrive', 'dropbox', 'repository', 'archive')
+PHASES = ('full', 'incremental')
+DEFAULT_WORK_DIR = Path(tempfile.gettempdir()) / 'diskguardian_bench'
+DEFAULT_THRESHOLD = 0.10
+# from the start of the worker process, imports included, to the first file reaching the
+# backend; importing the Google and Dropbox SDKs alone takes 200-300 ms
+FIRST_COPY_BUDGET_MS = 200
+CLOUD_FIRST_COPY_BUDGET_MS = {'gdrive': 500, 'dropbox': 500}
+# backends that transform the data themselves, so a slow step of their own shows up as a
+# low throughput even on a fast disk; the repository chunked at 5.6 MB/s in pure Python
+MIN_MB_PER_S = {'repository': 25}
+# metric -> True when higher is better
+COMPARED_METRICS = {'files_per_s': True, 'mb_per_s': True, 'peak_rss_mb': False, 'requests_total': False}
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='run_benchmarks',
+                                     description="Mide el rendimiento de las copias de seguridad con árboles sintéticos")
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='mixed',
+                        help="árbol de origen: " + "; ".join(f"{name}: {profile['description']}"
+                                                              for name, profile in sorted(PROFILES.items())))
+    parser.add_argument('--scale', type=float, default=0.01,
+                        help="fracción del perfil que se genera (1.0 = tamaño completo)")
+    parser.add_argument('--seed', type=int, default=0, help="semilla del generador de árboles")
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help="destinos a medir, separados por comas")
+    parser.add_argument('--latency-ms', type=float, default=5,
+                        help="latencia añadida a cada petición de los servidores simulados")
+    parser.add_argument('--workers', type=int, default=None, help="hilos de copia (por defecto, los de la aplicación)")
+    parser.add_argument('--mode', choices=('full', 'incremental'), default='incremental',
+                        help="modo de copia de los destinos local, NAS y nube")
+    parser.add_argument('--pack-small-files', action='store_true',
+                        help="empaquetar los archivos pequeños en Google Drive y Dropbox")
+    parser.add_argument('--profiling', action='store_true',
+                        help="guardar un perfil de rendimiento de cada ejecución (añade algo de coste)")
+    parser.add_argument('--work-dir', type=Path, default=DEFAULT_WORK_DIR,
+                        help="carpeta de trabajo; los árboles generados se reutilizan entre ejecuciones")
+    parser.add_argument('--nas-server', help="servidor SMB real; sin él se usa el smbclient simulado")
+    parser.add_argument('--nas-share', default='benchmark')
+    parser.add_argument('--nas-user', default='guest')
+    parser.add_argument('--nas-password', default='')
+    parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'),
+                        help="archivo JSON con los resultados")
+    parser.add_argument('--compare', type=Path, help="resultados anteriores con los que comparar")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="empeoramiento relativo a partir del cual se marca una regresión")
+    args = parser.parse_args(argv)
+    args.backends = [name.strip() for name in args.backends.split(',') if name.strip()]
+    unknown = [name for name in args.backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"destinos desconocidos: {', '.join(unknown)}")
+    return args
+
+
+def _start_server(backend, args, storage):
+    if backend == 'gdrive':
+        from benchmarks.fake_drive import FakeDrive
+
+        return FakeDrive(args.latency_ms, storage).start()
+    if backend == 'dropbox':
+        from benchmarks.fake_dropbox import FakeDropbox
+
+        return FakeDropbox(args.latency_ms, storage).start()
+    return None
+
+
+def _dest_config(backend, args, run_dir, server):
+    if backend in ('local', 'repository', 'archive'):
+        config = {'path': str(run_dir / 'dest')}
+        if backend == 'local':
+            config['mode'] = args.mode
+    elif backend == 'nas':
+        config = {'server': args.nas_server or 'benchmark', 'share': args.nas_share,
+                  'username': args.nas_user, 'password': args.nas_password, 'mode': args.mode}
+    elif backend == 'gdrive':
+        config = {'folder_name': 'Benchmark', 'api_endpoint': server.url + '/drive/v3/', 'mode': args.mode,
+                  'pack_small_files': args.pack_small_files}
+    else:
+        config = {'token': 'benchmark', 'folder_path': '/Benchmark', 'api_base_url': server.url, 'mode': args.mode,
+                  'pack_small_files': args.pack_small_files}
+    if args.workers:
+        config['workers'] = args.workers
+    return config
+
+
+def _worker_env(backend, args, run_dir):
+    env = dict(os.environ)
+    paths = [str(REPO_ROOT)]
+    if backend == 'nas' and not args.nas_server:
+        # the shim goes first so it shadows an installed smbclient
+        paths.insert(0, str(FAKE_SMB_PATH))
+        env['FAKE_SMB_ROOT'] = str(run_dir / 'smb')
+        env['FAKE_SMB_LATENCY_MS'] = str(args.latency_ms)
+    env['PYTHONPATH'] = os.pathsep.join(paths + [env['PYTHONPATH']] if env.get('PYTHONPATH') else paths)
+    return env
+
+
+def _run_worker(spec, run_dir, env):
+    spec_file = run_dir / 'spec.json'
+    result_file = run_dir / 'result.json'
+    spec_file.write_text(json.dumps(spec), encoding='utf-8')
+    result_file.unlink(missing_ok=True)
+    completed = subprocess.run([sys.executable, '-m', 'benchmarks.bench_worker', str(spec_file), str(result_file)],
+                               cwd=run_dir / 'cwd', env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True)
+    if completed.returncode != 0 or not result_file.exists():
+        raise RuntimeError(f"el proceso de {spec['backend']} terminó con código {completed.returncode}:\n"
+                           f"{completed.stdout[-2000:]}")
+    return json.loads(result_file.read_text(encoding='utf-8'))
+
+
+def _wait_next_second():
+    # backups are named to the second; two runs in the same second would share a folder
+    time.sleep(1.05 - time.time() % 1)
+
+
+def run_backend(backend, args, tree, run_dir):
+    shutil.rmtree(run_dir, ignore_errors=True)
+    (run_dir / 'cwd').mkdir(parents=True)
+    if backend == 'nas' and not args.nas_server:
+        (run_dir / 'smb' / 'benchmark' / args.nas_share).mkdir(parents=True)
+    server = _start_server(backend, args, run_dir / 'server')
+    try:
+        config = _dest_config(backend, args, run_dir, server)
+        env = _worker_env(backend, args, run_dir)
+        results = {}
+        for phase in PHASES:
+            _wait_next_second()
+            if server is not None:
+                server.reset_counts()
+            spec = {'backend': backend, 'phase': phase, 'source': tree['path'], 'dest_config': config,
+                    'profiling': {'enabled': True, 'dir': str(run_dir / 'profiles')} if args.profiling else None}
+            measured = _run_worker(spec, run_dir, env)
+            seconds = max(measured['seconds'], 1e-9)
+            requests = server.reset_counts() if server is not None else {}
+            results[phase] = {
+                'seconds': round(measured['seconds'], 3),
+                'cpu_seconds': round(measured['cpu_seconds'], 3),
+                'files_per_s': round(tree['files'] / seconds, 1),
+                'mb_per_s': round(tree['bytes'] / 1024 ** 2 / seconds, 2),
+                'peak_rss_mb': round(measured['peak_rss_bytes'] / 1024 ** 2, 1),
+                'errors': measured['errors'],
+                'first_copy_ms': (round(measured['first_copy_seconds'] * 1000, 1)
+                                  if measured.get('first_copy_seconds') is not None else None),
+                'requests': requests,
+                'requests_total': sum(count for kind, count in requests.items() if not kind.endswith('_entry')
+                                      and kind != 'batch_part'),
+            }
+        return results
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def compare(results, baseline, threshold):
+    # returns the regressions as readable lines; only backends and phases present in
+    # both results are compared
+    regressions = []
+    for backend, phases in results['results'].items():
+        for phase, current in phases.items():
+            previous = baseline.get('results', {}).get(backend, {}).get(phase)
+            if not previous:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                old, new = previous.get(metric), current.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if (-change if higher_is_better else change) > threshold:
+                    regressions.append(f"{backend} ({phase}): {metric} {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def over_budget(results):
+    slow = []
+    for backend, phases in results['results'].items():
+        budget_ms = CLOUD_FIRST_COPY_BUDGET_MS.get(backend, FIRST_COPY_BUDGET_MS)
+        for phase, result in phases.items():
+            if result.get('first_copy_ms') is not None and result['first_copy_ms'] > budget_ms:
+                slow.append(f"{backend} ({phase}): primera copia a los {result['first_copy_ms']:.0f} ms "
+                            f"(objetivo {budget_ms} ms)")
+            if backend in MIN_MB_PER_S and result['mb_per_s'] < MIN_MB_PER_S[backend]:
+                slow.append(f"{backend} ({phase}): {result['mb_per_s']:.1f} MB/s "
+                            f"(mínimo {MIN_MB_PER_S[backend]} MB/s)")
+    return slow
+
+
+def _summary_line(backend, phase, result):
+    line = (f"{backend:<10} {phase:<11} {result['seconds']:>8.2f} s {result['files_per_s']:>10.1f} arch/s "
+            f"{result['mb_per_s']:>8.2f} MB/s {result['peak_rss_mb']:>7.1f} MB RSS")
+    if result.get('first_copy_ms') is not None:
+        line += f" {result['first_copy_ms']:>6.0f} ms hasta copiar"
+    if result['requests_total']:
+        line += f" {result['requests_total']:>6} peticiones"
+    if result['errors']:
+        line += f" {result['errors']} errores"
+    return line
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    tree_root = args.work_dir / f"tree_{args.profile}_{args.scale}_{args.seed}"
+
+    print(f"Generando el árbol '{args.profile}' (escala {args.scale}) en {tree_root}...")
+    tree = generate_tree(tree_root, args.profile, args.scale, args.seed)
+    print(f"Árbol listo: {tree['files']} archivos, {tree['bytes'] / 1024 ** 2:.1f} MB")
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {'profile': args.profile, 'scale': args.scale, 'seed': args.seed, 'latency_ms': args.latency_ms,
+                   'workers': args.workers, 'mode': args.mode, 'pack_small_files': args.pack_small_files},
+        'tree': {'files': tree['files'], 'bytes': tree['bytes']},
+        'results': {},
+    }
+    failed = False
+    for backend in args.backends:
+        print(f"Midiendo {backend}...")
+        try:
+            results['results'][backend] = run_backend(backend, args, tree, args.work_dir / 'runs' / backend)
+        except Exception as e:
+            failed = True
+            print(f"Error midiendo {backend}: {str(e)}")
+            continue
+        for phase, result in results['results'][backend].items():
+            print(_summary_line(backend, phase, result))
+
+    args.output.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    print(f"Resultados guardados en {args.output}")
+
+    below_budget = over_budget(results)
+    if below_budget:
+        failed = True
+        print("Por debajo del rendimiento mínimo:")
+        for line in below_budget:
+            print(f"  {line}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding='utf-8'))
+        if baseline.get('params') != results['params'] or baseline.get('tree') != results['tree']:
+            print("Advertencia: los resultados anteriores se midieron con otros parámetros")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"Regresiones (más de un {args.threshold:.0%} peor):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Sin regresiones respecto a los resultados anteriores")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import json
+import math
+import os
+import random
+from pathlib import Path
+
+TREE_INFO = ".benchmark_tree.json"
+BLOCK_SIZE = 1024 * 1024
+FIXED_MTIME = 1_600_000_000
+
+# counts are for scale=1.0; sizes are (low, high) bounds of a log-uniform distribution
+PROFILES = {
+    'tiny': {
+        'description': "un millón de archivos de 0 a 4 KB",
+        'groups': [{'files': 1_000_000, 'size': (0, 4096), 'per_dir': 1000, 'depth': 2}],
+    },
+    'huge': {
+        'description': "cuatro archivos de 4 GB",
+        'groups': [{'files': 4, 'size': (4 * 1024 ** 3, 4 * 1024 ** 3), 'per_dir': 4, 'depth': 0}],
+    },
+    'deep': {
+        'description': "50.000 archivos pequeños en carpetas anidadas 64 niveles",
+        'groups': [{'files': 50_000, 'size': (100, 64 * 1024), 'per_dir': 20, 'depth': 64}],
+    },
+    'mixed': {
+        'description': "perfil realista: código y documentos, fotos, vídeos y algunos archivos grandes",
+        'groups': [
+            {'files': 80_000, 'size': (200, 64 * 1024), 'per_dir': 40, 'depth': 8, 'text': True},
+            {'files': 15_000, 'size': (64 * 1024, 2 * 1024 ** 2), 'per_dir': 100, 'depth': 4, 'text': True},
+            {'files': 5_000, 'size': (1024 ** 2, 12 * 1024 ** 2), 'per_dir': 200, 'depth': 3},
+            {'files': 200, 'size': (50 * 1024 ** 2, 500 * 1024 ** 2), 'per_dir': 20, 'depth': 2},
+            {'files': 2, 'size': (2 * 1024 ** 3, 2 * 1024 ** 3), 'per_dir': 2, 'depth': 1},
+        ],
+    },
+}
+
+
+class _ContentSource:
+    # random blocks make every file unique (no accidental deduplication or compression);
+    # text blocks compress like source code and documents do
+    def __init__(self, rng):
+        self.rng = rng
+        words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10)))
+                 for _ in range(2000)]
+        text = ' '.join(rng.choice(words) for _ in range(BLOCK_SIZE // 5)).encode('ascii')
+        self.text = memoryview(text[:BLOCK_SIZE])
+
+    def write(self, f, size, text):
+        while size > 0:
+            count = min(size, BLOCK_SIZE)
+            if text:
+                start = self.rng.randrange(0, BLOCK_SIZE - count + 1)
+                f.write(self.text[start:start + count])
+            else:
+                f.write(self.rng.randbytes(count))
+            size -= count
+
+
+def _size(rng, low, high):
+    if low == high:
+        return low
+    return min(high, int(math.exp(rng.uniform(math.log(low + 1), math.log(high + 1)))) - 1)
+
+
+def _dir_path(group_no, index, per_dir, depth):
+    # files fill directories of per_dir entries; directories hang off a chain of nested
+    # folders so deep profiles really are deep
+    dir_no = index // per_dir
+    parts = [f"g{group_no}"]
+    if depth:
+        level = dir_no % depth
+        parts += [f"d{i}" for i in range(level)]
+        parts.append(f"dir{dir_no:06d}")
+    return Path(*parts)
+
+
+def generate_tree(root, profile='mixed', scale=1.0, seed=0, log=print):
+    # reproducible: the same profile, scale and seed give the same names, sizes, contents
+    # and times; an existing tree with the same parameters is reused. The files go to
+    # root/data, the description of the tree next to it
+    root = Path(root)
+    data = root / 'data'
+    params = {'profile': profile, 'scale': scale, 'seed': seed}
+    info_file = root / TREE_INFO
+    if info_file.exists():
+        info = json.loads(info_file.read_text(encoding='utf-8'))
+        if info.get('params') == params:
+            return info
+    if data.exists() and any(data.iterdir()):
+        raise FileExistsError(f"{data} ya contiene otro árbol; usa una carpeta vacía")
+
+    rng = random.Random(seed)
+    content = _ContentSource(rng)
+    files = 0
+    total_bytes = 0
+    for group_no, group in enumerate(PROFILES[profile]['groups']):
+        # a group that would round to no files keeps one, shrunk so the total stays in scale
+        exact = group['files'] * scale
+        count = max(1, int(exact))
+        shrink = min(1.0, exact)
+        for index in range(count):
+            rel_dir = _dir_path(group_no, index, group['per_dir'], group['depth'])
+            (data / rel_dir).mkdir(parents=True, exist_ok=True)
+            size = int(_size(rng, *group['size']) * shrink)
+            path = data / rel_dir / f"f{index:07d}.{'txt' if group.get('text') else 'bin'}"
+            with open(path, 'wb') as f:
+                content.write(f, size, group.get('text', False))
+            mtime = FIXED_MTIME + index
+            os.utime(path, (mtime, mtime))
+            files += 1
+            total_bytes += size
+            if files % 50_000 == 0:
+                log(f"{files} archivos generados")
+
+    info = {'params': params, 'path': str(data), 'files': files, 'bytes': total_bytes}
+    info_file.write_text(json.dumps(info), encoding='utf-8')
+    return info
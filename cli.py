@@ -0,0 +1,215 @@
+# Copias de seguridad sin interfaz gráfica, para servidores y cron. Usa la misma
+# configuración y los mismos perfiles que main.py:
+#
+#   python cli.py list
+#   python cli.py run PERFIL [--resume] [--profiling]
+#   python cli.py daemon [PERFIL ...]
+import time
+
+# taken before anything else is imported, so the start-up cost is part of the measurement
+STARTED = time.perf_counter()
+
+import argparse
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+
+from backup_manager import BackupManager
+from config_manager import ConfigManager
+from event_bus import create_file_logger
+
+DEST_NAMES = {'local': "disco local", 'nas': "NAS", 'gdrive': "Google Drive", 'dropbox': "Dropbox",
+              'repository': "repositorio", 'archive': "archivo comprimido"}
+
+
+def _make_log(quiet=False):
+    file_logger = create_file_logger()
+
+    def log(message):
+        line = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}"
+        file_logger.info(line)
+        if not quiet:
+            # one write per line, so lines from the copy threads do not interleave
+            sys.stdout.write(line + '\n')
+            sys.stdout.flush()
+
+    return log
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='cli', description="Copias de seguridad sin interfaz gráfica",
+                                     epilog="Código de salida: 0 si la copia terminó sin errores, 1 en otro caso")
+    parser.add_argument('--dir', help="carpeta con backup_config.json y las cachés (por defecto, la actual)")
+    parser.add_argument('--quiet', action='store_true', help="escribir solo en diskguardian.log")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help="mostrar los perfiles guardados")
+
+    run = commands.add_parser('run', help="ejecutar la copia de un perfil guardado")
+    run.add_argument('profile', help="nombre del perfil")
+    run.add_argument('--resume', action='store_true', help="reanudar la última copia interrumpida")
+    run.add_argument('--profiling', action='store_true', help="guardar un perfil de rendimiento de la copia")
+
+    daemon = commands.add_parser('daemon', help="ejecutar las copias según la programación guardada")
+    daemon.add_argument('profiles', nargs='*', help="perfiles que se copian (por defecto, todos)")
+    daemon.add_argument('--profiling', action='store_true', help="guardar un perfil de rendimiento de cada copia")
+    return parser.parse_args(argv)
+
+
+def run_profile(config_manager, manager, name, log, resume=False, profiling=False, startup=True):
+    # returns True when the backup completed without errors; startup logs how long the
+    # process took to start copying, which only means something for the first run
+    profile = config_manager.load_profile(name)
+    if profile is None:
+        raise ValueError(f"No existe el perfil '{name}'")
+    if not profile.get('sources'):
+        raise ValueError(f"El perfil '{name}' no tiene carpetas de origen")
+    if 'destination' not in profile:
+        raise ValueError(f"El perfil '{name}' no guarda su destino; ábrelo en la aplicación y vuelve a guardarlo")
+    dest_type = profile.get('dest_type', 'local')
+    dest_config = config_manager.dest_config(dest_type, profile['destination'])
+    profiling_config = dict(profile.get('profiling') or {})
+    if profiling:
+        profiling_config['enabled'] = True
+    retention = profile.get('retention') or {}
+
+    log(f"Perfil '{name}': {len(profile['sources'])} orígenes hacia {DEST_NAMES.get(dest_type, dest_type)}")
+    manager.backup(profile['sources'], dest_type, dest_config, lambda *args: None,
+                   filters=profile.get('filters'), resume=resume, throttle=profile.get('throttle'),
+                   retention=retention if retention.get('auto') else None,
+                   metrics_file=config_manager.config.get('metrics_textfile') or None,
+                   profiling=profiling_config)
+
+    metrics = manager.metrics
+    if startup and metrics.first_file_at is not None:
+        log(f"Primera copia a los {(metrics.first_file_at - STARTED) * 1000:.0f} ms del arranque")
+    run = metrics.snapshot()
+    return run['status'] == 'completed' and not run['errors']
+
+
+STOP_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+
+def _install_stop_handler(on_stop):
+    def handler(signum, frame):
+        on_stop()
+
+    for signum in STOP_SIGNALS:
+        signal.signal(signum, handler)
+
+
+def list_profiles(config_manager):
+    names = config_manager.get_profiles()
+    if not names:
+        print("No hay perfiles guardados")
+    for name in names:
+        profile = config_manager.load_profile(name)
+        dest_type = profile.get('dest_type', 'local')
+        note = "" if 'destination' in profile else " (sin destino guardado)"
+        print(f"{name}: {len(profile.get('sources', []))} orígenes hacia {DEST_NAMES.get(dest_type, dest_type)}{note}")
+    schedule_config = config_manager.get_schedule()
+    if not schedule_config.get('enabled'):
+        print("Programación desactivada")
+        return 0
+    from scheduler import schedule_cron
+
+    try:
+        cron = schedule_cron(schedule_config)
+        next_run = cron.next_after(datetime.now())
+    except ValueError as e:
+        print(f"Programación no válida: {str(e)}")
+        return 1
+    print(f"Programación: {cron} (cron), próxima copia {next_run.strftime('%Y-%m-%d %H:%M')}")
+    return 0
+
+
+def run_once(config_manager, args, log):
+    manager = BackupManager(log)
+
+    def stop():
+        log("Deteniendo copia de seguridad...")
+        manager.stop()
+
+    _install_stop_handler(stop)
+    try:
+        ok = run_profile(config_manager, manager, args.profile, log, resume=args.resume, profiling=args.profiling)
+    except Exception as e:
+        log(f"Error: {str(e)}")
+        return 1
+    return 0 if ok else 1
+
+
+def run_daemon(config_manager, args, log):
+    # imported here so single runs from cron do not load the scheduler
+    from scheduler import BackupScheduler
+
+    names = args.profiles or config_manager.get_profiles()
+    missing = [name for name in names if config_manager.load_profile(name) is None]
+    if missing:
+        log(f"Error: no existen los perfiles {', '.join(missing)}")
+        return 1
+    if not names:
+        log("Error: no hay perfiles guardados")
+        return 1
+    if not config_manager.get_schedule().get('enabled', False):
+        log("Error: la programación está desactivada; actívala en la pestaña Programación")
+        return 1
+
+    # blocked before any thread starts, so every thread inherits the mask and the main
+    # thread takes the signal with sigwait(), sleeping without a timer until then
+    wait_for_signal = hasattr(signal, 'pthread_sigmask')
+    if wait_for_signal:
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+    manager = BackupManager(log)
+    stopping = threading.Event()
+
+    def run_all():
+        for name in names:
+            if stopping.is_set():
+                break
+            try:
+                run_profile(config_manager, manager, name, log, profiling=args.profiling, startup=False)
+            except Exception as e:
+                log(f"Error en el perfil '{name}': {str(e)}")
+
+    sources = sorted({source for name in names for source in config_manager.load_profile(name).get('sources', [])})
+    scheduler = BackupScheduler(run_all, watch_sources=sources, log=log)
+    scheduler.start()
+    manager.watcher = scheduler.watcher
+    log(f"Servicio de copias iniciado para {len(names)} perfiles; Ctrl+C para terminar")
+
+    def stop():
+        stopping.set()
+        manager.stop()
+
+    if wait_for_signal:
+        signal.sigwait(STOP_SIGNALS)
+        stop()
+    else:
+        _install_stop_handler(stop)
+        # a timed wait lets the handler run on Windows
+        while not stopping.wait(1):
+            pass
+    log("Deteniendo el servicio de copias...")
+    scheduler.stop()
+    log("Servicio de copias detenido")
+    return 0
+
+
+def main(argv=None):
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    if args.dir:
+        os.chdir(args.dir)
+    config_manager = ConfigManager()
+    if args.command == 'list':
+        return list_profiles(config_manager)
+    log = _make_log(args.quiet)
+    if args.command == 'run':
+        return run_once(config_manager, args, log)
+    return run_daemon(config_manager, args, log)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import json
 import os
 from pathlib import Path
+from copy_engine import DEFAULT_WORKERS
 
 class ConfigManager:
     def __init__(self, config_file="backup_config.json"):
@@ -47,3 +48,70 @@ class ConfigManager:
         if 'profiles' in self.config and name in self.config['profiles']:
             del self.config['profiles'][name]
             self.save_config()
+            
+    def dest_config(self, dest_type, destination):
+        # a profile keeps what was entered for its destination; credentials and performance
+        # settings come from the global configuration. Raises ValueError when something is missing
+        destination = destination or {}
+        config = self.config
+        dest_config = {}
+        
+        if dest_type == "local":
+            if not destination.get('path'):
+                raise ValueError("Selecciona la ruta de destino")
+            dest_config['path'] = destination['path']
+            dest_config['mode'] = destination.get('mode', 'full')
+            dest_config['checksums'] = destination.get('checksums', False)
+            dest_config['workers'] = config.get('copy_workers', DEFAULT_WORKERS)
+            
+        elif dest_type == "nas":
+            if not (destination.get('server') and destination.get('share')):
+                raise ValueError("Completa la configuración del NAS")
+            dest_config.update({
+                'server': destination['server'],
+                'share': destination['share'],
+                'username': destination.get('username', ''),
+                'password': destination.get('password', ''),
+                'mode': destination.get('mode', 'full'),
+                'workers': config.get('copy_workers', DEFAULT_WORKERS)
+            })
+            
+        elif dest_type == "gdrive":
+            if 'gdrive_credentials' not in config:
+                raise ValueError("Configura las credenciales de Google Drive en Configuración")
+            dest_config.update({
+                'credentials_path': config['gdrive_credentials'],
+                'folder_name': destination.get('folder_name', 'Backups'),
+                'mode': destination.get('mode', 'full'),
+                'pack_small_files': destination.get('pack_small_files', False),
+                'pack_threshold': config.get('pack_threshold_kb', 256) * 1024,
+                'workers': config.get('copy_workers', DEFAULT_WORKERS),
+                'chunk_size': config.get('gdrive_chunk_mb', 8) * 1024 * 1024
+            })
+            
+        elif dest_type == "dropbox":
+            if 'dropbox_token' not in config:
+                raise ValueError("Configura el token de Dropbox en Configuración")
+            dest_config.update({
+                'token': config['dropbox_token'],
+                'folder_path': destination.get('folder_path', '/Backups'),
+                'mode': destination.get('mode', 'full'),
+                'pack_small_files': destination.get('pack_small_files', False),
+                'pack_threshold': config.get('pack_threshold_kb', 256) * 1024,
+                'workers': config.get('copy_workers', DEFAULT_WORKERS)
+            })
+            
+        elif dest_type == "repository":
+            if not destination.get('path'):
+                raise ValueError("Selecciona la carpeta del repositorio")
+            dest_config['path'] = destination['path']
+            
+        elif dest_type == "archive":
+            if not destination.get('path'):
+                raise ValueError("Selecciona la carpeta para el archivo de respaldo")
+            dest_config['path'] = destination['path']
+            
+        else:
+            raise ValueError(f"Tipo de destino desconocido: {dest_type}")
+            
+        return dest_config
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+HASH_CACHE_FILE = "hash_cache.db"
+DROPBOX_BLOCK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def dropbox_content_hash(path):
+    block_hashes = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(DROPBOX_BLOCK_SIZE)
+            if not block:
+                break
+            block_hashes.update(hashlib.sha256(block).digest())
+    return block_hashes.hexdigest()
+
+
+def md5_hash(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+HASH_FUNCTIONS = {
+    'dropbox': dropbox_content_hash,
+    'md5': md5_hash,
+}
+
+
+class HashingReader:
+    # file wrapper that hashes the data as an uploader reads it, so the checksum costs no
+    # extra pass over the source; ranges read again after a retry are not hashed twice.
+    # With metrics, every read of the source is timed as the 'read' stage
+    def __init__(self, f, metrics=None):
+        self.f = f
+        self.metrics = metrics
+        self.digest = hashlib.sha256()
+        self.hashed = 0
+
+    def _catch_up(self, offset):
+        position = self.f.tell()
+        self.f.seek(self.hashed)
+        while self.hashed < offset:
+            data = self.f.read(min(offset - self.hashed, READ_SIZE))
+            if not data:
+                break
+            self.digest.update(data)
+            self.hashed += len(data)
+        self.f.seek(position)
+
+    def read(self, size=-1):
+        position = self.f.tell()
+        if position > self.hashed:
+            # a resumed upload starts past data an earlier run sent
+            self._catch_up(position)
+        if self.metrics is None:
+            data = self.f.read(size)
+        else:
+            with self.metrics.timer('read'):
+                data = self.f.read(size)
+        end = position + len(data)
+        if position <= self.hashed < end:
+            self.digest.update(memoryview(data)[self.hashed - position:])
+            self.hashed = end
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def hexdigest(self):
+        self._catch_up(os.fstat(self.f.fileno()).st_size)
+        return self.digest.hexdigest()
+
+
+class HashCache:
+    def __init__(self, db_file=HASH_CACHE_FILE):
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL, PRIMARY KEY (path, kind))"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, entry, kind):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT hash FROM hashes WHERE path = ? AND kind = ? AND size = ? AND mtime_ns = ?",
+                (str(entry.path), kind, entry.size, entry.mtime_ns)).fetchone()
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row[0] if row else None
+
+    def store(self, entry, kind, value):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO hashes (path, kind, size, mtime_ns, hash) VALUES (?, ?, ?, ?, ?)",
+                (str(entry.path), kind, entry.size, entry.mtime_ns, value))
+
+    def get(self, entry, kind):
+        value = self.lookup(entry, kind)
+        if value is not None:
+            return value
+        value = HASH_FUNCTIONS[kind](entry.path)
+        self.store(entry, kind, value)
+        return value
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
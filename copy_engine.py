@@ -0,0 +1,56 @@
+import queue
+import threading
+
+DEFAULT_WORKERS = 4
+
+_STOP = object()
+
+
+class CopyPool:
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=None, should_stop=None, on_error=None, on_start=None):
+        self.workers = max(1, int(workers))
+        self.tasks = queue.Queue(maxsize=queue_size or self.workers * 4)
+        self.should_stop = should_stop or (lambda: False)
+        self.on_error = on_error
+        self.on_start = on_start
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"copy-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, label, func, *args):
+        self.tasks.put((label, func, args))
+
+    def close(self):
+        for _ in self._threads:
+            self.tasks.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self):
+        if self.on_start:
+            self.on_start()
+        while True:
+            task = self.tasks.get()
+            if task is _STOP:
+                return
+            if self.should_stop():
+                continue
+            label, func, args = task
+            try:
+                func(*args)
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(label, e)
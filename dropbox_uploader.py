@@ -0,0 +1,310 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+
+from content_hash import HashingReader
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+FINISH_BATCH_SIZE = 500
+FOLDER_BATCH_SIZE = 1000
+COPY_BATCH_SIZE = 1000
+DELETE_BATCH_SIZE = 1000
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def redirect_session(base_url):
+    import requests
+
+    # the SDK always talks to https://*.dropboxapi.com; this sends those requests to
+    # another server (e.g. a local fake Dropbox) while keeping the API paths
+    class RedirectSession(requests.Session):
+        def request(self, method, url, *args, **kwargs):
+            for host in ('https://api.dropboxapi.com', 'https://content.dropboxapi.com'):
+                if url.startswith(host):
+                    url = base_url.rstrip('/') + url[len(host):]
+                    break
+            return super().request(method, url, *args, **kwargs)
+
+    return RedirectSession()
+
+
+def _client_modified(mtime_ns):
+    return datetime.fromtimestamp(mtime_ns // 1_000_000_000, tz=timezone.utc).replace(tzinfo=None)
+
+
+class DropboxUploader:
+    def __init__(self, dbx, chunk_size=DEFAULT_CHUNK_SIZE, batch_size=FINISH_BATCH_SIZE, on_committed=None,
+                 throttle=None, on_hashed=None, metrics=None):
+        self.dbx = dbx
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.on_committed = on_committed or (lambda label, error, metadata: None)
+        # on_hashed(label, sha256) runs once the file has been read, before its commit
+        self.on_hashed = on_hashed or (lambda label, sha256: None)
+        self.api_calls = 0
+        self._pending = []
+        self._copies = []
+        self._pending_lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._calls_lock = threading.Lock()
+
+    def _call(self, func, *args, **kwargs):
+        with self._calls_lock:
+            self.api_calls += 1
+        if self.metrics is None:
+            return func(*args, **kwargs)
+        with self.metrics.timer('remote'):
+            return func(*args, **kwargs)
+
+    def _read(self, f, size=-1):
+        data = f.read(size)
+        if self.throttle is not None:
+            self.throttle.wait_bytes(len(data))
+        return data
+
+    def _commit_info(self, dropbox_path, mtime_ns):
+        from dropbox.files import CommitInfo, WriteMode
+
+        return CommitInfo(path=dropbox_path, mode=WriteMode('overwrite'),
+                          client_modified=_client_modified(mtime_ns), mute=True)
+
+    def upload(self, label, path, dropbox_path, size, mtime_ns, session=None, on_progress=None):
+        from dropbox.exceptions import ApiError
+        from dropbox.files import UploadSessionCursor, UploadSessionFinishArg
+
+        commit = self._commit_info(dropbox_path, mtime_ns)
+        with open(path, 'rb') as raw:
+            f = HashingReader(raw, self.metrics)
+            if size <= self.chunk_size:
+                # small files are sent in a closed session and committed later in a batch
+                started = self._call(self.dbx.files_upload_session_start, self._read(f), close=True)
+                cursor = UploadSessionCursor(session_id=started.session_id, offset=size)
+                self.on_hashed(label, f.hexdigest())
+                self._queue_commit(label, UploadSessionFinishArg(cursor=cursor, commit=commit))
+                return False
+
+            metadata = None
+            if session is not None:
+                # continue the upload session of an interrupted run
+                f.seek(session['offset'])
+                cursor = UploadSessionCursor(session_id=session['session_id'], offset=session['offset'])
+                try:
+                    metadata = self._send_chunks(f, cursor, commit, size, on_progress)
+                except ApiError:
+                    # the session expired or no longer matches the offset; start over
+                    if self.metrics is not None:
+                        self.metrics.retry()
+                    f.seek(0)
+            if metadata is None:
+                started = self._call(self.dbx.files_upload_session_start, self._read(f, self.chunk_size))
+                cursor = UploadSessionCursor(session_id=started.session_id, offset=f.tell())
+                if on_progress:
+                    on_progress(cursor.session_id, cursor.offset)
+                metadata = self._send_chunks(f, cursor, commit, size, on_progress)
+            self.on_hashed(label, f.hexdigest())
+        self.on_committed(label, None, metadata)
+        return True
+
+    def _send_chunks(self, f, cursor, commit, size, on_progress):
+        while True:
+            data = self._read(f, self.chunk_size)
+            if f.tell() >= size or not data:
+                return self._call(self.dbx.files_upload_session_finish, data, cursor, commit)
+            self._call(self.dbx.files_upload_session_append_v2, data, cursor)
+            cursor.offset = f.tell()
+            if on_progress:
+                on_progress(cursor.session_id, cursor.offset)
+
+    def _queue_commit(self, label, finish_arg):
+        with self._pending_lock:
+            self._pending.append((label, finish_arg))
+            if len(self._pending) < self.batch_size:
+                return
+            batch, self._pending = self._pending, []
+        self._finish_batch(batch)
+
+    def queue_copy(self, label, from_path, to_path):
+        from dropbox.files import RelocationPath
+
+        with self._pending_lock:
+            self._copies.append((label, RelocationPath(from_path=from_path, to_path=to_path)))
+            if len(self._copies) < COPY_BATCH_SIZE:
+                return
+            batch, self._copies = self._copies, []
+        self._copy_batch(batch)
+
+    def flush(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+            copies, self._copies = self._copies, []
+        if batch:
+            self._finish_batch(batch)
+        if copies:
+            self._copy_batch(copies)
+
+    def _copy_batch(self, batch):
+        try:
+            with self._commit_lock:
+                launch = self._call(self.dbx.files_copy_batch_v2, [path for _, path in batch], autorename=False)
+                if launch.is_complete():
+                    results = launch.get_complete().entries
+                else:
+                    job_id = launch.get_async_job_id()
+                    while True:
+                        time.sleep(1)
+                        status = self._call(self.dbx.files_copy_batch_check_v2, job_id)
+                        if status.is_complete():
+                            results = status.get_complete().entries
+                            break
+        except Exception as e:
+            for label, _ in batch:
+                self.on_committed(label, e, None)
+            return
+        for (label, _), result in zip(batch, results):
+            if result.is_success():
+                self.on_committed(label, None, result.get_success())
+            else:
+                self.on_committed(label, result.get_failure(), None)
+
+    def upload_bytes(self, data, dropbox_path):
+        from dropbox.files import WriteMode
+
+        if self.throttle is not None:
+            self.throttle.wait_bytes(len(data))
+        return self._call(self.dbx.files_upload, data, dropbox_path, mode=WriteMode('overwrite'), mute=True)
+
+    def download(self, dropbox_path):
+        _, response = self._call(self.dbx.files_download, dropbox_path)
+        return response.content
+
+    def hash_file(self, dropbox_path):
+        from dropbox.exceptions import ApiError
+
+        try:
+            _, response = self._call(self.dbx.files_download, dropbox_path)
+        except ApiError as e:
+            if e.error.is_path() and e.error.get_path().is_not_found():
+                raise FileNotFoundError(dropbox_path)
+            raise
+        digest = hashlib.sha256()
+        with response:
+            for data in response.iter_content(HASH_BUFFER_SIZE):
+                digest.update(data)
+        return digest.hexdigest()
+
+    def read_range(self, dropbox_path, offset, size):
+        # /files/download honours a Range header; the SDK only exposes it through a
+        # client clone with extra headers
+        ranged = self.dbx.clone(headers={'Range': f"bytes={offset}-{offset + size - 1}"})
+        _, response = self._call(ranged.files_download, dropbox_path)
+        return response.content
+
+    def list_backups(self, folder_path, exclude=None):
+        from dropbox.exceptions import ApiError
+        from dropbox.files import FolderMetadata
+
+        names = []
+        try:
+            result = self._call(self.dbx.files_list_folder, folder_path)
+        except ApiError as e:
+            # the folder is only created by the first backup
+            if e.error.is_path() and e.error.get_path().is_not_found():
+                return []
+            raise
+        while True:
+            names.extend(entry.name for entry in result.entries
+                         if isinstance(entry, FolderMetadata) and entry.name.startswith('backup_'))
+            if not result.has_more:
+                break
+            result = self._call(self.dbx.files_list_folder_continue, result.cursor)
+        return sorted(name for name in names if name != exclude)
+
+    def list_tree(self, path):
+        from dropbox.files import FileMetadata
+
+        files = {}
+        prefix_length = len(path) + 1
+        result = self._call(self.dbx.files_list_folder, path, recursive=True)
+        while True:
+            for entry in result.entries:
+                if isinstance(entry, FileMetadata):
+                    files[entry.path_display[prefix_length:]] = {'size': entry.size, 'content_hash': entry.content_hash}
+            if not result.has_more:
+                break
+            result = self._call(self.dbx.files_list_folder_continue, result.cursor)
+        return files
+
+    def _finish_batch(self, batch):
+        try:
+            results = self._commit(batch)
+        except Exception as e:
+            for label, _ in batch:
+                self.on_committed(label, e, None)
+            return
+        for (label, _), result in zip(batch, results):
+            if result.is_success():
+                self.on_committed(label, None, result.get_success())
+            else:
+                self.on_committed(label, result.get_failure(), None)
+
+    def _commit(self, batch):
+        entries = [finish_arg for _, finish_arg in batch]
+        # commits to one namespace are serialised by Dropbox; sending batches one at a
+        # time avoids too_many_write_operations errors between our own workers
+        with self._commit_lock:
+            if hasattr(self.dbx, 'files_upload_session_finish_batch_v2'):
+                return self._call(self.dbx.files_upload_session_finish_batch_v2, entries).entries
+
+            launch = self._call(self.dbx.files_upload_session_finish_batch, entries)
+            if launch.is_complete():
+                return launch.get_complete().entries
+            job_id = launch.get_async_job_id()
+            while True:
+                time.sleep(1)
+                status = self._call(self.dbx.files_upload_session_finish_batch_check, job_id)
+                if status.is_complete():
+                    return status.get_complete().entries
+                if status.is_failed():
+                    raise Exception(f"Error confirmando lote de subidas: {status.get_failed()}")
+
+    def delete_batch(self, paths):
+        # returns the paths that could not be deleted with their errors
+        from dropbox.files import DeleteArg
+
+        failed = []
+        for start in range(0, len(paths), DELETE_BATCH_SIZE):
+            group = paths[start:start + DELETE_BATCH_SIZE]
+            launch = self._call(self.dbx.files_delete_batch, [DeleteArg(path) for path in group])
+            result = launch.get_complete() if launch.is_complete() else None
+            if launch.is_async_job_id():
+                job_id = launch.get_async_job_id()
+                while True:
+                    time.sleep(1)
+                    status = self._call(self.dbx.files_delete_batch_check, job_id)
+                    if status.is_complete():
+                        result = status.get_complete()
+                        break
+                    if status.is_failed():
+                        failed.extend((path, status.get_failed()) for path in group)
+                        break
+            if result is not None:
+                for path, entry in zip(group, result.entries):
+                    if entry.is_failure():
+                        failed.append((path, entry.get_failure()))
+        return failed
+
+    def create_folders(self, paths):
+        paths = sorted(paths)
+        for start in range(0, len(paths), FOLDER_BATCH_SIZE):
+            launch = self._call(self.dbx.files_create_folder_batch, paths[start:start + FOLDER_BATCH_SIZE],
+                                autorename=False, force_async=False)
+            if launch.is_async_job_id():
+                job_id = launch.get_async_job_id()
+                while True:
+                    time.sleep(1)
+                    status = self._call(self.dbx.files_create_folder_batch_check, job_id)
+                    if not status.is_in_progress():
+                        break
@@ -0,0 +1,60 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+from collections import deque
+from datetime import datetime
+
+LOG_FILE = "diskguardian.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+
+def create_file_logger(log_file=LOG_FILE, background=False):
+    logger = logging.getLogger("diskguardian")
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        if background:
+            # the logging thread only queues the line; a listener thread writes the file.
+            # The queue is unbounded, so a burst of lines is never dropped from the file
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(log_queue, handler)
+            listener.start()
+            atexit.register(listener.stop)
+            handler = logging.handlers.QueueHandler(log_queue)
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+class UIEventBus:
+    def __init__(self, file_logger=None, max_pending=10000):
+        # deque.append/popleft are atomic, so the worker threads never take a lock. Only
+        # the on-screen copy is bounded; every line goes to file_logger as it is logged
+        self._lines = deque(maxlen=max_pending)
+        self._file_logger = file_logger
+        self._progress = None
+        self._status = None
+
+    def log(self, message):
+        line = f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}"
+        if self._file_logger is not None:
+            self._file_logger.info(line)
+        self._lines.append(line)
+
+    def progress(self, value, status=""):
+        self._progress = value
+        if status:
+            self._status = status
+
+    def drain(self):
+        lines = []
+        try:
+            while True:
+                lines.append(self._lines.popleft())
+        except IndexError:
+            pass
+        return lines, self._progress, self._status
@@ -0,0 +1,139 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+
+BUFFER_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409
+
+METHODS = ('reflink', 'copy_file_range', 'sendfile', 'buffer')
+# errors meaning the method does not work between these two files (another filesystem,
+# no support in the filesystem or the kernel); anything else is an error of the file
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EINVAL, errno.ETXTBSY,
+                      errno.ENOTTY}
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _reflink(src_fd, dst_fd, size, throttle=None):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "reflink no disponible")
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, size, throttle=None):
+    # a throttled copy goes in buffer-sized steps so the rate limit can act between them
+    step = BUFFER_SIZE if throttle is not None else 1 << 30
+    copied = 0
+    while copied < size:
+        count = min(size - copied, step)
+        if throttle is not None:
+            throttle.wait_bytes(count)
+        sent = os.copy_file_range(src_fd, dst_fd, count)
+        if sent == 0:
+            break
+        copied += sent
+    if copied == 0 and size:
+        raise OSError(errno.EOPNOTSUPP, "copy_file_range no copió datos")
+
+
+def _sendfile(src_fd, dst_fd, size, throttle=None):
+    step = BUFFER_SIZE if throttle is not None else 1 << 30
+    offset = 0
+    while offset < size:
+        count = min(size - offset, step)
+        if throttle is not None:
+            throttle.wait_bytes(count)
+        sent = os.sendfile(dst_fd, src_fd, offset, count)
+        if sent == 0:
+            break
+        offset += sent
+    if offset == 0 and size:
+        raise OSError(errno.EOPNOTSUPP, "sendfile no copió datos")
+
+
+def _buffer_copy(src_fd, dst_fd, size, throttle=None):
+    with os.fdopen(src_fd, 'rb', buffering=0, closefd=False) as fsrc, \
+            os.fdopen(dst_fd, 'wb', buffering=0, closefd=False) as fdst:
+        if throttle is None:
+            shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+            return
+        while True:
+            data = fsrc.read(BUFFER_SIZE)
+            if not data:
+                break
+            throttle.wait_bytes(len(data))
+            fdst.write(data)
+
+
+def _hashing_copy(src_fd, dst_fd, size, throttle, digest):
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with os.fdopen(src_fd, 'rb', buffering=0, closefd=False) as fsrc, \
+            os.fdopen(dst_fd, 'wb', buffering=0, closefd=False) as fdst:
+        while True:
+            count = fsrc.readinto(buffer)
+            if not count:
+                break
+            if throttle is not None:
+                throttle.wait_bytes(count)
+            digest.update(view[:count])
+            written = 0
+            while written < count:
+                written += fdst.write(view[written:count])
+
+
+_BACKENDS = [
+    ('reflink', _reflink),
+    ('copy_file_range', _copy_file_range if hasattr(os, 'copy_file_range') else None),
+    ('sendfile', _sendfile if hasattr(os, 'sendfile') and sys.platform.startswith('linux') else None),
+    ('buffer', _buffer_copy),
+]
+
+
+class FastCopier:
+    def __init__(self, throttle=None):
+        self.throttle = throttle
+        self.disabled = set()
+        self.counts = dict.fromkeys(METHODS, 0)
+        self._lock = threading.Lock()
+
+    def copy(self, src, dst, digest=None):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            src_fd = fsrc.fileno()
+            dst_fd = fdst.fileno()
+            size = os.fstat(src_fd).st_size
+            method = None
+            if digest is not None:
+                # the checksum needs the data in user space, so the source is read once
+                # through a buffer instead of being copied inside the kernel
+                _hashing_copy(src_fd, dst_fd, size, self.throttle, digest)
+                method = 'buffer'
+            for name, func in _BACKENDS:
+                if method is not None:
+                    break
+                if func is None or name in self.disabled:
+                    continue
+                try:
+                    func(src_fd, dst_fd, size, self.throttle)
+                    method = name
+                except OSError as e:
+                    if name == 'buffer' or e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    # a backend that is not supported here will fail for every file on
+                    # this destination, so stop trying it for the run
+                    self.disabled.add(name)
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+                    os.ftruncate(dst_fd, 0)
+        shutil.copystat(src, dst)
+        with self._lock:
+            self.counts[method] += 1
+        return method
+
+    def summary(self):
+        return ", ".join(f"{name}: {count}" for name, count in self.counts.items() if count)
@@ -0,0 +1,134 @@
+import os
+import re
+import time
+
+COMMON_EXCLUDES = [
+    'node_modules/', '.git/', '__pycache__/', '.cache/', '.venv/', 'venv/', '.tox/', '.gradle/',
+    'build/', 'dist/', 'target/', '*.tmp', '*.temp', '*.swp', '~$*', 'Thumbs.db', '.DS_Store',
+]
+
+_FLAGS = re.IGNORECASE if os.name == 'nt' else 0
+
+
+def _translate(pattern):
+    # gitignore glob -> regex over a '/'-separated path relative to the source root
+    i = 0
+    out = []
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f"[{body.replace(chr(92), chr(92) * 2)}]")
+                i = end
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def _compile_rule(line):
+    negate = line.startswith('!')
+    if negate:
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    # like .gitignore, a pattern with a slash is anchored to the root; one without
+    # matches the name at any depth
+    if '/' in line:
+        regex = '^' + _translate(line.lstrip('/')) + '$'
+    else:
+        regex = '(?:^|/)' + _translate(line) + '$'
+    return negate, dir_only, regex
+
+
+def _parse_patterns(patterns):
+    if isinstance(patterns, str):
+        patterns = patterns.splitlines()
+    rules = []
+    for line in patterns:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            rules.append(line)
+    return rules
+
+
+class FileFilter:
+    def __init__(self, exclude=(), include=(), max_size=None, max_age_days=None):
+        self.exclude = _parse_patterns(exclude)
+        self.include = _parse_patterns(include)
+        self.max_size = max_size or None
+        self.min_mtime_ns = int((time.time() - max_age_days * 86400) * 1e9) if max_age_days else None
+
+        # consecutive rules of the same kind are merged into one alternation, so a
+        # path is checked against a few regexes however many patterns there are
+        self._groups = []
+        for rule in filter(None, map(_compile_rule, self.exclude)):
+            negate, dir_only, regex = rule
+            if self._groups and self._groups[-1][0] == negate:
+                self._groups[-1][1 if dir_only else 2].append(regex)
+            else:
+                self._groups.append((negate, [regex] if dir_only else [], [] if dir_only else [regex]))
+        self._groups = [(negate, self._join(dir_regexes + any_regexes), self._join(any_regexes))
+                        for negate, dir_regexes, any_regexes in reversed(self._groups)]
+
+        include_rules = [rule[2] for rule in filter(None, map(_compile_rule, self.include))]
+        self._include = self._join(include_rules)
+
+    @staticmethod
+    def _join(regexes):
+        return re.compile('|'.join(f"(?:{regex})" for regex in regexes), _FLAGS) if regexes else None
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(exclude=config.get('exclude', ()), include=config.get('include', ()),
+                   max_size=int(config.get('max_size_mb') or 0) * 1024 * 1024,
+                   max_age_days=int(config.get('max_age_days') or 0))
+
+    @property
+    def active(self):
+        return bool(self._groups or self._include or self.max_size or self.min_mtime_ns)
+
+    def _excluded(self, rel_path, is_dir):
+        # the last matching rule wins, as in .gitignore
+        for negate, dir_regex, file_regex in self._groups:
+            regex = dir_regex if is_dir else file_regex
+            if regex is not None and regex.search(rel_path):
+                return not negate
+        return False
+
+    def skip_dir(self, rel_path):
+        return self._excluded(rel_path, True)
+
+    def skip_file(self, rel_path, size, mtime_ns):
+        if self.max_size and size > self.max_size:
+            return True
+        if self.min_mtime_ns and mtime_ns < self.min_mtime_ns:
+            return True
+        if self._excluded(rel_path, False):
+            return True
+        return self._include is not None and not self._include.search(rel_path)
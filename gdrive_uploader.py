@@ -0,0 +1,392 @@
+import hashlib
+import mimetypes
+import random
+import re
+import threading
+import time
+
+from content_hash import HashingReader
+
+GOOGLE_ROOT = 'https://www.googleapis.com/'
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+FILE_FIELDS = 'id, md5Checksum'
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+BATCH_LIMIT = 100
+ID_BATCH = 1000
+MAX_RETRIES = 8
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def _backoff(attempt):
+    time.sleep(min(2 ** attempt, 64) + random.random())
+
+
+def _quoted(value):
+    # a string literal for the q parameter of files.list; folder and file names are
+    # chosen by the user and may contain quotes
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def _new_http(timeout, api_endpoint=None):
+    import httplib2
+    from urllib.parse import urlsplit
+
+    if not api_endpoint:
+        http = httplib2.Http(timeout=timeout)
+        # Drive answers 308 to every resumable chunk but the last; it is not a redirect
+        http.redirect_codes = http.redirect_codes - {308}
+        return http
+
+    # with api_endpoint set, batches still go to the root URL of the discovery document
+    # and uploads to https on the endpoint's host; this sends both to the endpoint itself
+    parts = urlsplit(api_endpoint)
+    origin = f"{parts.scheme}://{parts.netloc}/"
+    roots = (GOOGLE_ROOT, f"https://{parts.netloc}/")
+
+    class RedirectHttp(httplib2.Http):
+        def request(self, uri, *args, **kwargs):
+            for root in roots:
+                if uri.startswith(root):
+                    uri = origin + uri[len(root):]
+                    break
+            return super().request(uri, *args, **kwargs)
+
+    http = RedirectHttp(timeout=timeout)
+    http.redirect_codes = http.redirect_codes - {308}
+    return http
+
+
+class _DigestSink:
+    # write target for MediaIoBaseDownload that only hashes what it receives
+    def __init__(self):
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return len(data)
+
+
+class DriveUploader:
+    def __init__(self, creds, chunk_size=DEFAULT_CHUNK_SIZE, api_endpoint=None, log=None, on_copied=None,
+                 throttle=None, metrics=None):
+        self.creds = creds
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+        self.metrics = metrics
+        self.api_endpoint = api_endpoint
+        self.log = log or (lambda message: None)
+        self.on_copied = on_copied or (lambda label, error, response: None)
+        self.folder_ids = {}
+        self.pending_folders = []
+        self._copies = []
+        self._copies_lock = threading.Lock()
+        self.api_calls = 0
+        self._ids = []
+        self._local = threading.local()
+        self._calls_lock = threading.Lock()
+
+    def _count_call(self, n=1):
+        with self._calls_lock:
+            self.api_calls += n
+
+    def _call(self, func, *args, **kwargs):
+        self._count_call()
+        if self.metrics is None:
+            return func(*args, **kwargs)
+        with self.metrics.timer('remote'):
+            return func(*args, **kwargs)
+
+    def _retry(self, attempt):
+        if self.metrics is not None:
+            self.metrics.retry()
+        _backoff(attempt)
+
+    def service(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.discovery import build
+
+            # httplib2 connections are not thread-safe, so every worker gets its own
+            http = AuthorizedHttp(self.creds, http=_new_http(120, self.api_endpoint))
+            client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+            service = build('drive', 'v3', http=http, cache_discovery=False, client_options=client_options)
+            self._local.service = service
+        return service
+
+    def _execute(self, request):
+        from googleapiclient.errors import HttpError
+
+        attempt = 0
+        while True:
+            try:
+                return self._call(request.execute)
+            except HttpError as e:
+                if e.resp.status not in RETRYABLE_STATUS or attempt >= MAX_RETRIES:
+                    raise
+            except OSError:
+                if attempt >= MAX_RETRIES:
+                    raise
+            self._retry(attempt)
+            attempt += 1
+
+    def create_folder(self, name, parent_id=None):
+        body = {'name': name, 'mimeType': FOLDER_MIME}
+        if parent_id:
+            body['parents'] = [parent_id]
+        return self._execute(self.service().files().create(body=body, fields='id'))['id']
+
+    def _next_id(self):
+        if not self._ids:
+            self._ids = self._execute(self.service().files().generateIds(count=ID_BATCH, space='drive'))['ids']
+        return self._ids.pop()
+
+    def add_folder(self, rel_path, name, parent_rel):
+        # IDs are generated up front so files can be queued into a folder before the
+        # batch that creates it has been sent
+        folder_id = self._next_id()
+        self.folder_ids[rel_path] = folder_id
+        self.pending_folders.append((rel_path.count('/'), folder_id, name, self.folder_ids[parent_rel]))
+        return folder_id
+
+    def flush_folders(self):
+        if not self.pending_folders:
+            return
+        service = self.service()
+        pending = sorted(self.pending_folders, key=lambda folder: folder[0])
+        self.pending_folders = []
+
+        # a batch may run its requests in any order, so each nesting level gets its own batches
+        levels = {}
+        for depth, folder_id, name, parent_id in pending:
+            levels.setdefault(depth, []).append((folder_id, name, parent_id))
+
+        for depth in sorted(levels):
+            folders = levels[depth]
+            for start in range(0, len(folders), BATCH_LIMIT):
+                group = folders[start:start + BATCH_LIMIT]
+                failed = []
+
+                def callback(request_id, response, exception):
+                    if exception is not None:
+                        failed.append(request_id)
+
+                batch = service.new_batch_http_request(callback=callback)
+                for folder_id, name, parent_id in group:
+                    body = {'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME, 'parents': [parent_id]}
+                    batch.add(service.files().create(body=body, fields='id'), request_id=folder_id)
+                self._call(batch.execute)
+
+                for folder_id, name, parent_id in group:
+                    if folder_id in failed:
+                        body = {'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME, 'parents': [parent_id]}
+                        self._execute(service.files().create(body=body, fields='id'))
+
+    def upload_file(self, path, name, parent_id, size, session=None, on_progress=None):
+        # the response gets a 'sha256' key with the checksum of the data read for the upload
+        mimetype = mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+        with open(path, 'rb') as f:
+            reader = HashingReader(f, self.metrics)
+            response = self._upload_stream(reader, mimetype, body={'name': name, 'parents': [parent_id]},
+                                           size=size, session=session, on_progress=on_progress)
+            response['sha256'] = reader.hexdigest()
+        return response
+
+    def _upload_stream(self, reader, mimetype, body, size, session, on_progress):
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaIoBaseUpload
+
+        service = self.service()
+        if size <= self.chunk_size:
+            if self.throttle is not None:
+                self.throttle.wait_bytes(size)
+            media = MediaIoBaseUpload(reader, mimetype=mimetype, resumable=False)
+            return self._execute(service.files().create(body=body, media_body=media, fields=FILE_FIELDS))
+
+        media = MediaIoBaseUpload(reader, mimetype=mimetype, chunksize=self.chunk_size, resumable=True)
+        request = service.files().create(body=body, media_body=media, fields=FILE_FIELDS)
+        if session is not None:
+            # continue the resumable session of an interrupted run from its last confirmed offset
+            request.resumable_uri = session['uri']
+            request.resumable_progress = session['offset']
+        response = None
+        attempt = 0
+        while response is None:
+            try:
+                if self.throttle is not None:
+                    self.throttle.wait_bytes(min(self.chunk_size, max(size - request.resumable_progress, 0)))
+                status, response = self._call(request.next_chunk)
+                attempt = 0
+                if status is not None and on_progress:
+                    on_progress(request.resumable_uri, status.resumable_progress)
+            except HttpError as e:
+                if session is not None and e.resp.status in (404, 410):
+                    # the saved session expired; upload the file again from the start
+                    session = None
+                    request = service.files().create(body=body, media_body=media, fields=FILE_FIELDS)
+                    continue
+                if e.resp.status not in RETRYABLE_STATUS or attempt >= MAX_RETRIES:
+                    raise
+                # the request keeps its resumable session URI, so the next call asks the
+                # server for the committed offset and continues from there
+                self._retry(attempt)
+                attempt += 1
+            except OSError:
+                if attempt >= MAX_RETRIES:
+                    raise
+                self._retry(attempt)
+                attempt += 1
+        return response
+
+    def upload_bytes(self, data, name, parent_id):
+        import io
+        from googleapiclient.http import MediaIoBaseUpload
+
+        if self.throttle is not None:
+            self.throttle.wait_bytes(len(data))
+        body = {'name': name, 'parents': [parent_id]}
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype='application/octet-stream', resumable=False)
+        return self._execute(self.service().files().create(body=body, media_body=media, fields=FILE_FIELDS))
+
+    def find_file(self, name, parent_id):
+        result = self._execute(self.service().files().list(
+            q=f"name = {_quoted(name)} and {_quoted(parent_id)} in parents and trashed = false", fields='files(id)'))
+        files = result.get('files', [])
+        return files[0]['id'] if files else None
+
+    def download(self, file_id):
+        return self._execute(self.service().files().get_media(fileId=file_id))
+
+    def hash_file(self, file_id):
+        # streamed in chunk_size pieces, so checking a large file never holds it in memory
+        from googleapiclient.errors import HttpError
+        from googleapiclient.http import MediaIoBaseDownload
+
+        sink = _DigestSink()
+        downloader = MediaIoBaseDownload(sink, self.service().files().get_media(fileId=file_id),
+                                         chunksize=self.chunk_size)
+        done = False
+        while not done:
+            try:
+                _, done = self._call(downloader.next_chunk, num_retries=MAX_RETRIES)
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise FileNotFoundError(file_id)
+                raise
+        return sink.digest.hexdigest()
+
+    def read_range(self, file_id, offset, size):
+        request = self.service().files().get_media(fileId=file_id)
+        request.headers['Range'] = f"bytes={offset}-{offset + size - 1}"
+        return self._execute(request)
+
+    def queue_copy(self, label, file_id, name, parent_id):
+        with self._copies_lock:
+            self._copies.append((label, file_id, name, parent_id))
+            if len(self._copies) < BATCH_LIMIT:
+                return
+            group, self._copies = self._copies, []
+        self._copy_batch(group)
+
+    def flush_copies(self):
+        with self._copies_lock:
+            group, self._copies = self._copies, []
+        if group:
+            self._copy_batch(group)
+
+    def _copy_batch(self, group):
+        service = self.service()
+        results = {}
+
+        def callback(request_id, response, exception):
+            results[request_id] = (exception, response)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for i, (label, file_id, name, parent_id) in enumerate(group):
+            body = {'name': name, 'parents': [parent_id]}
+            batch.add(service.files().copy(fileId=file_id, body=body, fields=FILE_FIELDS), request_id=str(i))
+        try:
+            self._call(batch.execute)
+        except Exception as e:
+            for label, *_ in group:
+                self.on_copied(label, e, None)
+            return
+
+        for i, (label, file_id, name, parent_id) in enumerate(group):
+            exception, response = results.get(str(i), (None, None))
+            if exception is not None or response is None:
+                try:
+                    body = {'name': name, 'parents': [parent_id]}
+                    response = self._execute(service.files().copy(fileId=file_id, body=body, fields=FILE_FIELDS))
+                except Exception as e:
+                    self.on_copied(label, e, None)
+                    continue
+            self.on_copied(label, None, response)
+
+    def delete_files(self, file_ids):
+        # deleting a folder removes everything inside it, so a whole backup is one request;
+        # returns the ids that could not be deleted with their errors
+        from googleapiclient.errors import HttpError
+
+        service = self.service()
+        failed = []
+        for start in range(0, len(file_ids), BATCH_LIMIT):
+            group = file_ids[start:start + BATCH_LIMIT]
+            errors = {}
+
+            def callback(request_id, response, exception):
+                if exception is not None:
+                    errors[request_id] = exception
+
+            batch = service.new_batch_http_request(callback=callback)
+            for file_id in group:
+                batch.add(service.files().delete(fileId=file_id), request_id=file_id)
+            self._call(batch.execute)
+
+            for file_id in errors:
+                try:
+                    self._execute(service.files().delete(fileId=file_id))
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        failed.append((file_id, e))
+        return failed
+
+    def list_backups(self, prefix, exclude=None):
+        query = f"mimeType = {_quoted(FOLDER_MIME)} and name contains {_quoted(prefix + '_')} and trashed = false"
+        # only this profile's folders: "Backup_fotos_..." must not match the prefix "Backup"
+        pattern = re.compile(re.escape(prefix) + r'_\d{8}_\d{6}')
+        folders = {}
+        page_token = None
+        while True:
+            result = self._execute(self.service().files().list(
+                q=query, fields='nextPageToken, files(id, name)', pageSize=1000, pageToken=page_token))
+            for folder in result.get('files', []):
+                if pattern.fullmatch(folder['name']) and folder['name'] != exclude:
+                    folders[folder['name']] = folder['id']
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+        return dict(sorted(folders.items()))
+
+    def list_tree(self, folder_id):
+        files = {}
+        pending = [(folder_id, '')]
+        while pending:
+            parent_id, rel_dir = pending.pop()
+            page_token = None
+            while True:
+                result = self._execute(self.service().files().list(
+                    q=f"{_quoted(parent_id)} in parents and trashed = false",
+                    fields='nextPageToken, files(id, name, mimeType, size, md5Checksum)',
+                    pageSize=1000, pageToken=page_token))
+                for item in result.get('files', []):
+                    rel_path = f"{rel_dir}/{item['name']}" if rel_dir else item['name']
+                    if item['mimeType'] == FOLDER_MIME:
+                        pending.append((item['id'], rel_path))
+                    else:
+                        files[rel_path] = {'size': int(item.get('size', 0)), 'md5': item.get('md5Checksum'),
+                                           'id': item['id']}
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    break
+        return files
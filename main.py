@@ -1,24 +1,49 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext, simpledialog
 import threading
+import multiprocessing
+import argparse
 import json
 import os
 from datetime import datetime
 from pathlib import Path
 from backup_manager import BackupManager
 from config_manager import ConfigManager
+from copy_engine import DEFAULT_WORKERS
+from event_bus import UIEventBus, create_file_logger
+from filters import COMMON_EXCLUDES
+from run_metrics import RunHistory, describe_run
+from scheduler import schedule_cron
+
+UI_REFRESH_MS = 100
+MAX_LOG_LINES = 2000
+# profile key -> variable holding it, for the fields shown by each destination type
+DESTINATION_FIELDS = {
+    'local': {'path': 'local_path', 'mode': 'local_mode', 'checksums': 'local_checksums'},
+    'nas': {'server': 'nas_server', 'share': 'nas_share', 'username': 'nas_user', 'password': 'nas_password',
+            'mode': 'nas_mode'},
+    'gdrive': {'folder_name': 'gdrive_folder', 'mode': 'gdrive_mode', 'pack_small_files': 'gdrive_packs'},
+    'dropbox': {'folder_path': 'dropbox_folder', 'mode': 'dropbox_mode', 'pack_small_files': 'dropbox_packs'},
+    'repository': {'path': 'repository_path'},
+    'archive': {'path': 'archive_path'},
+}
 
 class BackupApp:
-    def __init__(self, root):
+    def __init__(self, root, force_profiling=False):
         self.root = root
+        self.force_profiling = force_profiling
         self.root.title("Sistema de Copias de Seguridad")
         self.root.geometry("900x700")
         
         self.config_manager = ConfigManager()
+        self.event_bus = UIEventBus(create_file_logger(background=True))
         self.backup_manager = BackupManager(self.log_message)
+        self.shown_progress = None
+        self.shown_status = None
         
         self.setup_ui()
         self.load_profiles()
+        self.root.after(UI_REFRESH_MS, self.process_events)
         
     def setup_ui(self):
         notebook = ttk.Notebook(self.root)
@@ -64,6 +89,78 @@ class BackupApp:
         ttk.Button(btn_frame, text="Agregar Carpeta", command=self.add_source_folder).pack(side='left', padx=2)
         ttk.Button(btn_frame, text="Eliminar", command=self.remove_source_folder).pack(side='left', padx=2)
         
+        filter_frame = ttk.LabelFrame(main_frame, text="Filtros", padding="10")
+        filter_frame.pack(fill='x', pady=5)
+        
+        ttk.Label(filter_frame, text="Excluir (un patrón por línea, estilo .gitignore; ! para volver a incluir):").pack(anchor='w')
+        self.exclude_text = tk.Text(filter_frame, height=3)
+        self.exclude_text.pack(fill='x', pady=2)
+        
+        ttk.Label(filter_frame, text="Incluir solo (patrones separados por espacios, vacío = todo):").pack(anchor='w')
+        self.include_patterns = tk.StringVar()
+        ttk.Entry(filter_frame, textvariable=self.include_patterns).pack(fill='x', pady=2)
+        
+        limits_frame = ttk.Frame(filter_frame)
+        limits_frame.pack(fill='x', pady=2)
+        ttk.Label(limits_frame, text="Tamaño máximo (MB, 0 = sin límite):").pack(side='left')
+        self.max_size_mb = tk.StringVar(value="0")
+        ttk.Spinbox(limits_frame, from_=0, to=1048576, textvariable=self.max_size_mb, width=7).pack(side='left', padx=5)
+        ttk.Label(limits_frame, text="Antigüedad máxima (días, 0 = sin límite):").pack(side='left')
+        self.max_age_days = tk.StringVar(value="0")
+        ttk.Spinbox(limits_frame, from_=0, to=36500, textvariable=self.max_age_days, width=6).pack(side='left', padx=5)
+        ttk.Button(limits_frame, text="Exclusiones habituales", command=self.add_common_excludes).pack(side='right')
+        
+        throttle_frame = ttk.LabelFrame(main_frame, text="Límites de velocidad", padding="10")
+        throttle_frame.pack(fill='x', pady=5)
+        
+        rates_frame = ttk.Frame(throttle_frame)
+        rates_frame.pack(fill='x', pady=2)
+        ttk.Label(rates_frame, text="MB/s (0 = sin límite):").pack(side='left')
+        self.max_mb_per_sec = tk.StringVar(value="0")
+        ttk.Spinbox(rates_frame, from_=0, to=10000, increment=0.5, textvariable=self.max_mb_per_sec, width=7).pack(side='left', padx=5)
+        ttk.Label(rates_frame, text="Archivos/s (0 = sin límite):").pack(side='left')
+        self.max_files_per_sec = tk.StringVar(value="0")
+        ttk.Spinbox(rates_frame, from_=0, to=100000, textvariable=self.max_files_per_sec, width=7).pack(side='left', padx=5)
+        
+        self.low_priority = tk.BooleanVar(value=False)
+        ttk.Checkbutton(throttle_frame, text="Prioridad baja de CPU y disco", 
+                       variable=self.low_priority).pack(anchor='w')
+        self.adaptive_throttle = tk.BooleanVar(value=False)
+        ttk.Checkbutton(throttle_frame, text="Reducir la velocidad cuando el disco de origen esté ocupado", 
+                       variable=self.adaptive_throttle).pack(anchor='w')
+        
+        retention_frame = ttk.LabelFrame(main_frame, text="Retención", padding="10")
+        retention_frame.pack(fill='x', pady=5)
+        
+        keep_frame = ttk.Frame(retention_frame)
+        keep_frame.pack(fill='x', pady=2)
+        self.keep_vars = {}
+        for key, label in (('keep_last', "Últimas:"), ('keep_daily', "Diarias:"),
+                           ('keep_weekly', "Semanales:"), ('keep_monthly', "Mensuales:")):
+            ttk.Label(keep_frame, text=label).pack(side='left')
+            self.keep_vars[key] = tk.StringVar(value="0")
+            ttk.Spinbox(keep_frame, from_=0, to=1000, textvariable=self.keep_vars[key], width=4).pack(side='left', padx=(2, 8))
+        ttk.Label(keep_frame, text="Tamaño máximo (GB):").pack(side='left')
+        self.max_total_gb = tk.StringVar(value="0")
+        ttk.Spinbox(keep_frame, from_=0, to=1000000, textvariable=self.max_total_gb, width=7).pack(side='left', padx=2)
+        
+        retention_actions = ttk.Frame(retention_frame)
+        retention_actions.pack(fill='x', pady=2)
+        self.auto_prune = tk.BooleanVar(value=False)
+        ttk.Checkbutton(retention_actions, text="Eliminar copias antiguas después de cada copia (0 = conservar todas)", 
+                       variable=self.auto_prune).pack(side='left')
+        ttk.Button(retention_actions, text="Aplicar ahora", command=self.apply_retention).pack(side='right')
+        
+        profiling_frame = ttk.LabelFrame(main_frame, text="Diagnóstico", padding="10")
+        profiling_frame.pack(fill='x', pady=5)
+        
+        self.profiling_enabled = tk.BooleanVar(value=False)
+        ttk.Checkbutton(profiling_frame, text="Perfilar el rendimiento de la copia (muestras de CPU y fases)", 
+                       variable=self.profiling_enabled).pack(side='left')
+        self.profiling_memory = tk.BooleanVar(value=False)
+        ttk.Checkbutton(profiling_frame, text="Incluir memoria (más lento durante los primeros 30 s)", 
+                       variable=self.profiling_memory).pack(side='left', padx=10)
+        
         dest_frame = ttk.LabelFrame(main_frame, text="Destino", padding="10")
         dest_frame.pack(fill='x', pady=5)
         
@@ -78,6 +175,10 @@ class BackupApp:
                        value="gdrive", command=self.update_destination_ui).pack(anchor='w')
         ttk.Radiobutton(dest_frame, text="Dropbox", variable=self.dest_type, 
                        value="dropbox", command=self.update_destination_ui).pack(anchor='w')
+        ttk.Radiobutton(dest_frame, text="Repositorio deduplicado", variable=self.dest_type, 
+                       value="repository", command=self.update_destination_ui).pack(anchor='w')
+        ttk.Radiobutton(dest_frame, text="Archivo comprimido", variable=self.dest_type, 
+                       value="archive", command=self.update_destination_ui).pack(anchor='w')
         
         self.dest_config_frame = ttk.Frame(dest_frame)
         self.dest_config_frame.pack(fill='x', pady=5)
@@ -93,6 +194,16 @@ class BackupApp:
         
         ttk.Button(action_frame, text="Detener", command=self.stop_backup).pack(side='left', padx=5)
         
+        self.resume_backup = tk.BooleanVar(value=False)
+        ttk.Checkbutton(action_frame, text="Reanudar la última copia interrumpida", 
+                       variable=self.resume_backup).pack(side='left', padx=5)
+        
+        self.verify_sample = tk.StringVar(value="100")
+        ttk.Spinbox(action_frame, from_=1, to=100, textvariable=self.verify_sample, width=5).pack(side='right', padx=5)
+        ttk.Label(action_frame, text="Muestra (%):").pack(side='right')
+        self.verify_btn = ttk.Button(action_frame, text="Verificar última copia", command=self.verify_backup)
+        self.verify_btn.pack(side='right', padx=5)
+        
         progress_frame = ttk.LabelFrame(main_frame, text="Progreso", padding="10")
         progress_frame.pack(fill='both', expand=True, pady=5)
         
@@ -116,18 +227,31 @@ class BackupApp:
         ttk.Label(main_frame, text="Programar copias de seguridad automáticas", 
                  font=('', 12, 'bold')).pack(anchor='w', pady=10)
         
-        self.schedule_enabled = tk.BooleanVar()
+        schedule_config = self.config_manager.get_schedule()
+        
+        self.schedule_enabled = tk.BooleanVar(value=schedule_config.get('enabled', False))
         ttk.Checkbutton(main_frame, text="Activar programación automática", 
                        variable=self.schedule_enabled).pack(anchor='w', pady=5)
+        self.schedule_catch_up = tk.BooleanVar(value=schedule_config.get('catch_up', True))
+        ttk.Checkbutton(main_frame, text="Al arrancar el servicio, hacer la copia que se perdió mientras estaba detenido", 
+                       variable=self.schedule_catch_up).pack(anchor='w', pady=5)
         
         freq_frame = ttk.LabelFrame(main_frame, text="Frecuencia", padding="10")
         freq_frame.pack(fill='x', pady=10)
         
-        self.frequency = tk.StringVar(value="daily")
+        self.frequency = tk.StringVar(value=schedule_config.get('frequency', "daily"))
         ttk.Radiobutton(freq_frame, text="Diaria", variable=self.frequency, value="daily").pack(anchor='w')
         ttk.Radiobutton(freq_frame, text="Semanal", variable=self.frequency, value="weekly").pack(anchor='w')
         ttk.Radiobutton(freq_frame, text="Mensual", variable=self.frequency, value="monthly").pack(anchor='w')
         
+        cron_frame = ttk.Frame(freq_frame)
+        cron_frame.pack(anchor='w')
+        ttk.Radiobutton(cron_frame, text="Expresión cron:", variable=self.frequency, value="cron").pack(side='left')
+        self.cron_var = tk.StringVar(value=schedule_config.get('cron', "0 2 * * *"))
+        ttk.Entry(cron_frame, textvariable=self.cron_var, width=20).pack(side='left', padx=5)
+        ttk.Label(freq_frame, text="minuto hora día mes día-semana; la hora de abajo no se usa", 
+                 foreground='gray').pack(anchor='w')
+        
         time_frame = ttk.LabelFrame(main_frame, text="Hora de ejecución", padding="10")
         time_frame.pack(fill='x', pady=10)
         
@@ -135,17 +259,19 @@ class BackupApp:
         time_input_frame.pack(anchor='w')
         
         ttk.Label(time_input_frame, text="Hora:").pack(side='left', padx=5)
-        self.hour_var = tk.StringVar(value="02")
+        self.hour_var = tk.StringVar(value=schedule_config.get('hour', "02"))
         ttk.Spinbox(time_input_frame, from_=0, to=23, textvariable=self.hour_var, 
                    width=5, format="%02.0f").pack(side='left')
         
         ttk.Label(time_input_frame, text="Minutos:").pack(side='left', padx=5)
-        self.minute_var = tk.StringVar(value="00")
+        self.minute_var = tk.StringVar(value=schedule_config.get('minute', "00"))
         ttk.Spinbox(time_input_frame, from_=0, to=59, textvariable=self.minute_var, 
                    width=5, format="%02.0f").pack(side='left')
         
         ttk.Button(main_frame, text="Guardar Programación", 
                   command=self.save_schedule).pack(pady=20)
+        ttk.Label(main_frame, text="Las copias programadas las ejecuta el servicio: python cli.py daemon", 
+                 foreground='gray').pack(anchor='w')
         
     def setup_profiles_tab(self):
         main_frame = ttk.Frame(self.tab_profiles, padding="10")
@@ -190,6 +316,12 @@ class BackupApp:
         ttk.Entry(cred_frame, textvariable=self.gdrive_cred_path, state='readonly').pack(side='left', fill='x', expand=True)
         ttk.Button(cred_frame, text="Seleccionar", command=self.select_gdrive_credentials).pack(side='left', padx=5)
         
+        chunk_frame = ttk.Frame(gdrive_frame)
+        chunk_frame.pack(anchor='w')
+        ttk.Label(chunk_frame, text="Tamaño de bloque de subida (MB):").pack(side='left')
+        self.gdrive_chunk_mb = tk.StringVar(value=str(self.config_manager.config.get('gdrive_chunk_mb', 8)))
+        ttk.Spinbox(chunk_frame, from_=1, to=256, textvariable=self.gdrive_chunk_mb, width=5).pack(side='left', padx=5)
+        
         dropbox_frame = ttk.LabelFrame(main_frame, text="Dropbox", padding="10")
         dropbox_frame.pack(fill='x', pady=10)
         
@@ -197,6 +329,32 @@ class BackupApp:
         self.dropbox_token = tk.StringVar()
         ttk.Entry(dropbox_frame, textvariable=self.dropbox_token, show='*').pack(fill='x', pady=5)
         
+        performance_frame = ttk.LabelFrame(main_frame, text="Rendimiento", padding="10")
+        performance_frame.pack(fill='x', pady=10)
+        
+        workers_frame = ttk.Frame(performance_frame)
+        workers_frame.pack(anchor='w')
+        ttk.Label(workers_frame, text="Copias o subidas simultáneas:").pack(side='left')
+        self.copy_workers = tk.StringVar(value=str(self.config_manager.config.get('copy_workers', DEFAULT_WORKERS)))
+        ttk.Spinbox(workers_frame, from_=1, to=64, textvariable=self.copy_workers, width=5).pack(side='left', padx=5)
+        
+        pack_frame = ttk.Frame(performance_frame)
+        pack_frame.pack(anchor='w')
+        ttk.Label(pack_frame, text="Tamaño máximo de archivo empaquetado (KB):").pack(side='left')
+        self.pack_threshold_kb = tk.StringVar(value=str(self.config_manager.config.get('pack_threshold_kb', 256)))
+        ttk.Spinbox(pack_frame, from_=1, to=65536, textvariable=self.pack_threshold_kb, width=6).pack(side='left', padx=5)
+        
+        metrics_frame = ttk.LabelFrame(main_frame, text="Métricas", padding="10")
+        metrics_frame.pack(fill='x', pady=10)
+        
+        ttk.Label(metrics_frame, text="Archivo de métricas para Prometheus (opcional, .prom):").pack(anchor='w')
+        metrics_file_frame = ttk.Frame(metrics_frame)
+        metrics_file_frame.pack(fill='x', pady=5)
+        self.metrics_file = tk.StringVar(value=self.config_manager.config.get('metrics_textfile', ''))
+        ttk.Entry(metrics_file_frame, textvariable=self.metrics_file).pack(side='left', fill='x', expand=True)
+        ttk.Button(metrics_file_frame, text="Seleccionar", command=self.select_metrics_file).pack(side='left', padx=5)
+        ttk.Button(metrics_frame, text="Mostrar últimas ejecuciones", command=self.show_run_history).pack(anchor='w')
+        
         ttk.Button(main_frame, text="Guardar Configuración", 
                   command=self.save_settings).pack(pady=20)
         
@@ -215,6 +373,19 @@ class BackupApp:
             ttk.Entry(path_frame, textvariable=self.local_path, state='readonly').pack(side='left', fill='x', expand=True)
             ttk.Button(path_frame, text="Seleccionar", command=self.select_local_path).pack(side='left', padx=5)
             
+            ttk.Label(self.dest_config_frame, text="Modo de copia:").pack(anchor='w', pady=(5,0))
+            self.local_mode = tk.StringVar(value="full")
+            ttk.Radiobutton(self.dest_config_frame, text="Completa", variable=self.local_mode, 
+                           value="full").pack(anchor='w')
+            ttk.Radiobutton(self.dest_config_frame, text="Incremental (solo archivos nuevos o modificados)", 
+                           variable=self.local_mode, value="incremental").pack(anchor='w')
+            ttk.Radiobutton(self.dest_config_frame, text="Instantánea con enlaces duros (copia navegable completa)", 
+                           variable=self.local_mode, value="hardlink").pack(anchor='w')
+            
+            self.local_checksums = tk.BooleanVar(value=False)
+            ttk.Checkbutton(self.dest_config_frame, text="Calcular checksum SHA-256 de cada archivo", 
+                           variable=self.local_checksums).pack(anchor='w', pady=(5,0))
+            
         elif dest_type == "nas":
             ttk.Label(self.dest_config_frame, text="Servidor NAS:").pack(anchor='w')
             self.nas_server = tk.StringVar()
@@ -232,10 +403,26 @@ class BackupApp:
             self.nas_password = tk.StringVar()
             ttk.Entry(self.dest_config_frame, textvariable=self.nas_password, show='*').pack(fill='x', pady=2)
             
+            ttk.Label(self.dest_config_frame, text="Modo de copia:").pack(anchor='w', pady=(5,0))
+            self.nas_mode = tk.StringVar(value="full")
+            ttk.Radiobutton(self.dest_config_frame, text="Completa", variable=self.nas_mode, 
+                           value="full").pack(anchor='w')
+            ttk.Radiobutton(self.dest_config_frame, text="Incremental (solo se envían archivos nuevos o modificados)", 
+                           variable=self.nas_mode, value="incremental").pack(anchor='w')
+            
         elif dest_type == "gdrive":
             ttk.Label(self.dest_config_frame, text="Carpeta en Google Drive:").pack(anchor='w')
             self.gdrive_folder = tk.StringVar(value="Backups")
             ttk.Entry(self.dest_config_frame, textvariable=self.gdrive_folder).pack(fill='x', pady=5)
+            ttk.Label(self.dest_config_frame, text="Modo de copia:").pack(anchor='w', pady=(5,0))
+            self.gdrive_mode = tk.StringVar(value="full")
+            ttk.Radiobutton(self.dest_config_frame, text="Completa", variable=self.gdrive_mode, 
+                           value="full").pack(anchor='w')
+            ttk.Radiobutton(self.dest_config_frame, text="Incremental (los archivos sin cambios se copian en el servidor)", 
+                           variable=self.gdrive_mode, value="incremental").pack(anchor='w')
+            self.gdrive_packs = tk.BooleanVar(value=False)
+            ttk.Checkbutton(self.dest_config_frame, text="Empaquetar archivos pequeños (menos llamadas a la API)", 
+                           variable=self.gdrive_packs).pack(anchor='w', pady=(5,0))
             ttk.Label(self.dest_config_frame, text="Configura las credenciales en la pestaña de Configuración", 
                      foreground='blue').pack(anchor='w')
             
@@ -243,9 +430,40 @@ class BackupApp:
             ttk.Label(self.dest_config_frame, text="Carpeta en Dropbox:").pack(anchor='w')
             self.dropbox_folder = tk.StringVar(value="/Backups")
             ttk.Entry(self.dest_config_frame, textvariable=self.dropbox_folder).pack(fill='x', pady=5)
+            ttk.Label(self.dest_config_frame, text="Modo de copia:").pack(anchor='w', pady=(5,0))
+            self.dropbox_mode = tk.StringVar(value="full")
+            ttk.Radiobutton(self.dest_config_frame, text="Completa", variable=self.dropbox_mode, 
+                           value="full").pack(anchor='w')
+            ttk.Radiobutton(self.dest_config_frame, text="Incremental (los archivos sin cambios se copian en el servidor)", 
+                           variable=self.dropbox_mode, value="incremental").pack(anchor='w')
+            self.dropbox_packs = tk.BooleanVar(value=False)
+            ttk.Checkbutton(self.dest_config_frame, text="Empaquetar archivos pequeños (menos llamadas a la API)", 
+                           variable=self.dropbox_packs).pack(anchor='w', pady=(5,0))
             ttk.Label(self.dest_config_frame, text="Configura el token en la pestaña de Configuración", 
                      foreground='blue').pack(anchor='w')
             
+        elif dest_type == "repository":
+            ttk.Label(self.dest_config_frame, text="Carpeta del repositorio:").pack(anchor='w')
+            path_frame = ttk.Frame(self.dest_config_frame)
+            path_frame.pack(fill='x', pady=5)
+            
+            self.repository_path = tk.StringVar()
+            ttk.Entry(path_frame, textvariable=self.repository_path, state='readonly').pack(side='left', fill='x', expand=True)
+            ttk.Button(path_frame, text="Seleccionar", command=self.select_repository_path).pack(side='left', padx=5)
+            ttk.Label(self.dest_config_frame, text="Los archivos se dividen en bloques y cada bloque se guarda una sola vez", 
+                     foreground='blue').pack(anchor='w')
+            
+        elif dest_type == "archive":
+            ttk.Label(self.dest_config_frame, text="Carpeta donde guardar el archivo:").pack(anchor='w')
+            path_frame = ttk.Frame(self.dest_config_frame)
+            path_frame.pack(fill='x', pady=5)
+            
+            self.archive_path = tk.StringVar()
+            ttk.Entry(path_frame, textvariable=self.archive_path, state='readonly').pack(side='left', fill='x', expand=True)
+            ttk.Button(path_frame, text="Seleccionar", command=self.select_archive_path).pack(side='left', padx=5)
+            ttk.Label(self.dest_config_frame, text="Todo el respaldo se guarda en un único archivo .dgar comprimido", 
+                     foreground='blue').pack(anchor='w')
+            
     def add_source_folder(self):
         folder = filedialog.askdirectory(title="Seleccionar carpeta para respaldar")
         if folder:
@@ -261,6 +479,16 @@ class BackupApp:
         if folder:
             self.local_path.set(folder)
             
+    def select_repository_path(self):
+        folder = filedialog.askdirectory(title="Seleccionar carpeta del repositorio")
+        if folder:
+            self.repository_path.set(folder)
+            
+    def select_archive_path(self):
+        folder = filedialog.askdirectory(title="Seleccionar carpeta para el archivo de respaldo")
+        if folder:
+            self.archive_path.set(folder)
+            
     def select_gdrive_credentials(self):
         file = filedialog.askopenfilename(
             title="Seleccionar archivo credentials.json de Google Drive",
@@ -269,17 +497,59 @@ class BackupApp:
         if file:
             self.gdrive_cred_path.set(file)
             
+    def select_metrics_file(self):
+        file = filedialog.asksaveasfilename(
+            title="Archivo de métricas para Prometheus",
+            defaultextension=".prom",
+            filetypes=[("Prometheus textfile", "*.prom"), ("All files", "*.*")]
+        )
+        if file:
+            self.metrics_file.set(file)
+            
+    def show_run_history(self):
+        try:
+            history = RunHistory()
+            try:
+                runs = history.runs(limit=10)
+            finally:
+                history.close()
+        except Exception as e:
+            self.log_message(f"Error leyendo el historial de ejecuciones: {str(e)}")
+            return
+        if not runs:
+            self.log_message("Todavía no hay ejecuciones registradas")
+            return
+        self.log_message("Últimas ejecuciones:")
+        for run in runs:
+            started = datetime.fromtimestamp(run['started']).strftime('%Y-%m-%d %H:%M')
+            self.log_message(f"  {started} {run['dest_key']}: {describe_run(run)}")
+            
     def log_message(self, message):
-        self.log_text.config(state='normal')
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state='disabled')
+        self.event_bus.log(message)
         
     def update_progress(self, value, status=""):
-        self.progress_var.set(value)
-        if status:
+        self.event_bus.progress(value, status)
+        
+    def process_events(self):
+        lines, progress, status = self.event_bus.drain()
+        
+        if lines:
+            self.log_text.config(state='normal')
+            self.log_text.insert(tk.END, "\n".join(lines[-MAX_LOG_LINES:]) + "\n")
+            excess = int(self.log_text.index('end-1c').split('.')[0]) - MAX_LOG_LINES - 1
+            if excess > 0:
+                self.log_text.delete('1.0', f"{excess + 1}.0")
+            self.log_text.see(tk.END)
+            self.log_text.config(state='disabled')
+            
+        if progress is not None and progress != self.shown_progress:
+            self.progress_var.set(progress)
+            self.shown_progress = progress
+        if status is not None and status != self.shown_status:
             self.status_label.config(text=status)
+            self.shown_status = status
+            
+        self.root.after(UI_REFRESH_MS, self.process_events)
             
     def start_backup(self):
         sources = list(self.source_listbox.get(0, tk.END))
@@ -289,51 +559,40 @@ class BackupApp:
             return
             
         dest_type = self.dest_type.get()
-        dest_config = {}
-        
-        if dest_type == "local":
-            if not hasattr(self, 'local_path') or not self.local_path.get():
-                messagebox.showwarning("Advertencia", "Selecciona la ruta de destino")
-                return
-            dest_config['path'] = self.local_path.get()
+        dest_config = self.get_dest_config()
+        if dest_config is None:
+            return
             
-        elif dest_type == "nas":
-            if not all([self.nas_server.get(), self.nas_share.get()]):
-                messagebox.showwarning("Advertencia", "Completa la configuración del NAS")
-                return
-            dest_config.update({
-                'server': self.nas_server.get(),
-                'share': self.nas_share.get(),
-                'username': self.nas_user.get(),
-                'password': self.nas_password.get()
-            })
+        try:
+            filters = self.get_filters()
+        except ValueError:
+            messagebox.showwarning("Advertencia", "Los límites de tamaño y antigüedad deben ser números enteros")
+            return
             
-        elif dest_type == "gdrive":
-            config = self.config_manager.load_config()
-            if 'gdrive_credentials' not in config:
-                messagebox.showwarning("Advertencia", "Configura las credenciales de Google Drive en Configuración")
-                return
-            dest_config.update({
-                'credentials_path': config['gdrive_credentials'],
-                'folder_name': self.gdrive_folder.get()
-            })
+        try:
+            throttle = self.get_throttle()
+        except ValueError:
+            messagebox.showwarning("Advertencia", "Los límites de velocidad deben ser números")
+            return
             
-        elif dest_type == "dropbox":
-            config = self.config_manager.load_config()
-            if 'dropbox_token' not in config:
-                messagebox.showwarning("Advertencia", "Configura el token de Dropbox en Configuración")
-                return
-            dest_config.update({
-                'token': config['dropbox_token'],
-                'folder_path': self.dropbox_folder.get()
-            })
+        try:
+            retention = self.get_retention()
+        except ValueError:
+            messagebox.showwarning("Advertencia", "Los valores de retención deben ser números")
+            return
             
+        resume = self.resume_backup.get()
+        profiling = self.get_profiling()
         self.backup_btn.config(state='disabled')
-        self.log_message("Iniciando copia de seguridad...")
+        self.log_message("Reanudando copia de seguridad..." if resume else "Iniciando copia de seguridad...")
         
         def backup_thread():
             try:
-                self.backup_manager.backup(sources, dest_type, dest_config, self.update_progress)
+                self.backup_manager.backup(sources, dest_type, dest_config, self.update_progress,
+                                           filters=filters, resume=resume, throttle=throttle,
+                                           retention=retention if retention.get('auto') else None,
+                                           metrics_file=self.config_manager.config.get('metrics_textfile') or None,
+                                           profiling=profiling)
                 self.root.after(0, lambda: messagebox.showinfo("Éxito", "Copia de seguridad completada"))
             except Exception as e:
                 self.log_message(f"Error: {str(e)}")
@@ -344,6 +603,90 @@ class BackupApp:
         thread = threading.Thread(target=backup_thread, daemon=True)
         thread.start()
         
+    def apply_retention(self):
+        dest_type = self.dest_type.get()
+        dest_config = self.get_dest_config()
+        if dest_config is None:
+            return
+        try:
+            retention = self.get_retention()
+        except ValueError:
+            messagebox.showwarning("Advertencia", "Los valores de retención deben ser números")
+            return
+        if not any(value for key, value in retention.items() if key != 'auto'):
+            messagebox.showwarning("Advertencia", "Indica cuántas copias conservar o un tamaño máximo")
+            return
+            
+        self.backup_btn.config(state='disabled')
+        
+        def confirm(removed):
+            if not removed:
+                self.backup_btn.config(state='normal')
+                messagebox.showinfo("Retención", "No hay copias antiguas que eliminar")
+            elif messagebox.askyesno("Confirmar", f"¿Eliminar {len(removed)} copias antiguas "
+                                                  f"(de {removed[0]} a {removed[-1]})?"):
+                threading.Thread(target=prune_thread, args=(False,), daemon=True).start()
+            else:
+                self.backup_btn.config(state='normal')
+                
+        def prune_thread(dry_run):
+            # a dry run first shows what the policy would delete, so nothing goes unexpectedly
+            try:
+                removed = self.backup_manager.prune(dest_type, dest_config, retention, dry_run=dry_run)
+            except Exception as e:
+                self.log_message(f"Error aplicando la retención: {str(e)}")
+                self.root.after(0, lambda: self.backup_btn.config(state='normal'))
+                return
+            if dry_run:
+                self.root.after(0, lambda: confirm(removed))
+            else:
+                self.root.after(0, lambda: self.backup_btn.config(state='normal'))
+                
+        threading.Thread(target=prune_thread, args=(True,), daemon=True).start()
+        
+    def verify_backup(self):
+        dest_type = self.dest_type.get()
+        dest_config = self.get_dest_config()
+        if dest_config is None:
+            return
+        try:
+            sample = float(self.verify_sample.get())
+        except ValueError:
+            messagebox.showwarning("Advertencia", "La muestra debe ser un porcentaje entre 1 y 100")
+            return
+        if not 0 < sample <= 100:
+            messagebox.showwarning("Advertencia", "La muestra debe ser un porcentaje entre 1 y 100")
+            return
+            
+        self.verify_btn.config(state='disabled')
+        
+        def verify_thread():
+            try:
+                self.backup_manager.verify(dest_type, dest_config, sample=sample / 100 if sample < 100 else None)
+            except Exception as e:
+                self.log_message(f"Error verificando la copia: {str(e)}")
+            finally:
+                self.root.after(0, lambda: self.verify_btn.config(state='normal'))
+                
+        threading.Thread(target=verify_thread, daemon=True).start()
+        
+    def get_destination(self):
+        fields = DESTINATION_FIELDS.get(self.dest_type.get(), {})
+        return {key: getattr(self, attr).get() for key, attr in fields.items() if hasattr(self, attr)}
+        
+    def set_destination(self, destination):
+        destination = destination or {}
+        for key, attr in DESTINATION_FIELDS.get(self.dest_type.get(), {}).items():
+            if key in destination and hasattr(self, attr):
+                getattr(self, attr).set(destination[key])
+                
+    def get_dest_config(self):
+        try:
+            return self.config_manager.dest_config(self.dest_type.get(), self.get_destination())
+        except ValueError as e:
+            messagebox.showwarning("Advertencia", str(e))
+            return
+        
     def stop_backup(self):
         self.backup_manager.stop()
         self.log_message("Deteniendo copia de seguridad...")
@@ -353,10 +696,19 @@ class BackupApp:
             'enabled': self.schedule_enabled.get(),
             'frequency': self.frequency.get(),
             'hour': self.hour_var.get(),
-            'minute': self.minute_var.get()
+            'minute': self.minute_var.get(),
+            'cron': self.cron_var.get().strip(),
+            'catch_up': self.schedule_catch_up.get()
         }
+        try:
+            next_run = schedule_cron(schedule_config).next_after(datetime.now())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+            
         self.config_manager.save_schedule(schedule_config)
-        messagebox.showinfo("Éxito", "Programación guardada correctamente")
+        messagebox.showinfo("Éxito", f"Programación guardada correctamente\n"
+                                     f"Próxima copia: {next_run.strftime('%Y-%m-%d %H:%M')}")
         
     def save_settings(self):
         settings = {}
@@ -367,19 +719,109 @@ class BackupApp:
         if self.dropbox_token.get():
             settings['dropbox_token'] = self.dropbox_token.get()
             
+        try:
+            settings['copy_workers'] = max(1, int(self.copy_workers.get()))
+            settings['gdrive_chunk_mb'] = max(1, int(self.gdrive_chunk_mb.get()))
+            settings['pack_threshold_kb'] = max(1, int(self.pack_threshold_kb.get()))
+        except ValueError:
+            messagebox.showwarning("Advertencia", "Los valores de rendimiento deben ser números enteros")
+            return
+        settings['metrics_textfile'] = self.metrics_file.get().strip()
+            
         self.config_manager.update_config(settings)
         messagebox.showinfo("Éxito", "Configuración guardada correctamente")
         
+    def add_common_excludes(self):
+        current = [line.strip() for line in self.exclude_text.get('1.0', tk.END).splitlines() if line.strip()]
+        missing = [pattern for pattern in COMMON_EXCLUDES if pattern not in current]
+        self.set_filters({'exclude': current + missing, 'include': self.include_patterns.get().split(),
+                          'max_size_mb': self.max_size_mb.get(), 'max_age_days': self.max_age_days.get()})
+        
+    def get_filters(self):
+        return {
+            'exclude': [line.strip() for line in self.exclude_text.get('1.0', tk.END).splitlines() if line.strip()],
+            'include': self.include_patterns.get().split(),
+            'max_size_mb': int(self.max_size_mb.get() or 0),
+            'max_age_days': int(self.max_age_days.get() or 0),
+        }
+        
+    def set_filters(self, filters):
+        filters = filters or {}
+        self.exclude_text.delete('1.0', tk.END)
+        self.exclude_text.insert('1.0', '\n'.join(filters.get('exclude', [])))
+        self.include_patterns.set(' '.join(filters.get('include', [])))
+        self.max_size_mb.set(str(filters.get('max_size_mb', 0)))
+        self.max_age_days.set(str(filters.get('max_age_days', 0)))
+        
+    def get_throttle(self):
+        return {
+            'max_mb_per_sec': max(0.0, float(self.max_mb_per_sec.get() or 0)),
+            'max_files_per_sec': max(0.0, float(self.max_files_per_sec.get() or 0)),
+            'low_priority': self.low_priority.get(),
+            'adaptive': self.adaptive_throttle.get(),
+        }
+        
+    def set_throttle(self, throttle):
+        throttle = throttle or {}
+        self.max_mb_per_sec.set(str(throttle.get('max_mb_per_sec', 0)))
+        self.max_files_per_sec.set(str(throttle.get('max_files_per_sec', 0)))
+        self.low_priority.set(throttle.get('low_priority', False))
+        self.adaptive_throttle.set(throttle.get('adaptive', False))
+        
+    def get_retention(self):
+        retention = {key: max(0, int(var.get() or 0)) for key, var in self.keep_vars.items()}
+        retention['max_total_gb'] = max(0.0, float(self.max_total_gb.get() or 0))
+        retention['auto'] = self.auto_prune.get()
+        return retention
+        
+    def set_retention(self, retention):
+        retention = retention or {}
+        for key, var in self.keep_vars.items():
+            var.set(str(retention.get(key, 0)))
+        self.max_total_gb.set(str(retention.get('max_total_gb', 0)))
+        self.auto_prune.set(retention.get('auto', False))
+        
+    def get_profiling(self):
+        return {
+            'enabled': self.profiling_enabled.get() or self.force_profiling,
+            'memory': self.profiling_memory.get(),
+        }
+        
+    def set_profiling(self, profiling):
+        profiling = profiling or {}
+        self.profiling_enabled.set(profiling.get('enabled', False))
+        self.profiling_memory.set(profiling.get('memory', False))
+        
     def new_profile(self):
         self.source_listbox.delete(0, tk.END)
+        self.set_filters(None)
+        self.set_throttle(None)
+        self.set_retention(None)
+        self.set_profiling(None)
         self.log_message("Nuevo perfil creado")
         
     def save_profile(self):
         name = simpledialog.askstring("Guardar Perfil", "Nombre del perfil:")
         if name:
+            try:
+                filters = self.get_filters()
+            except ValueError:
+                messagebox.showwarning("Advertencia", "Los límites de tamaño y antigüedad deben ser números enteros")
+                return
+            try:
+                throttle = self.get_throttle()
+                retention = self.get_retention()
+            except ValueError:
+                messagebox.showwarning("Advertencia", "Los límites de velocidad y la retención deben ser números")
+                return
             profile = {
                 'sources': list(self.source_listbox.get(0, tk.END)),
-                'dest_type': self.dest_type.get()
+                'dest_type': self.dest_type.get(),
+                'destination': self.get_destination(),
+                'filters': filters,
+                'throttle': throttle,
+                'retention': retention,
+                'profiling': {'enabled': self.profiling_enabled.get(), 'memory': self.profiling_memory.get()}
             }
             self.config_manager.save_profile(name, profile)
             self.load_profiles()
@@ -399,7 +841,12 @@ class BackupApp:
             for source in profile.get('sources', []):
                 self.source_listbox.insert(tk.END, source)
             self.dest_type.set(profile.get('dest_type', 'local'))
+            self.set_filters(profile.get('filters'))
+            self.set_throttle(profile.get('throttle'))
+            self.set_retention(profile.get('retention'))
+            self.set_profiling(profile.get('profiling'))
             self.update_destination_ui()
+            self.set_destination(profile.get('destination'))
             self.log_message(f"Perfil '{profile_name}' cargado")
             
     def delete_profile(self):
@@ -420,8 +867,13 @@ class BackupApp:
             self.profile_listbox.insert(tk.END, profile)
 
 def main():
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Sistema de copias de seguridad")
+    parser.add_argument('--profiling', action='store_true',
+                        help="perfilar el rendimiento de todas las copias de esta sesión")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = BackupApp(root)
+    app = BackupApp(root, force_profiling=args.profiling)
     root.mainloop()
 
 if __name__ == "__main__":
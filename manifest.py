@@ -0,0 +1,146 @@
+import json
+import os
+import hashlib
+from pathlib import Path
+from datetime import datetime
+
+MANIFEST_NAME = ".diskguardian_manifest.json"
+MANIFEST_CACHE_DIR = "manifest_cache"
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(entry):
+    return {
+        'size': entry.size,
+        'mtime_ns': entry.mtime_ns,
+        'inode': entry.inode,
+    }
+
+
+class BackupManifest:
+    def __init__(self, snapshot, base=None, files=None, created=None):
+        self.snapshot = snapshot
+        self.base = base
+        self.files = files if files is not None else {}
+        self.created = created or datetime.now().isoformat(timespec='seconds')
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        if data.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"Versión de manifiesto no soportada: {data.get('version')}")
+        return cls(data['snapshot'], data.get('base'), data.get('files', {}), data.get('created'))
+
+    def to_json(self):
+        return json.dumps({
+            'version': MANIFEST_VERSION,
+            'snapshot': self.snapshot,
+            'base': self.base,
+            'created': self.created,
+            'files': self.files,
+        }, ensure_ascii=False, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, folder, name=MANIFEST_NAME):
+        with open(Path(folder) / name, 'r', encoding='utf-8') as f:
+            return cls.from_json(f.read())
+
+    def save(self, folder, name=MANIFEST_NAME):
+        manifest_file = Path(folder) / name
+        tmp_file = manifest_file.with_name(manifest_file.name + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+        os.replace(tmp_file, manifest_file)
+
+    def get(self, rel_path):
+        return self.files.get(rel_path)
+
+    def locate(self, dest_path, rel_path):
+        entry = self.files.get(rel_path)
+        if entry is None:
+            return None
+        return Path(dest_path) / entry.get('stored_in', self.snapshot) / rel_path
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.files.values())
+
+    def record_copied(self, rel_path, scan_entry, sha256=None):
+        entry = file_signature(scan_entry)
+        if sha256:
+            entry['sha256'] = sha256
+        entry['stored_in'] = self.snapshot
+        self.files[rel_path] = entry
+        return entry
+
+    def record_unchanged(self, rel_path, previous_entry, scan_entry=None):
+        entry = dict(previous_entry)
+        if scan_entry is not None:
+            entry.update(file_signature(scan_entry))
+        self.files[rel_path] = entry
+        return entry
+
+    def is_unchanged(self, rel_path, scan_entry, use_hash=False):
+        previous_entry = self.files.get(rel_path)
+        if previous_entry is None:
+            return False
+        if previous_entry['size'] != scan_entry.size:
+            return False
+        resolution = previous_entry.get('mtime_resolution_ns', 1)
+        if (previous_entry['mtime_ns'] // resolution == scan_entry.mtime_ns // resolution
+                and previous_entry.get('inode', scan_entry.inode) == scan_entry.inode):
+            return True
+        if use_hash and previous_entry.get('sha256'):
+            return hash_file(scan_entry.path) == previous_entry['sha256']
+        return False
+
+
+def find_latest_manifest(dest_path, exclude=None):
+    dest_path = Path(dest_path)
+    if not dest_path.is_dir():
+        return None
+
+    candidates = sorted(
+        (p for p in dest_path.iterdir() if p.is_dir() and p.name.startswith('backup_') and p.name != exclude),
+        key=lambda p: p.name,
+        reverse=True
+    )
+    for folder in candidates:
+        if (folder / MANIFEST_NAME).exists():
+            try:
+                return BackupManifest.load(folder)
+            except (OSError, ValueError, KeyError):
+                continue
+    return None
+
+
+def _cache_file(key):
+    safe_key = "".join(c if c.isalnum() or c in '-_.' else '_' for c in key)
+    return Path(MANIFEST_CACHE_DIR) / f"{safe_key}.json"
+
+
+def load_cached_manifest(key):
+    cache_file = _cache_file(key)
+    if not cache_file.exists():
+        return None
+    try:
+        return BackupManifest.load(cache_file.parent, cache_file.name)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_cached_manifest(key, manifest):
+    cache_file = _cache_file(key)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    manifest.save(cache_file.parent, cache_file.name)
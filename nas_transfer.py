@@ -0,0 +1,225 @@
+import errno
+import hashlib
+import queue
+import threading
+
+WRITE_SIZE = 8 * 1024 * 1024
+PIPELINE_THRESHOLD = 16 * 1024 * 1024
+PIPELINE_DEPTH = 4
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+class NASTransfer:
+    def __init__(self, server, username=None, password=None, write_size=WRITE_SIZE, throttle=None):
+        self.server = server
+        self.username = username
+        self.password = password
+        self.write_size = write_size
+        self.throttle = throttle
+        self._local = threading.local()
+        self._caches = []
+        self._caches_lock = threading.Lock()
+        self._created_dirs = set()
+        self._dirs_lock = threading.Lock()
+
+    def _connection_cache(self):
+        cache = getattr(self._local, 'cache', None)
+        if cache is None:
+            from smbclient import register_session
+
+            cache = {}
+            register_session(self.server, username=self.username, password=self.password,
+                             connection_cache=cache)
+            self._local.cache = cache
+            with self._caches_lock:
+                self._caches.append(cache)
+        return cache
+
+    def connect(self):
+        self._connection_cache()
+
+    def close(self):
+        from smbclient import reset_connection_cache
+
+        with self._caches_lock:
+            caches, self._caches = self._caches, []
+        for cache in caches:
+            try:
+                reset_connection_cache(fail_on_error=False, connection_cache=cache)
+            except Exception:
+                pass
+
+    def makedirs(self, path):
+        from smbclient import mkdir
+
+        with self._dirs_lock:
+            if path in self._created_dirs:
+                return
+        parent = path.rsplit('\\', 1)[0]
+        if parent.count('\\') > 3 and parent != path:
+            self.makedirs(parent)
+        try:
+            mkdir(path, connection_cache=self._connection_cache())
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with self._dirs_lock:
+            self._created_dirs.add(path)
+
+    def mark_existing(self, path):
+        with self._dirs_lock:
+            self._created_dirs.add(path)
+
+    def _write_all(self, fdst, data):
+        if self.throttle is not None:
+            self.throttle.wait_bytes(len(data))
+        view = memoryview(data)
+        while view:
+            written = fdst.write(view)
+            view = view[written:]
+
+    def copy_file(self, src, dst, size=None):
+        # returns the SHA-256 of the data sent, computed on the way
+        from smbclient import open_file
+        from smbclient.shutil import copystat
+
+        cache = self._connection_cache()
+        digest = hashlib.sha256()
+        with open(src, 'rb') as fsrc, open_file(dst, mode='wb', buffering=0, connection_cache=cache) as fdst:
+            if size is not None and size >= PIPELINE_THRESHOLD:
+                self._pipelined_copy(fsrc, fdst, digest)
+            else:
+                while True:
+                    data = fsrc.read(self.write_size)
+                    if not data:
+                        break
+                    digest.update(data)
+                    self._write_all(fdst, data)
+        copystat(str(src), dst, connection_cache=cache)
+        return digest.hexdigest()
+
+    def _pipelined_copy(self, fsrc, fdst, digest):
+        # read the next blocks from the local disk while the current one is on the wire
+        blocks = queue.Queue(maxsize=PIPELINE_DEPTH)
+        read_error = []
+        cancelled = threading.Event()
+
+        def reader():
+            try:
+                while not cancelled.is_set():
+                    data = fsrc.read(self.write_size)
+                    digest.update(data)
+                    blocks.put(data)
+                    if not data:
+                        return
+            except Exception as e:
+                read_error.append(e)
+                blocks.put(b'')
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        try:
+            while True:
+                data = blocks.get()
+                if not data:
+                    break
+                self._write_all(fdst, data)
+        finally:
+            cancelled.set()
+            while thread.is_alive():
+                try:
+                    blocks.get_nowait()
+                except queue.Empty:
+                    thread.join(0.05)
+        if read_error:
+            raise read_error[0]
+
+    def list_backups(self, share_path, exclude=None):
+        from smbclient import scandir
+
+        return sorted(
+            entry.name for entry in scandir(share_path, connection_cache=self._connection_cache())
+            if entry.is_dir() and entry.name.startswith('backup_') and entry.name != exclude
+        )
+
+    def list_tree(self, root, skip=()):
+        from smbclient import scandir
+
+        cache = self._connection_cache()
+        files = {}
+        stack = [(root, '')]
+        while stack:
+            path, rel_dir = stack.pop()
+            for entry in scandir(path, connection_cache=cache):
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir():
+                    stack.append((f"{path}\\{entry.name}", rel_path))
+                elif rel_path not in skip:
+                    st = entry.stat()
+                    files[rel_path] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        return files
+
+    def read_file(self, path):
+        from smbclient import open_file
+
+        with open_file(path, mode='rb', connection_cache=self._connection_cache()) as f:
+            return f.read()
+
+    def write_file(self, path, data):
+        from smbclient import open_file
+
+        with open_file(path, mode='wb', connection_cache=self._connection_cache()) as f:
+            self._write_all(f, data)
+
+    def rename(self, src, dst):
+        from smbclient import rename
+
+        rename(src, dst, connection_cache=self._connection_cache())
+
+    def list_dir(self, path):
+        from smbclient import scandir
+
+        return [(f"{path}\\{entry.name}", entry.is_dir())
+                for entry in scandir(path, connection_cache=self._connection_cache())]
+
+    def hash_file(self, path, buffer_size=HASH_BUFFER_SIZE):
+        from smbclient import open_file
+
+        digest = hashlib.sha256()
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        try:
+            f = open_file(path, mode='rb', buffering=0, connection_cache=self._connection_cache())
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise FileNotFoundError(path)
+            raise
+        with f:
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                digest.update(view[:count])
+        return digest.hexdigest()
+
+    def remove_tree(self, path):
+        from smbclient.shutil import rmtree
+
+        rmtree(path, connection_cache=self._connection_cache())
+
+    def remove_file(self, path):
+        from smbclient import remove
+
+        remove(path, connection_cache=self._connection_cache())
+
+    def remove_dir(self, path):
+        from smbclient import rmdir
+
+        rmdir(path, connection_cache=self._connection_cache())
+
+    def server_copy(self, src, dst):
+        from smbclient.shutil import copy2
+
+        # both paths are on the share, so smbclient asks the server to copy the data
+        # (FSCTL_SRV_COPYCHUNK) instead of sending it through this machine
+        copy2(src, dst, connection_cache=self._connection_cache())
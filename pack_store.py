@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+PACK_DIR = ".diskguardian_packs"
+PACK_INDEX_NAME = ".diskguardian_packs.json"
+DEFAULT_SMALL_FILE_LIMIT = 256 * 1024
+PACK_SIZE = 16 * 1024 * 1024
+
+
+class PackBuilder:
+    def __init__(self, on_pack, pack_size=PACK_SIZE):
+        self.on_pack = on_pack
+        self.pack_size = pack_size
+        self.data = bytearray()
+        self.members = []
+        self.pack_count = 0
+        self.packs = {}
+        self.files = {}
+        self.dirs = []
+        self.lock = threading.Lock()
+
+    def add(self, rel_path, entry):
+        with open(entry.path, 'rb') as f:
+            data = f.read()
+        self.members.append((rel_path, len(self.data), len(data), entry.mtime_ns, hashlib.sha256(data).hexdigest()))
+        self.data += data
+        if len(self.data) >= self.pack_size:
+            self.flush()
+
+    def flush(self):
+        if not self.members:
+            return
+        self.pack_count += 1
+        name = f"pack_{self.pack_count:05d}.dgp"
+        data, self.data = bytes(self.data), bytearray()
+        members, self.members = self.members, []
+        self.on_pack(name, data, members)
+
+    def record(self, name, size, location, members):
+        # called from the upload workers once a pack is safely stored; files of a
+        # pack that failed never reach the index
+        with self.lock:
+            self.packs[name] = {'size': size, 'location': location}
+            for rel_path, offset, length, mtime_ns, *checksum in members:
+                # members journaled before checksums were kept have no fifth field
+                self.files[rel_path] = {'pack': name, 'offset': offset, 'size': length, 'mtime_ns': mtime_ns,
+                                        'sha256': checksum[0] if checksum else None}
+
+    def restore(self, name, size, location, members):
+        # packs uploaded by an interrupted run keep their place in the index
+        self.record(name, size, location, members)
+        self.pack_count = max(self.pack_count, int(name[5:10]))
+
+    def to_json(self):
+        with self.lock:
+            return json.dumps({'packs': self.packs, 'files': self.files, 'dirs': self.dirs},
+                              ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class PackReader:
+    def __init__(self, index, fetch, fetch_pack=None):
+        # fetch(location, offset, size) returns that byte range of a stored pack;
+        # fetch_pack(location) returns a whole pack for bulk restores
+        self.packs = index['packs']
+        self.files = index['files']
+        self.dirs = index.get('dirs', [])
+        self.fetch = fetch
+        self.fetch_pack = fetch_pack
+
+    @classmethod
+    def from_json(cls, data, fetch, fetch_pack=None):
+        return cls(json.loads(data), fetch, fetch_pack)
+
+    def list(self):
+        return list(self.files)
+
+    def read(self, rel_path):
+        member = self.files[rel_path]
+        if not member['size']:
+            return b''
+        return self.fetch(self.packs[member['pack']]['location'], member['offset'], member['size'])
+
+    def _write(self, rel_path, data, dest_file):
+        member = self.files[rel_path]
+        dest_file = Path(dest_file)
+        dest_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(dest_file, 'wb') as f:
+            f.write(data)
+        os.utime(dest_file, ns=(member['mtime_ns'], member['mtime_ns']))
+
+    def extract(self, rel_path, dest_file):
+        self._write(rel_path, self.read(rel_path), dest_file)
+
+    def extract_all(self, target_dir, rel_paths=None):
+        target_dir = Path(target_dir)
+        if rel_paths is None:
+            rel_paths = list(self.files)
+            for rel_path in self.dirs:
+                (target_dir / rel_path).mkdir(parents=True, exist_ok=True)
+        if self.fetch_pack is None:
+            for rel_path in rel_paths:
+                self.extract(rel_path, target_dir / rel_path)
+            return len(rel_paths)
+
+        # one download per pack instead of one ranged request per file
+        by_pack = {}
+        for rel_path in rel_paths:
+            by_pack.setdefault(self.files[rel_path]['pack'], []).append(rel_path)
+        for name, members in by_pack.items():
+            data = self.fetch_pack(self.packs[name]['location'])
+            for rel_path in members:
+                member = self.files[rel_path]
+                self._write(rel_path, data[member['offset']:member['offset'] + member['size']], target_dir / rel_path)
+        return len(rel_paths)
@@ -0,0 +1,117 @@
+import re
+from datetime import datetime
+
+_TIMESTAMP = re.compile(r'_(\d{8}_\d{6})(?:\.dgar)?$')
+
+
+def backup_time(name):
+    # backup_20240131_020000, <folder>_20240131_020000 (Drive) or backup_20240131_020000.dgar
+    match = _TIMESTAMP.search(name)
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+
+
+class RetentionPolicy:
+    def __init__(self, keep_last=0, keep_daily=0, keep_weekly=0, keep_monthly=0, max_total_bytes=0):
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.keep_monthly = keep_monthly
+        self.max_total_bytes = max_total_bytes
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(keep_last=int(config.get('keep_last') or 0), keep_daily=int(config.get('keep_daily') or 0),
+                   keep_weekly=int(config.get('keep_weekly') or 0),
+                   keep_monthly=int(config.get('keep_monthly') or 0),
+                   max_total_bytes=int(float(config.get('max_total_gb') or 0) * 1024 ** 3))
+
+    @property
+    def counts(self):
+        return self.keep_last or self.keep_daily or self.keep_weekly or self.keep_monthly
+
+    @property
+    def active(self):
+        return bool(self.counts or self.max_total_bytes)
+
+    def describe(self):
+        parts = []
+        for count, label in ((self.keep_last, "últimas"), (self.keep_daily, "diarias"),
+                             (self.keep_weekly, "semanales"), (self.keep_monthly, "mensuales")):
+            if count:
+                parts.append(f"{count} {label}")
+        if self.max_total_bytes:
+            parts.append(f"máximo {self.max_total_bytes / 1024 ** 3:g} GB")
+        return ", ".join(parts)
+
+    def _needed(self, backups, names):
+        # a kept backup also keeps every backup that still holds some of its files
+        needed = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in needed or name not in backups:
+                continue
+            needed.add(name)
+            pending.extend(backups[name].get('depends_on') or ())
+        return needed
+
+    def plan(self, backups, protected=()):
+        # backups: {name: {'stored_bytes', 'total_bytes', 'depends_on'}}; returns the names
+        # to delete, oldest first
+        dated = sorted(((backup_time(name), name) for name in backups if backup_time(name) is not None),
+                       reverse=True)
+        if not dated or not self.active:
+            return []
+        newest = dated[0][1]
+
+        if self.counts:
+            keep = {newest}
+            keep.update(name for _, name in dated[:self.keep_last])
+            for count, bucket in ((self.keep_daily, lambda t: t.date()),
+                                  (self.keep_weekly, lambda t: t.isocalendar()[:2]),
+                                  (self.keep_monthly, lambda t: (t.year, t.month))):
+                seen = set()
+                for when, name in dated:
+                    if len(seen) >= count:
+                        break
+                    key = bucket(when)
+                    if key not in seen:
+                        # the newest backup of each period represents it
+                        seen.add(key)
+                        keep.add(name)
+        else:
+            keep = {name for _, name in dated}
+        # interrupted runs and anything without a timestamp are never touched
+        keep.update(name for name in protected if name in backups)
+        keep.update(name for name in backups if backup_time(name) is None)
+        keep = self._needed(backups, keep)
+
+        if self.max_total_bytes:
+            def size(name):
+                # what deleting the backup frees: the data it holds itself, not what it shares
+                info = backups[name]
+                if info.get('stored_bytes') is not None:
+                    return info['stored_bytes']
+                return info.get('total_bytes') or 0
+
+            total = sum(size(name) for name in keep)
+            changed = True
+            while total > self.max_total_bytes and changed:
+                changed = False
+                for when, name in reversed(dated):
+                    if total <= self.max_total_bytes:
+                        break
+                    if name not in keep or name == newest or name in protected:
+                        continue
+                    if name in self._needed(backups, keep - {name}):
+                        continue
+                    keep.discard(name)
+                    total -= size(name)
+                    changed = True
+        return [name for _, name in reversed(dated) if name not in keep]
@@ -1,3 +1,4 @@
+import importlib.util
 import platform
 
 print("=" * 60)
@@ -21,7 +22,7 @@ print("  1. Descarga todos los archivos del proyecto")
 print("  2. Asegúrate de tener Python 3.11+ instalado")
 print("  3. Instala las dependencias:")
 print("     pip install google-api-python-client google-auth-httplib2")
-print("     pip install google-auth-oauthlib dropbox smbprotocol schedule")
+print("     pip install google-auth-oauthlib dropbox smbprotocol fastcdc")
 print("  4. Ejecuta: python main.py")
 print()
 print("CONFIGURACIÓN:")
@@ -39,25 +40,36 @@ print()
 print("Verificando módulos instalados...")
 modules_ok = True
 
-try:
-    from backup_manager import BackupManager
-    from config_manager import ConfigManager
-    from scheduler import BackupScheduler
-    import tkinter
-    import dropbox
-    import schedule
-    import smbprotocol
-    from google.oauth2 import credentials
+# find_spec locates a module without importing it, so the check does not pay for
+# loading every cloud SDK
+REQUIRED_MODULES = [
+    ("backup_manager", "gestor de copias"),
+    ("config_manager", "configuración"),
+    ("scheduler", "programación"),
+    ("tkinter", "interfaz gráfica"),
+    ("dropbox", "Dropbox"),
+    ("smbprotocol", "NAS"),
+    ("fastcdc", "repositorio"),
+    ("googleapiclient", "Google Drive"),
+    ("google_auth_oauthlib", "Google Drive"),
+]
+for module, purpose in REQUIRED_MODULES:
+    try:
+        found = importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        found = False
+    if not found:
+        print(f"✗ Error: Falta un módulo - {module} ({purpose})")
+        modules_ok = False
+if modules_ok:
     print("✓ Todos los módulos están correctamente instalados")
-except ImportError as e:
-    print(f"✗ Error: Falta un módulo - {e}")
-    modules_ok = False
 
 if modules_ok:
     print("✓ La aplicación está lista para usarse en Windows")
     print()
     print("Archivos principales:")
     print("  • main.py - Aplicación principal con interfaz gráfica")
+    print("  • cli.py - Copias sin interfaz gráfica (perfiles y servicio programado)")
     print("  • backup_manager.py - Gestor de copias de seguridad")
     print("  • config_manager.py - Gestión de configuración")
     print("  • scheduler.py - Programación de tareas")
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+JOURNAL_DIR = "run_journal"
+FSYNC_INTERVAL = 2.0
+
+
+def _journal_file(key):
+    safe_key = "".join(c if c.isalnum() or c in '-_.' else '_' for c in key)
+    return Path(JOURNAL_DIR) / f"{safe_key}.jsonl"
+
+
+def pending_backup(key):
+    # name of the backup an interrupted run left behind, which a resume would continue
+    try:
+        with open(_journal_file(key), 'r', encoding='utf-8') as f:
+            return json.loads(f.readline()).get('backup_name')
+    except (OSError, ValueError):
+        return None
+
+
+class RunJournal:
+    def __init__(self, key):
+        self.path = _journal_file(key)
+        self.backup_name = None
+        self.meta = {}
+        self.files = {}
+        self.folders = {}
+        self.sessions = {}
+        self.packs = {}
+        self.resumed = False
+        self._file = None
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut short if the process died while writing it
+                    continue
+                kind = record.pop('type')
+                if kind == 'start':
+                    self.backup_name = record['backup_name']
+                    self.meta = record.get('meta', {})
+                elif kind == 'file':
+                    self.files[record['rel']] = record
+                    self.sessions.pop(record['rel'], None)
+                elif kind == 'folder':
+                    self.folders[record['rel']] = record['id']
+                elif kind == 'session':
+                    self.sessions[record['rel']] = record
+                elif kind == 'pack':
+                    self.packs[record['name']] = record
+                    for rel_path, offset, length, mtime_ns, *checksum in record['members']:
+                        # members journaled before checksums were kept have no fifth field
+                        self.files[rel_path] = {'rel': rel_path, 'size': length, 'mtime_ns': mtime_ns,
+                                                'pack': record['name'], 'sha256': checksum[0] if checksum else None}
+        return self.backup_name is not None
+
+    def open(self, backup_name, resume=False, **meta):
+        # returns the backup name to use: the interrupted run's when resuming, else the new one
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if resume and self.path.exists():
+            try:
+                self.resumed = self._load()
+            except OSError:
+                self.resumed = False
+        if self.resumed:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            return self.backup_name
+        self.files, self.folders, self.sessions, self.packs = {}, {}, {}, {}
+        self.backup_name = backup_name
+        self.meta = meta
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._write({'type': 'start', 'backup_name': backup_name, 'meta': meta,
+                     'started': datetime.now().isoformat(timespec='seconds')}, sync=True)
+        return backup_name
+
+    def _write(self, record, sync=False):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            now = time.monotonic()
+            if sync or now - self._last_sync >= FSYNC_INTERVAL:
+                os.fsync(self._file.fileno())
+                self._last_sync = now
+
+    def completed(self, entry, key=None):
+        # the file was finished by the interrupted run and has not changed since
+        record = self.files.get(key or entry.rel_path)
+        if record is not None and record['size'] == entry.size and record['mtime_ns'] == entry.mtime_ns:
+            return record
+        return None
+
+    def session(self, entry, key=None):
+        record = self.sessions.get(key or entry.rel_path)
+        if record is not None and record['size'] == entry.size and record['mtime_ns'] == entry.mtime_ns:
+            return record
+        return None
+
+    def file_done(self, entry, key=None, **data):
+        self._write({'type': 'file', 'rel': key or entry.rel_path, 'size': entry.size,
+                     'mtime_ns': entry.mtime_ns, **data})
+
+    def folder_done(self, rel_path, folder_id):
+        self._write({'type': 'folder', 'rel': rel_path, 'id': folder_id})
+
+    def session_progress(self, entry, key=None, **data):
+        self._write({'type': 'session', 'rel': key or entry.rel_path, 'size': entry.size,
+                     'mtime_ns': entry.mtime_ns, **data})
+
+    def pack_done(self, name, size, location, members):
+        self._write({'type': 'pack', 'name': name, 'size': size, 'location': location, 'members': members})
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def finish(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
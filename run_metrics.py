@@ -0,0 +1,278 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+RUN_HISTORY_FILE = "run_history.db"
+HISTORY_PER_DESTINATION = 500
+STAGES = ('stat', 'read', 'write', 'remote')
+COUNTERS = ('files_transferred', 'bytes_transferred', 'files_skipped', 'bytes_skipped', 'retries', 'errors')
+# upper bounds in seconds, from a cached stat to the upload of a large file
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+STATUS_NAMES = {'running': "en curso", 'completed': "completada", 'stopped': "detenida", 'failed': "fallida"}
+
+
+class _ThreadMetrics:
+    __slots__ = ('counters', 'buckets', 'sums')
+
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        # one slot per bucket plus one for anything slower than the last bound
+        self.buckets = {stage: [0] * (len(LATENCY_BUCKETS) + 1) for stage in STAGES}
+        self.sums = dict.fromkeys(STAGES, 0.0)
+
+
+class _Timer:
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class RunMetrics:
+    # counters and per-stage latency histograms of one backup run. Every thread updates
+    # its own copy, so recording takes no lock and costs a dictionary update; snapshot()
+    # adds the copies up
+    def __init__(self, dest_type=None, dest_key=None):
+        self.dest_type = dest_type
+        self.dest_key = dest_key
+        self.started = time.time()
+        self.finished = None
+        self.status = 'running'
+        self.scan_seconds = None
+        # perf_counter() when the first file reached the backend: how long the run spent on
+        # set-up (connecting, previous manifests, journal) before copying
+        self.first_file_at = None
+        self._clock = time.perf_counter()
+        self._duration = None
+        self._local = threading.local()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _mine(self):
+        mine = getattr(self._local, 'metrics', None)
+        if mine is None:
+            mine = self._local.metrics = _ThreadMetrics()
+            with self._lock:
+                self._threads.append(mine)
+        return mine
+
+    def observe(self, stage, seconds):
+        mine = self._mine()
+        mine.buckets[stage][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        mine.sums[stage] += seconds
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def copy_started(self):
+        if self.first_file_at is None:
+            self.first_file_at = time.perf_counter()
+
+    def transferred(self, nbytes, files=1):
+        counters = self._mine().counters
+        counters['files_transferred'] += files
+        counters['bytes_transferred'] += nbytes
+
+    def skipped(self, nbytes, files=1):
+        counters = self._mine().counters
+        counters['files_skipped'] += files
+        counters['bytes_skipped'] += nbytes
+
+    def retry(self):
+        self._mine().counters['retries'] += 1
+
+    def error(self):
+        self._mine().counters['errors'] += 1
+
+    def finish(self, status, scan_seconds=None):
+        self.status = status
+        self.scan_seconds = scan_seconds
+        self.finished = time.time()
+        self._duration = time.perf_counter() - self._clock
+
+    def snapshot(self):
+        with self._lock:
+            threads = list(self._threads)
+        counters = dict.fromkeys(COUNTERS, 0)
+        stages = {stage: {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)} for stage in STAGES}
+        for mine in threads:
+            for name, value in mine.counters.items():
+                counters[name] += value
+            for stage, buckets in mine.buckets.items():
+                total = stages[stage]
+                total['sum'] += mine.sums[stage]
+                for index, count in enumerate(buckets):
+                    total['buckets'][index] += count
+        for total in stages.values():
+            total['count'] = sum(total['buckets'])
+        duration = self._duration if self._duration is not None else time.perf_counter() - self._clock
+        return {
+            'dest_type': self.dest_type,
+            'dest_key': self.dest_key,
+            'started': self.started,
+            'finished': self.finished,
+            'status': self.status,
+            'duration_seconds': duration,
+            'scan_seconds': self.scan_seconds,
+            'first_file_seconds': self.first_file_at - self._clock if self.first_file_at is not None else None,
+            **counters,
+            'bytes_per_second': counters['bytes_transferred'] / duration if duration > 0 else 0.0,
+            'stages': stages,
+        }
+
+
+def describe_run(run):
+    text = (f"{STATUS_NAMES.get(run['status'], run['status'])} en {run['duration_seconds']:.1f} s: "
+            f"{run['files_transferred']} archivos transferidos ({run['bytes_transferred'] / 1048576:.1f} MB, "
+            f"{run['bytes_per_second'] / 1048576:.1f} MB/s), {run['files_skipped']} sin transferir")
+    if run.get('first_file_seconds') is not None:
+        text += f", copiando a los {run['first_file_seconds'] * 1000:.0f} ms"
+    if run.get('scan_seconds') is not None:
+        text += f", análisis del origen {run['scan_seconds']:.1f} s"
+    return text + f", {run['retries']} reintentos, {run['errors']} errores"
+
+
+class RunHistory:
+    def __init__(self, db_file=RUN_HISTORY_FILE):
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, dest_key TEXT NOT NULL, started REAL NOT NULL,"
+            " status TEXT NOT NULL, metrics TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS runs_by_dest ON runs (dest_key, started)")
+        self.db.commit()
+        self.lock = threading.Lock()
+
+    def record(self, metrics):
+        with self.lock:
+            self.db.execute("INSERT INTO runs (dest_key, started, status, metrics) VALUES (?, ?, ?, ?)",
+                            (metrics['dest_key'], metrics['started'], metrics['status'], json.dumps(metrics)))
+            # the history is for trends, so only the newest runs of each destination are kept
+            self.db.execute(
+                "DELETE FROM runs WHERE dest_key = ? AND id NOT IN"
+                " (SELECT id FROM runs WHERE dest_key = ? ORDER BY started DESC LIMIT ?)",
+                (metrics['dest_key'], metrics['dest_key'], HISTORY_PER_DESTINATION))
+            self.db.commit()
+
+    def runs(self, dest_key=None, limit=50):
+        # newest first
+        with self.lock:
+            if dest_key is None:
+                rows = self.db.execute("SELECT metrics FROM runs ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = self.db.execute("SELECT metrics FROM runs WHERE dest_key = ? ORDER BY started DESC LIMIT ?",
+                                       (dest_key, limit)).fetchall()
+        return [json.loads(metrics) for metrics, in rows]
+
+    def latest(self, status=None):
+        # {dest_key: metrics} of the newest run of every destination, optionally only
+        # among the runs that ended with status
+        # with MAX(), SQLite takes the other columns from the row holding the maximum
+        query = "SELECT dest_key, metrics, MAX(started) FROM runs"
+        params = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            params = (status,)
+        query += " GROUP BY dest_key"
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        return {dest_key: json.loads(metrics) for dest_key, metrics, _ in rows}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def prometheus_text(latest, last_success=None):
+    # the newest run of every destination in the Prometheus text format, for the
+    # node_exporter textfile collector
+    last_success = last_success or {}
+    metrics = []
+
+    def family(name, kind, help_text):
+        samples = []
+        metrics.append((name, kind, help_text, samples))
+        return samples
+
+    start = family('diskguardian_last_run_start_timestamp_seconds', 'gauge', 'Start of the last backup run.')
+    end = family('diskguardian_last_run_end_timestamp_seconds', 'gauge', 'End of the last backup run.')
+    success = family('diskguardian_last_run_success', 'gauge', '1 if the last backup run completed.')
+    last_ok = family('diskguardian_last_success_timestamp_seconds', 'gauge', 'End of the last completed run.')
+    duration = family('diskguardian_last_run_duration_seconds', 'gauge', 'Duration of the last backup run.')
+    scan = family('diskguardian_last_run_scan_duration_seconds', 'gauge', 'Time to walk the sources.')
+    first_file = family('diskguardian_last_run_first_file_seconds', 'gauge',
+                        'Time from the start of the run until the first file reached the backend.')
+    files = family('diskguardian_last_run_files', 'gauge', 'Files transferred or skipped as unchanged.')
+    nbytes = family('diskguardian_last_run_bytes', 'gauge', 'Bytes transferred or skipped as unchanged.')
+    rate = family('diskguardian_last_run_throughput_bytes_per_second', 'gauge', 'Bytes transferred per second.')
+    retries = family('diskguardian_last_run_retries', 'gauge', 'Retried operations in the last run.')
+    errors = family('diskguardian_last_run_errors', 'gauge', 'Errors in the last run.')
+    stage_latency = family('diskguardian_last_run_stage_latency_seconds', 'histogram',
+                           'Latency of stat, read, write and remote operations in the last run.')
+
+    for dest_key, run in sorted(latest.items()):
+        labels = f'dest="{_label(dest_key)}",type="{_label(run.get("dest_type"))}"'
+        start.append(('', labels, run['started']))
+        if run.get('finished') is not None:
+            end.append(('', labels, run['finished']))
+        success.append(('', labels, int(run['status'] == 'completed')))
+        if dest_key in last_success:
+            last_ok.append(('', labels, last_success[dest_key]['finished']))
+        duration.append(('', labels, run['duration_seconds']))
+        if run.get('scan_seconds') is not None:
+            scan.append(('', labels, run['scan_seconds']))
+        if run.get('first_file_seconds') is not None:
+            first_file.append(('', labels, run['first_file_seconds']))
+        for result in ('transferred', 'skipped'):
+            files.append(('', f'{labels},result="{result}"', run[f'files_{result}']))
+            nbytes.append(('', f'{labels},result="{result}"', run[f'bytes_{result}']))
+        rate.append(('', labels, run['bytes_per_second']))
+        retries.append(('', labels, run['retries']))
+        errors.append(('', labels, run['errors']))
+        for stage, histogram in run['stages'].items():
+            stage_labels = f'{labels},stage="{stage}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram['buckets']):
+                cumulative += count
+                stage_latency.append(('_bucket', f'{stage_labels},le="{bound}"', cumulative))
+            stage_latency.append(('_sum', stage_labels, histogram['sum']))
+            stage_latency.append(('_count', stage_labels, histogram['count']))
+
+    lines = []
+    for name, kind, help_text, samples in metrics:
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{{{labels}}} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, latest, last_success=None):
+    # written next to the target and renamed, so the collector never reads half a file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text(latest, last_success))
+    os.replace(temp_path, path)
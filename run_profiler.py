@@ -0,0 +1,282 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+from event_bus import LOG_FILE
+
+PROFILE_DIR = "diskguardian_profiles"
+DEFAULT_INTERVAL_MS = 10
+# share of the wall time the sampler may hold the interpreter; a slow sample stretches
+# the interval instead of slowing the backup down
+MAX_SAMPLER_OVERHEAD = 0.02
+MAX_INTERVAL = 1.0
+MAX_STACK_DEPTH = 64
+MAX_STACKS = 50000
+MAX_SPANS = 20000
+MEMORY_FRAMES = 8
+# tracemalloc slows every allocation down several times over, so it only watches the
+# start of the run and the snapshot is taken when the window closes
+DEFAULT_MEMORY_SECONDS = 30
+MEMORY_TOP = 50
+MEMORY_TRACEBACKS = 5000
+TRUNCATED = "[truncated]"
+
+
+def _thread_group(name):
+    # copy-worker-0 .. copy-worker-N share one root in the flame graph
+    return re.sub(r'[-_ ]?\d+$', '', name) or name
+
+
+def _folded_name(text):
+    # ';' separates frames in the folded format; the count follows the last space
+    return text.replace(';', ':').replace('\n', ' ')
+
+
+class StackSampler:
+    # wall-clock sampler: every interval it walks the stack of every thread, so threads
+    # blocked on a disk or the network show where they wait as well as where they spend CPU
+    def __init__(self, interval=DEFAULT_INTERVAL_MS / 1000, max_overhead=MAX_SAMPLER_OVERHEAD):
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.stacks = Counter()
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _folded_name(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        interval = self.interval
+        while not self._stop.wait(interval):
+            started = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < MAX_STACK_DEPTH:
+                    frames.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                if frame is not None:
+                    frames.append(TRUNCATED)
+                frames.append(_folded_name(_thread_group(names.get(ident, str(ident)))))
+                stack = ';'.join(reversed(frames))
+                if stack not in self.stacks and len(self.stacks) >= MAX_STACKS:
+                    stack = f"{frames[-1]};{TRUNCATED}"
+                self.stacks[stack] += 1
+            self.samples += 1
+            cost = time.perf_counter() - started
+            self.sampling_seconds += cost
+            interval = min(MAX_INTERVAL, max(self.interval, cost / self.max_overhead))
+
+    def folded(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class RunProfiler:
+    # on-demand profile of one backup run: wall-clock stack samples (folded stacks for
+    # flamegraph.pl, speedscope or inferno), a tracemalloc snapshot and the phases of the
+    # run as a Chrome trace (chrome://tracing, Perfetto). Inactive profilers do nothing,
+    # so callers never check
+    def __init__(self, enabled=False, directory=None, interval=DEFAULT_INTERVAL_MS / 1000, memory=False,
+                 memory_seconds=DEFAULT_MEMORY_SECONDS):
+        self.enabled = enabled
+        self.directory = Path(directory) if directory else Path(LOG_FILE).resolve().parent / PROFILE_DIR
+        self.interval = interval
+        self.memory = memory
+        self.memory_seconds = memory_seconds
+        self.output_dir = None
+        self.sampler = None
+        self.spans = []
+        self.dropped_spans = 0
+        self._running = False
+        self._thread_names = {}
+        self._phases = {}
+        self._clock = None
+        self._started_tracing = False
+        self._memory_timer = None
+        self._memory_snapshot = None
+        self._memory_peak = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        return cls(enabled=bool(config.get('enabled')), directory=config.get('dir') or None,
+                   interval=max(1.0, float(config.get('interval_ms') or DEFAULT_INTERVAL_MS)) / 1000,
+                   memory=bool(config.get('memory')),
+                   memory_seconds=float(config.get('memory_seconds') or DEFAULT_MEMORY_SECONDS))
+
+    @property
+    def active(self):
+        return self.enabled and self._running
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        safe_name = re.sub(r'[^\w.-]+', '_', name).strip('_')
+        self.output_dir = self.directory / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{safe_name}"
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._clock = time.perf_counter()
+        self._running = True
+        if self.memory:
+            import tracemalloc
+
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(MEMORY_FRAMES)
+                self._started_tracing = True
+            self._memory_timer = threading.Timer(self.memory_seconds, self._capture_memory)
+            self._memory_timer.daemon = True
+            self._memory_timer.start()
+        self.sampler = StackSampler(self.interval)
+        self.sampler.start()
+
+    def _add_span(self, name, started, ended, ident, args=None):
+        with self._lock:
+            if len(self.spans) >= MAX_SPANS:
+                self.dropped_spans += 1
+                return
+            if ident not in self._thread_names and ident == threading.get_ident():
+                self._thread_names[ident] = threading.current_thread().name
+            self.spans.append((name, started, ended, ident, args))
+
+    def record(self, name, started, ended, **args):
+        # a span of the calling thread timed by the caller with time.perf_counter()
+        if self.active:
+            self._add_span(name, started, ended, threading.get_ident(), args)
+
+    def span(self, name, **args):
+        if not self.active:
+            return nullcontext()
+        return _Span(self, name, args)
+
+    def phase(self, name):
+        # phases of a thread follow each other: starting one ends the previous
+        if not self.active:
+            return
+        ident = threading.get_ident()
+        now = time.perf_counter()
+        previous = self._phases.pop(ident, None)
+        if previous is not None:
+            self._add_span(previous[0], previous[1], now, ident)
+        if name is not None:
+            with self._lock:
+                self._thread_names.setdefault(ident, threading.current_thread().name)
+            self._phases[ident] = (name, now)
+
+    def stop(self):
+        # writes the profile and returns a summary for the log, or None when inactive
+        if not self.active:
+            return None
+        now = time.perf_counter()
+        for ident, (name, started) in list(self._phases.items()):
+            self._add_span(name, started, now, ident)
+        self._phases.clear()
+        self._running = False
+        self.sampler.stop()
+        wall = max(now - self._clock, 1e-9)
+
+        (self.output_dir / "cpu.folded").write_text(self.sampler.folded(), encoding='utf-8')
+        self._write_trace()
+        summary = {
+            'dir': str(self.output_dir),
+            'samples': self.sampler.samples,
+            'sampler_overhead': self.sampler.sampling_seconds / wall,
+            'spans': len(self.spans),
+            'dropped_spans': self.dropped_spans,
+            'peak_memory': None,
+        }
+        if self.memory:
+            self._memory_timer.cancel()
+            self._capture_memory()
+            if self._memory_snapshot is not None:
+                self._write_memory()
+                summary['peak_memory'] = self._memory_peak
+        return summary
+
+    def _capture_memory(self):
+        import tracemalloc
+
+        with self._lock:
+            if self._memory_snapshot is not None or not tracemalloc.is_tracing():
+                return
+            _, self._memory_peak = tracemalloc.get_traced_memory()
+            self._memory_snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ))
+            if self._started_tracing:
+                tracemalloc.stop()
+
+    def _write_trace(self):
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': ident, 'args': {'name': name}}
+                  for ident, name in self._thread_names.items()]
+        for name, started, ended, ident, args in self.spans:
+            event = {'name': name, 'cat': 'backup', 'ph': 'X', 'pid': pid, 'tid': ident,
+                     'ts': round((started - self._clock) * 1e6, 1), 'dur': round((ended - started) * 1e6, 1)}
+            if args:
+                event['args'] = args
+            events.append(event)
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms',
+                 'otherData': {'dropped_spans': self.dropped_spans}}
+        (self.output_dir / "trace.json").write_text(json.dumps(trace), encoding='utf-8')
+
+    def _write_memory(self):
+        snapshot = self._memory_snapshot
+        # the raw snapshot can be compared later with tracemalloc.Snapshot.load()
+        snapshot.dump(str(self.output_dir / "memory.tracemalloc"))
+
+        stats = snapshot.statistics('traceback')
+        lines = []
+        for stat in stats[:MEMORY_TRACEBACKS]:
+            frames = [_folded_name(f"{os.path.basename(frame.filename)}:{frame.lineno}") for frame in stat.traceback]
+            lines.append(f"{';'.join(frames)} {stat.size}\n")
+        (self.output_dir / "memory.folded").write_text(''.join(lines), encoding='utf-8')
+
+        top = [f"Pico de memoria trazada: {self._memory_peak / 1048576:.1f} MB",
+               f"Memoria viva en la instantánea: {sum(stat.size for stat in stats) / 1048576:.1f} MB", ""]
+        for stat in snapshot.statistics('lineno')[:MEMORY_TOP]:
+            frame = stat.traceback[0]
+            top.append(f"{stat.size / 1024:10.1f} KB {stat.count:8} bloques  {frame.filename}:{frame.lineno}")
+        (self.output_dir / "memory_top.txt").write_text('\n'.join(top) + '\n', encoding='utf-8')
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'args', 'started')
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._add_span(self.name, self.started, time.perf_counter(), threading.get_ident(), self.args)
+        return False
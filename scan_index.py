@@ -0,0 +1,451 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import sqlite3
+import stat
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+from scanner import ScanEntry
+
+SCAN_INDEX_FILE = "scan_index.db"
+# the index is a cache that the watcher rebuilds on start, so another schema is dropped
+SCHEMA_VERSION = 2
+COMMIT_EVERY = 2000
+DEBOUNCE_SECONDS = 1.0
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class ScanIndex:
+    def __init__(self, db_file=SCAN_INDEX_FILE):
+        self.db_file = db_file
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript(
+                "DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS deleted; DROP TABLE IF EXISTS runs;"
+                "DROP TABLE IF EXISTS meta;"
+                f"PRAGMA user_version = {SCHEMA_VERSION};"
+            )
+            self.db.execute("VACUUM")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " root TEXT NOT NULL, rel_path TEXT NOT NULL, path TEXT NOT NULL, is_dir INTEGER NOT NULL,"
+            " size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,"
+            " gen INTEGER NOT NULL, PRIMARY KEY (root, rel_path))"
+        )
+        self.db.commit()
+        self.lock = threading.Lock()
+        self._uncommitted = 0
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+            self._uncommitted = 0
+
+    def update(self, root, rel_path, path, st, gen=0):
+        is_dir = 1 if stat.S_ISDIR(st.st_mode) else 0
+        size = 0 if is_dir else st.st_size
+        mtime_ns = 0 if is_dir else st.st_mtime_ns
+        inode = 0 if is_dir else st.st_ino
+        with self.lock:
+            row = self.db.execute(
+                "SELECT is_dir, size, mtime_ns, inode FROM entries WHERE root = ? AND rel_path = ?",
+                (root, rel_path)).fetchone()
+            if row == (is_dir, size, mtime_ns, inode):
+                if gen:
+                    self.db.execute("UPDATE entries SET gen = ? WHERE root = ? AND rel_path = ?",
+                                    (gen, root, rel_path))
+            else:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO entries (root, rel_path, path, is_dir, size, mtime_ns, inode, gen)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (root, rel_path, str(path), is_dir, size, mtime_ns, inode, gen))
+        self._maybe_commit()
+
+    def remove(self, root, rel_path):
+        # a removed directory takes its whole subtree with it
+        with self.lock:
+            pattern = rel_path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '/%'
+            self.db.execute("DELETE FROM entries WHERE root = ? AND (rel_path = ? OR rel_path LIKE ? ESCAPE '\\')",
+                            (root, rel_path, pattern))
+        self._maybe_commit()
+
+    def sweep(self, root, gen):
+        # entries a full rescan did not touch no longer exist
+        with self.lock:
+            stale = self.db.execute("DELETE FROM entries WHERE root = ? AND gen != ?", (root, gen)).rowcount
+        self.commit()
+        return stale
+
+    def close(self):
+        self.commit()
+        with self.lock:
+            self.db.close()
+
+
+def _to_entry(row):
+    path, rel_path, is_dir, size, mtime_ns, inode = row
+    return ScanEntry(Path(path), rel_path, bool(is_dir), size, mtime_ns, inode)
+
+
+class IndexedScanner:
+    def __init__(self, index, sources, should_stop=None, on_error=None, file_filter=None, metrics=None):
+        self.index = index
+        self.sources = [Path(s) for s in sources]
+        self.should_stop = should_stop or (lambda: False)
+        self.on_error = on_error
+        self.file_filter = file_filter if file_filter is not None and file_filter.active else None
+        self.metrics = metrics
+        self.skipped = 0
+        self._pruned = set()
+        self.files_found = 0
+        self.bytes_found = 0
+        self.done = False
+        self.scan_seconds = None
+        self._closed = False
+        index.commit()
+
+    def __iter__(self):
+        # a separate connection reads a consistent WAL snapshot while the watcher keeps writing
+        started = time.perf_counter()
+        db = sqlite3.connect(self.index.db_file, isolation_level=None)
+        try:
+            db.execute("BEGIN")
+            file_sources = []
+            dir_sources = []
+            for source in self.sources:
+                (dir_sources if source.is_dir() else file_sources).append(source)
+
+            singles = []
+            for source in file_sources:
+                try:
+                    st = source.stat()
+                except OSError as e:
+                    if self.on_error:
+                        self.on_error(source, e)
+                    continue
+                singles.append(ScanEntry(source, source.name, False, st.st_size, st.st_mtime_ns, st.st_ino))
+
+            roots = [str(source) for source in dir_sources]
+            self.files_found += len(singles)
+            self.bytes_found += sum(entry.size for entry in singles)
+            if self.file_filter is None:
+                for root in roots:
+                    count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                                              " WHERE root = ? AND is_dir = 0", (root,)).fetchone()
+                    self.files_found += count
+                    self.bytes_found += total
+                self.scan_seconds = time.perf_counter() - started
+                self.done = True
+
+            if singles and self.metrics is not None:
+                self.metrics.copy_started()
+            yield from singles
+            for root in roots:
+                # parents sort before their children, as with a directory walk
+                rows = db.execute("SELECT path, rel_path, is_dir, size, mtime_ns, inode FROM entries"
+                                  " WHERE root = ? ORDER BY rel_path", (root,))
+                for entry in map(_to_entry, rows):
+                    if self.should_stop():
+                        return
+                    if self.file_filter is not None:
+                        if not self._accept(entry, len(Path(root).name) + 1):
+                            continue
+                        self.files_found += not entry.is_dir
+                        self.bytes_found += entry.size
+                    if self.metrics is not None and self.metrics.first_file_at is None:
+                        self.metrics.copy_started()
+                    yield entry
+            if not self.done:
+                self.scan_seconds = time.perf_counter() - started
+            self.done = True
+        finally:
+            self._closed = True
+            db.close()
+
+    def _accept(self, entry, prefix):
+        rel_path = entry.rel_path
+        parent = rel_path.rpartition('/')[0]
+        # the index holds everything, so descendants of a pruned folder are dropped here
+        while parent:
+            if parent in self._pruned:
+                return False
+            parent = parent.rpartition('/')[0]
+        if len(rel_path) < prefix:
+            return True
+        if entry.is_dir:
+            if self.file_filter.skip_dir(rel_path[prefix:]):
+                self._pruned.add(rel_path)
+                self.skipped += 1
+                return False
+        elif self.file_filter.skip_file(rel_path[prefix:], entry.size, entry.mtime_ns):
+            self.skipped += 1
+            return False
+        return True
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class SourceWatcher:
+    def __init__(self, sources, index=None, log=None):
+        self.roots = [Path(s) for s in sources if Path(s).is_dir()]
+        self.index = index or ScanIndex()
+        self.log = log or (lambda message: None)
+        self.libc = _load_libc()
+        self.fd = None
+        self.watches = {}
+        self.live = set()
+        self.pending = {}
+        self.rescan_needed = set()
+        self.gen = int(time.time())
+        self.running = False
+        self.thread = None
+        self._sync_requested = threading.Event()
+        self._synced = threading.Event()
+        # self-pipe: sync() and stop() wake the select() that waits for inotify events
+        self._wake_fds = None
+
+    @property
+    def available(self):
+        return self.libc is not None
+
+    def start(self):
+        if not self.available:
+            self.log("El índice de origen necesita inotify (Linux); se recorrerán las carpetas en cada copia")
+            return False
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self.log(f"No se pudo iniciar inotify: {os.strerror(ctypes.get_errno())}")
+            return False
+        self.fd = fd
+        self._wake_fds = os.pipe()
+        for wake_fd in self._wake_fds:
+            os.set_blocking(wake_fd, False)
+        self.rescan_needed = {str(root) for root in self.roots}
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="source-watcher", daemon=True)
+        self.thread.start()
+        return True
+
+    def _wake(self):
+        try:
+            os.write(self._wake_fds[1], b'x')
+        except (OSError, TypeError):
+            # closed, or a byte is already waiting
+            pass
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self._wake()
+            self.thread.join()
+            self.thread = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self._wake_fds is not None:
+            for wake_fd in self._wake_fds:
+                os.close(wake_fd)
+            self._wake_fds = None
+        self.index.close()
+
+    def covers(self, sources):
+        roots = [str(Path(s)) for s in sources if Path(s).is_dir()]
+        return bool(self.running and roots and all(root in self.live for root in roots))
+
+    def sync(self, timeout=30):
+        # apply queued events now so a run that is about to start sees every change
+        if not self.running:
+            return False
+        self._synced.clear()
+        self._sync_requested.set()
+        self._wake()
+        return self._synced.wait(timeout)
+
+    def scanner(self, sources, should_stop=None, on_error=None, file_filter=None, metrics=None):
+        self.sync()
+        return IndexedScanner(self.index, sources, should_stop=should_stop, on_error=on_error,
+                              file_filter=file_filter, metrics=metrics)
+
+    def _add_watch(self, root, path, rel_dir):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, "límite de inotify alcanzado (fs.inotify.max_user_watches)")
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(err, os.strerror(err), str(path))
+        self.watches[wd] = (root, str(path), rel_dir)
+
+    def _scan_tree(self, root, path, rel_dir, gen=0):
+        stack = [(path, rel_dir)]
+        while stack and self.running:
+            dir_path, rel = stack.pop()
+            # the watch goes in before the listing, so nothing created in between is lost
+            self._add_watch(root, dir_path, rel)
+            try:
+                st = os.stat(dir_path, follow_symlinks=False)
+                self.index.update(root, rel, dir_path, st, gen)
+                with os.scandir(dir_path) as it:
+                    dir_entries = list(it)
+            except OSError:
+                continue
+            for entry in dir_entries:
+                rel_path = f"{rel}/{entry.name}"
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, rel_path))
+                    elif entry.is_file():
+                        self.index.update(root, rel_path, entry.path, entry.stat(), gen)
+                except OSError:
+                    continue
+
+    def _rescan(self, root):
+        self.live.discard(root)
+        self.gen += 1
+        started = time.monotonic()
+        try:
+            self._scan_tree(root, root, Path(root).name, self.gen)
+        except OSError as e:
+            self.log(f"Índice de origen desactivado para {root}: {e}")
+            return
+        if not self.running:
+            return
+        removed = self.index.sweep(root, self.gen)
+        self.live.add(root)
+        self.log(f"Índice de origen actualizado para {root} en {time.monotonic() - started:.1f} s "
+                 f"({removed} entradas eliminadas)")
+
+    def _read_events(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.log("Cola de inotify desbordada, se volverá a recorrer el origen")
+                self.rescan_needed.update(str(root) for root in self.roots)
+                self.pending.clear()
+                continue
+            watch = self.watches.get(wd)
+            if watch is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            root, dir_path, rel_dir = watch
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if dir_path == root:
+                    self.live.discard(root)
+                    self.rescan_needed.add(root)
+                continue
+            if not name:
+                continue
+            key = (root, f"{rel_dir}/{name}")
+            self.pending.setdefault(key, (os.path.join(dir_path, name), time.monotonic()))
+
+    def _apply_pending(self, force=False):
+        now = time.monotonic()
+        ready = [key for key, (_, seen) in self.pending.items() if force or now - seen >= DEBOUNCE_SECONDS]
+        for key in ready:
+            path, _ = self.pending.pop(key)
+            root, rel_path = key
+            if root in self.rescan_needed:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.index.remove(root, rel_path)
+                continue
+            try:
+                if stat.S_ISDIR(st.st_mode):
+                    if not os.path.islink(path):
+                        # a new or moved-in directory gets its watches and its contents indexed
+                        self._scan_tree(root, path, rel_path)
+                elif stat.S_ISREG(st.st_mode):
+                    self.index.update(root, rel_path, path, st)
+            except OSError as e:
+                self.log(f"Índice de origen desactivado para {root}: {e}")
+                self.live.discard(root)
+        if ready:
+            self.index.commit()
+
+    def _run(self):
+        try:
+            while self.running:
+                for root in list(self.rescan_needed):
+                    self.rescan_needed.discard(root)
+                    self._rescan(root)
+
+                # with nothing waiting for the debounce the thread sleeps until the
+                # kernel or the self-pipe has something, instead of waking to poll
+                timeout = DEBOUNCE_SECONDS / 2 if self.pending else None
+                readable, _, _ = select.select([self.fd, self._wake_fds[0]], [], [], timeout)
+                if self._wake_fds[0] in readable:
+                    try:
+                        os.read(self._wake_fds[0], 512)
+                    except BlockingIOError:
+                        pass
+                if self.fd in readable:
+                    self._read_events()
+
+                sync = self._sync_requested.is_set()
+                if sync:
+                    # events can still be in the kernel queue when sync() is called
+                    self._read_events()
+                self._apply_pending(force=sync)
+                if sync:
+                    self._sync_requested.clear()
+                    self._synced.set()
+        except Exception as e:
+            self.log(f"Error en el vigilante del índice de origen: {str(e)}")
+            self.live.clear()
+            self.running = False
@@ -0,0 +1,190 @@
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+ScanEntry = namedtuple('ScanEntry', ['path', 'rel_path', 'is_dir', 'size', 'mtime_ns', 'inode'])
+
+_DONE = object()
+
+
+class SourceScanner:
+    def __init__(self, sources, should_stop=None, on_error=None, queue_size=4096, file_filter=None, on_start=None,
+                 metrics=None, profiler=None):
+        self.sources = [Path(s) for s in sources]
+        self.should_stop = should_stop or (lambda: False)
+        self.on_error = on_error
+        self.on_start = on_start
+        self.file_filter = file_filter if file_filter is not None and file_filter.active else None
+        self.metrics = metrics
+        self.profiler = profiler
+        self.skipped = 0
+        self.entries = queue.Queue(maxsize=queue_size)
+        self.files_found = 0
+        self.bytes_found = 0
+        self.done = False
+        self.scan_seconds = None
+        self._closed = False
+        self._thread = None
+
+    def __iter__(self):
+        self._thread = threading.Thread(target=self._run, name="source-scanner", daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                entry = self.entries.get()
+                if entry is _DONE:
+                    return
+                if self.metrics is not None and self.metrics.first_file_at is None:
+                    self.metrics.copy_started()
+                yield entry
+        finally:
+            self._closed = True
+
+    def _put(self, entry):
+        if not entry.is_dir:
+            self.files_found += 1
+            self.bytes_found += entry.size
+        while not self.should_stop() and not self._closed:
+            try:
+                self.entries.put(entry, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _error(self, path, e):
+        if self.on_error:
+            self.on_error(path, e)
+
+    def _run(self):
+        if self.on_start:
+            self.on_start()
+        started = time.perf_counter()
+        try:
+            for source in self.sources:
+                if self.should_stop():
+                    break
+                if source.is_file():
+                    try:
+                        st = source.stat()
+                    except OSError as e:
+                        self._error(source, e)
+                        continue
+                    if not self._put(ScanEntry(source, source.name, False, st.st_size, st.st_mtime_ns, st.st_ino)):
+                        break
+                elif source.is_dir():
+                    self._walk(source)
+        finally:
+            self.scan_seconds = time.perf_counter() - started
+            if self.profiler is not None:
+                self.profiler.record('scan', started, started + self.scan_seconds, files=self.files_found)
+            self.done = True
+            while not self._closed:
+                try:
+                    self.entries.put(_DONE, timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+
+    def _walk(self, source):
+        file_filter = self.file_filter
+        metrics = self.metrics
+        # filter rules see paths relative to the source folder, without its name
+        prefix = len(source.name) + 1
+        stack = [(source, source.name)]
+        while stack:
+            if self.should_stop():
+                return
+            dir_path, rel_dir = stack.pop()
+            if not self._put(ScanEntry(dir_path, rel_dir, True, 0, 0, 0)):
+                return
+            try:
+                with os.scandir(dir_path) as it:
+                    dir_entries = list(it)
+            except OSError as e:
+                self._error(dir_path, e)
+                continue
+
+            subdirs = []
+            for entry in dir_entries:
+                rel_path = f"{rel_dir}/{entry.name}"
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        # excluded folders are never opened, which is where the time goes
+                        if file_filter and file_filter.skip_dir(rel_path[prefix:]):
+                            self.skipped += 1
+                            continue
+                        subdirs.append((Path(entry.path), rel_path))
+                    elif entry.is_file():
+                        if metrics is None:
+                            st = entry.stat()
+                        else:
+                            stat_started = time.perf_counter()
+                            st = entry.stat()
+                            metrics.observe('stat', time.perf_counter() - stat_started)
+                        if file_filter and file_filter.skip_file(rel_path[prefix:], st.st_size, st.st_mtime_ns):
+                            self.skipped += 1
+                            continue
+                        if not self._put(ScanEntry(Path(entry.path), rel_path, False,
+                                                   st.st_size, st.st_mtime_ns, st.st_ino)):
+                            return
+                except OSError as e:
+                    self._error(entry.path, e)
+            stack.extend(reversed(subdirs))
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+class ProgressTracker:
+    def __init__(self, scanner, progress_callback, expected_bytes=None, interval=0.5):
+        self.scanner = scanner
+        self.progress_callback = progress_callback
+        self.expected_bytes = expected_bytes or 0
+        self.interval = interval
+        self.files_done = 0
+        self.bytes_done = 0
+        self.started = time.monotonic()
+        self._last_report = 0
+        self._lock = threading.Lock()
+
+    def estimated_total(self):
+        if self.scanner.done:
+            return self.scanner.bytes_found
+        return max(self.scanner.bytes_found, self.expected_bytes)
+
+    def add(self, nbytes, files=1):
+        with self._lock:
+            self.files_done += files
+            self.bytes_done += nbytes
+            now = time.monotonic()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+        self.report()
+
+    def report(self):
+        total = self.estimated_total()
+        done = self.bytes_done
+        if total > 0:
+            percent = min(int(done * 100 / total), 99)
+        else:
+            percent = 0 if not self.scanner.done else 99
+
+        elapsed = time.monotonic() - self.started
+        rate = done / elapsed if elapsed > 0 else 0
+        status = f"{done / 1048576:.1f} de {total / 1048576:.1f} MB ({rate / 1048576:.1f} MB/s)"
+        if rate > 0 and total > done:
+            status += f", tiempo restante: {_format_duration((total - done) / rate)}"
+        if not self.scanner.done:
+            status += " - analizando origen..."
+        self.progress_callback(percent, status)
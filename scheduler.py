@@ -1,52 +1,287 @@
-import schedule
-import time
+import heapq
+import json
+import os
 import threading
+from datetime import datetime, timedelta
 from config_manager import ConfigManager
+from scan_index import SourceWatcher
+
+SCHEDULE_STATE_FILE = "schedule_state.json"
+# the wait is timed on the monotonic clock, which stops while the machine is suspended;
+# waking up at least this often bounds how late a job runs after a resume or a change of
+# the system clock
+MAX_SLEEP = 900
+# cron looks this many years ahead before deciding an expression never matches (30 February)
+MAX_YEARS_AHEAD = 8
+CRON_ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+MONTH_NAMES = {name: index + 1 for index, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'))}
+DAY_NAMES = {name: index for index, name in enumerate(('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'))}
+FREQUENCY_DAYS = {'daily': '* * *', 'weekly': '* * 1', 'monthly': '1 * *'}
+
+
+def _cron_field(text, low, high, names=None):
+    values = set()
+    for part in text.lower().split(','):
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step < 1:
+                raise ValueError
+        else:
+            step = 1
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(names.get(value, value)) if names else int(value) for value in part.split('-', 1))
+        else:
+            start = int(names.get(part, part)) if names else int(part)
+            # 'N/step' runs from N to the end of the range, as in cron
+            end = high if step > 1 else start
+        if not low <= start <= end <= high:
+            raise ValueError
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronExpression:
+    # standard five fields: minute, hour, day of the month, month and day of the week
+    # (0 or 7 is Sunday), with lists, ranges, steps, English month and day names and the
+    # @daily-style aliases. As in cron, when both day fields are restricted a day matching
+    # either of them is due
+    def __init__(self, text):
+        self.text = text.strip()
+        fields = CRON_ALIASES.get(self.text.lower(), self.text).split()
+        if len(fields) != 5:
+            raise ValueError(f"Expresión cron no válida: '{text}' (se esperan 5 campos)")
+        try:
+            self.minutes = _cron_field(fields[0], 0, 59)
+            self.hours = _cron_field(fields[1], 0, 23)
+            self.days = set(_cron_field(fields[2], 1, 31))
+            self.months = set(_cron_field(fields[3], 1, 12, MONTH_NAMES))
+            self.weekdays = {day % 7 for day in _cron_field(fields[4], 0, 7, DAY_NAMES)}
+        except ValueError:
+            raise ValueError(f"Expresión cron no válida: '{text}'") from None
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        
+    def __str__(self):
+        return self.text
+        
+    def _day_matches(self, moment):
+        in_month = moment.day in self.days
+        # cron counts the week from Sunday, Python from Monday
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+        
+    def next_after(self, after):
+        # first due minute strictly after the naive local datetime 'after'
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        last_year = moment.year + MAX_YEARS_AHEAD
+        while moment.year <= last_year:
+            if moment.month not in self.months:
+                moment = datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+                continue
+            if not self._day_matches(moment):
+                moment = datetime(moment.year, moment.month, moment.day) + timedelta(days=1)
+                continue
+            hour = next((hour for hour in self.hours if hour >= moment.hour), None)
+            if hour is None:
+                moment = datetime(moment.year, moment.month, moment.day) + timedelta(days=1)
+                continue
+            if hour != moment.hour:
+                moment = moment.replace(hour=hour, minute=0)
+            minute = next((minute for minute in self.minutes if minute >= moment.minute), None)
+            if minute is None:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+                continue
+            return moment.replace(minute=minute)
+        raise ValueError(f"La expresión cron '{self.text}' no coincide con ninguna fecha")
+
+
+def schedule_cron(schedule_config):
+    # the expression of the saved schedule: the 'cron' key, or the frequency and time
+    # chosen in the Programación tab
+    if schedule_config.get('frequency') == 'cron':
+        return CronExpression(schedule_config.get('cron') or '')
+    days = FREQUENCY_DAYS.get(schedule_config.get('frequency', 'daily'), FREQUENCY_DAYS['daily'])
+    try:
+        hour = int(schedule_config.get('hour', '02'))
+        minute = int(schedule_config.get('minute', '00'))
+    except ValueError:
+        hour = minute = -1
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        raise ValueError("La hora de la programación no es válida")
+    return CronExpression(f"{minute} {hour} {days}")
+
+
+class ScheduleState:
+    # when every job last ran, so runs missed while the service was not running (the
+    # machine was off, asleep or restarting) can be caught up
+    def __init__(self, state_file=SCHEDULE_STATE_FILE):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                self.last_runs = json.load(f)
+        except (OSError, ValueError):
+            self.last_runs = {}
+            
+    def last_run(self, name):
+        value = self.last_runs.get(name)
+        return datetime.fromisoformat(value) if value else None
+        
+    def ran(self, name, moment):
+        with self.lock:
+            self.last_runs[name] = moment.isoformat(timespec='seconds')
+            temp_path = f"{self.state_file}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.last_runs, f, indent=2)
+            os.replace(temp_path, self.state_file)
+
+
+class _Job:
+    def __init__(self, name, cron, function, catch_up):
+        self.name = name
+        self.cron = cron
+        self.function = function
+        self.catch_up = catch_up
+        self.due = None
+        self.missed = None
+
 
 class BackupScheduler:
-    def __init__(self, backup_function):
+    # jobs sit in a heap ordered by their next run and the thread sleeps until the first
+    # one is due; stop() and changes to the jobs wake it at once
+    def __init__(self, backup_function, watch_sources=None, log=None, state_file=SCHEDULE_STATE_FILE):
         self.backup_function = backup_function
         self.config_manager = ConfigManager()
         self.running = False
         self.thread = None
+        self.watch_sources = watch_sources
+        self.log = log
+        self.watcher = None
+        self.state = ScheduleState(state_file)
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.counter = 0
+        
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+            
+    def add_job(self, name, cron, function, catch_up=True):
+        if not isinstance(cron, CronExpression):
+            cron = CronExpression(cron)
+        job = _Job(name, cron, function, catch_up)
+        now = datetime.now()
+        last_run = self.state.last_run(name)
+        if last_run is None:
+            # nothing to catch up on the first start
+            self.state.ran(name, now)
+        elif catch_up and cron.next_after(last_run) <= now:
+            # however many runs were missed, one run brings the backup up to date
+            job.missed = cron.next_after(last_run)
+        job.due = now if job.missed else cron.next_after(now)
+        self._push(job)
+        return job
+        
+    def _push(self, job):
+        with self.lock:
+            self.counter += 1
+            heapq.heappush(self.jobs, (job.due, self.counter, job))
+        self.wakeup.set()
+        
+    def clear(self):
+        with self.lock:
+            self.jobs = []
+        self.wakeup.set()
         
+    def next_run(self):
+        with self.lock:
+            return self.jobs[0][0] if self.jobs else None
+            
     def setup_schedule(self):
-        schedule.clear()
+        self.clear()
         
         schedule_config = self.config_manager.get_schedule()
         
         if not schedule_config.get('enabled', False):
             return
             
-        frequency = schedule_config.get('frequency', 'daily')
-        hour = schedule_config.get('hour', '02')
-        minute = schedule_config.get('minute', '00')
-        time_str = f"{hour}:{minute}"
-        
-        if frequency == 'daily':
-            schedule.every().day.at(time_str).do(self.backup_function)
-        elif frequency == 'weekly':
-            schedule.every().monday.at(time_str).do(self.backup_function)
-        elif frequency == 'monthly':
-            schedule.every().day.at(time_str).do(self._check_monthly)
-            
-    def _check_monthly(self):
-        import datetime
-        if datetime.datetime.now().day == 1:
-            self.backup_function()
-            
+        try:
+            cron = schedule_cron(schedule_config)
+        except ValueError as e:
+            self._log(f"Error: {str(e)}")
+            return
+        self.add_job('backup', cron, self.backup_function, catch_up=schedule_config.get('catch_up', True))
+        
     def start(self):
         self.setup_schedule()
         self.running = True
-        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.wakeup.clear()
+        if self.watch_sources and self.config_manager.config.get('scan_index', True):
+            self.watcher = SourceWatcher(self.watch_sources, log=self.log)
+            self.watcher.start()
+        else:
+            self.watcher = None
+        self.thread = threading.Thread(target=self._run, name="backup-scheduler", daemon=True)
         self.thread.start()
         
+        next_run = self.next_run()
+        if next_run is not None:
+            self._log(f"Próxima copia programada: {next_run.strftime('%Y-%m-%d %H:%M')}")
+            
     def stop(self):
         self.running = False
-        if self.thread:
+        self.wakeup.set()
+        if self.thread and self.thread is not threading.current_thread():
             self.thread.join()
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
             
     def _run(self):
         while self.running:
-            schedule.run_pending()
-            time.sleep(60)
+            next_run = self.next_run()
+            timeout = None
+            if next_run is not None:
+                timeout = min(MAX_SLEEP, max(0.0, (next_run - datetime.now()).total_seconds()))
+            if self.wakeup.wait(timeout):
+                self.wakeup.clear()
+                continue
+                
+            now = datetime.now()
+            with self.lock:
+                if not self.jobs or self.jobs[0][0] > now:
+                    continue
+                _, _, job = heapq.heappop(self.jobs)
+            self._fire(job, now)
+            
+    def _fire(self, job, now):
+        if job.missed:
+            self._log(f"Ejecutando la copia programada del {job.missed.strftime('%Y-%m-%d %H:%M')}, "
+                      f"que se perdió mientras el servicio no estaba en marcha")
+            job.missed = None
+        self.state.ran(job.name, now)
+        try:
+            job.function()
+        except Exception as e:
+            self._log(f"Error en la tarea programada '{job.name}': {str(e)}")
+        # the next run is counted from the end of this one, so a run longer than the
+        # interval is not followed by a burst of overdue runs
+        job.due = job.cron.next_after(datetime.now())
+        if self.running:
+            self._push(job)
+            self._log(f"Próxima copia programada: {self.next_run().strftime('%Y-%m-%d %H:%M')}")
@@ -0,0 +1,242 @@
+import os
+import platform
+import sys
+import threading
+import time
+from pathlib import Path
+
+SAMPLE_INTERVAL = 1.0
+LATENCY_FACTOR = 3.0
+LATENCY_MARGIN_MS = 20.0
+MIN_ADAPTIVE_RATE = 1024 * 1024
+RECOVERY_STEP = 0.1
+
+BACKGROUND_NICE = 19
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_LOWEST_LEVEL = 7
+_IOPRIO_SET = {'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'armv7l': 314}
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+
+def lower_thread_priority():
+    # on Linux nice and the I/O priority are per thread, so only the backup
+    # workers are demoted and the interface stays responsive
+    if sys.platform.startswith('linux'):
+        import ctypes
+
+        tid = threading.get_native_id()
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, BACKGROUND_NICE)
+        except OSError:
+            return False
+        nr = _IOPRIO_SET.get(platform.machine().lower())
+        if nr is not None:
+            # lowest best-effort level rather than the idle class, which can stall
+            # a backup indefinitely on a disk that is never idle
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.syscall(nr, IOPRIO_WHO_PROCESS, tid, (IOPRIO_CLASS_BE << IOPRIO_CLASS_SHIFT) | IOPRIO_LOWEST_LEVEL)
+        return True
+    if os.name == 'nt':
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32
+        # background mode lowers the CPU, I/O and memory priority of the thread
+        return bool(kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN))
+    return False
+
+
+def lower_process_priority():
+    # initializer for worker processes (archive compression)
+    try:
+        os.nice(BACKGROUND_NICE)
+    except (AttributeError, OSError):
+        pass
+    lower_thread_priority()
+
+
+class TokenBucket:
+    def __init__(self, rate=0):
+        self.rate = 0.0
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = float(rate or 0)
+            # one second of burst, so short pauses in the copy are not paid back at once
+            self.capacity = max(self.rate, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def consume(self, amount, should_stop=None):
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # the tokens are taken even if that leaves a debt: each caller sleeps off its own
+            # share, so concurrent workers together stay at the rate
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        deadline = time.monotonic() + wait
+        while wait > 0:
+            if should_stop is not None and should_stop():
+                return
+            time.sleep(min(wait, 0.2))
+            wait = deadline - time.monotonic()
+
+
+def _block_stat_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stat_file = Path(f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}/stat")
+    return stat_file if stat_file.exists() else None
+
+
+class DiskLatencyProbe:
+    def __init__(self, paths):
+        # one counter file per source disk; the busiest one sets the pace
+        self.stat_files = []
+        if sys.platform.startswith('linux'):
+            for path in paths:
+                stat_file = _block_stat_file(path)
+                if stat_file is not None and stat_file not in self.stat_files:
+                    self.stat_files.append(stat_file)
+        self._last = [self._read(f) for f in self.stat_files]
+
+    @property
+    def available(self):
+        return bool(self.stat_files)
+
+    def _read(self, stat_file):
+        try:
+            fields = stat_file.read_text().split()
+            # completed reads and writes and the milliseconds spent on them
+            return int(fields[0]) + int(fields[4]), int(fields[3]) + int(fields[7])
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def sample(self):
+        # average milliseconds per request since the last sample, None if the disk was idle
+        worst = None
+        for i, stat_file in enumerate(self.stat_files):
+            current = self._read(stat_file)
+            last, self._last[i] = self._last[i], current
+            if current is None or last is None or current[0] <= last[0]:
+                continue
+            latency = (current[1] - last[1]) / (current[0] - last[0])
+            worst = latency if worst is None else max(worst, latency)
+        return worst
+
+
+class Throttle:
+    def __init__(self, bytes_per_sec=0, files_per_sec=0, low_priority=False, adaptive=False,
+                 should_stop=None, log=None):
+        self.max_bytes_per_sec = bytes_per_sec or 0
+        self.low_priority = low_priority
+        self.adaptive = adaptive
+        self.should_stop = should_stop or (lambda: False)
+        self.log = log or (lambda message: None)
+        self.bytes = TokenBucket(self.max_bytes_per_sec)
+        self.files = TokenBucket(files_per_sec)
+        self.bytes_done = 0
+        self._count_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config, should_stop=None, log=None):
+        config = config or {}
+        return cls(bytes_per_sec=float(config.get('max_mb_per_sec') or 0) * 1024 * 1024,
+                   files_per_sec=float(config.get('max_files_per_sec') or 0),
+                   low_priority=bool(config.get('low_priority')), adaptive=bool(config.get('adaptive')),
+                   should_stop=should_stop, log=log)
+
+    @property
+    def active(self):
+        return bool(self.bytes.rate or self.files.rate or self.low_priority or self.adaptive)
+
+    @property
+    def limits_bytes(self):
+        return bool(self.max_bytes_per_sec or self.adaptive)
+
+    def wait_file(self):
+        self.files.consume(1, self.should_stop)
+
+    def wait_bytes(self, amount):
+        if self.adaptive:
+            with self._count_lock:
+                self.bytes_done += amount
+        self.bytes.consume(amount, self.should_stop)
+
+    def worker_started(self):
+        if self.low_priority:
+            lower_thread_priority()
+
+    def start(self, sources):
+        if not self.adaptive:
+            return
+        probe = DiskLatencyProbe(sources)
+        if not probe.available:
+            self.log("El ajuste automático de velocidad no está disponible para el disco de origen en este sistema")
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._monitor, args=(probe,), name="throttle-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.bytes.set_rate(self.max_bytes_per_sec)
+
+    def _monitor(self, probe):
+        baseline = None
+        backed_off = False
+        ceiling = self.max_bytes_per_sec
+        last_done = 0
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            with self._count_lock:
+                done = self.bytes_done
+            throughput = (done - last_done) / SAMPLE_INTERVAL
+            last_done = done
+            latency = probe.sample()
+            if latency is None:
+                continue
+            # the baseline follows the quietest latency seen and drifts up only slowly
+            if baseline is None or latency < baseline:
+                baseline = latency
+            else:
+                baseline += (latency - baseline) * 0.01
+            busy = latency > max(baseline * LATENCY_FACTOR, baseline + LATENCY_MARGIN_MS)
+            rate = self.bytes.rate
+
+            if busy:
+                current = rate or throughput
+                if not current:
+                    continue
+                if not backed_off and not self.max_bytes_per_sec:
+                    # without a configured limit, recovery aims for the speed reached before backing off
+                    ceiling = max(throughput, MIN_ADAPTIVE_RATE)
+                self.bytes.set_rate(max(current / 2, MIN_ADAPTIVE_RATE))
+                if not backed_off:
+                    self.log(f"Disco de origen ocupado ({latency:.0f} ms por operación), "
+                             f"reduciendo la velocidad a {self.bytes.rate / 1048576:.1f} MB/s")
+                backed_off = True
+            elif backed_off:
+                # additive recovery, then back to the configured limit (or to no limit at all)
+                step = ceiling * RECOVERY_STEP
+                if rate + step >= ceiling:
+                    self.bytes.set_rate(self.max_bytes_per_sec)
+                    backed_off = False
+                    self.log("El disco de origen vuelve a estar libre, velocidad restablecida")
+                else:
+                    self.bytes.set_rate(rate + step)
@@ -0,0 +1,118 @@
+import hashlib
+import math
+import mmap
+import os
+import threading
+
+from copy_engine import CopyPool, DEFAULT_WORKERS
+
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+MMAP_SLICE = 64 * 1024 * 1024
+
+
+def hash_local_file(path):
+    # mapped in large slices: no copy into Python buffers, and hashlib releases the
+    # GIL on big updates, so several workers hash at full speed in parallel
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return digest.hexdigest()
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return hash_stream(f)
+        with mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for offset in range(0, size, MMAP_SLICE):
+                    digest.update(view[offset:offset + MMAP_SLICE])
+    return digest.hexdigest()
+
+
+def hash_stream(f, buffer_size=HASH_BUFFER_SIZE):
+    digest = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        count = f.readinto(buffer)
+        if not count:
+            break
+        digest.update(view[:count])
+    return digest.hexdigest()
+
+
+def hash_chunks(chunks):
+    digest = hashlib.sha256()
+    for data in chunks:
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _sample_key(rel_path):
+    return hashlib.md5(rel_path.encode('utf-8')).digest()
+
+
+def select_sample(rel_paths, fraction, position=0):
+    # a fixed pseudo-random order walked a slice per run: every file is checked once
+    # every 1/fraction runs, and the order does not depend on how the tree is laid out
+    ordered = sorted(rel_paths, key=_sample_key)
+    if not ordered or fraction >= 1:
+        return ordered, 0
+    count = max(1, math.ceil(len(ordered) * fraction))
+    start = position % len(ordered)
+    selected = ordered[start:start + count]
+    if len(selected) < count:
+        selected += ordered[:count - len(selected)]
+    return selected, (start + count) % len(ordered)
+
+
+class Verifier:
+    def __init__(self, workers=DEFAULT_WORKERS, should_stop=None, log=None):
+        self.workers = workers
+        self.should_stop = should_stop or (lambda: False)
+        self.log = log or (lambda message: None)
+        self.lock = threading.Lock()
+
+    def run(self, expected, compute):
+        # expected: {rel_path: sha256 or None}; compute(rel_path) hashes the stored copy
+        # and raises FileNotFoundError when it is gone
+        stats = {'checked': 0, 'ok': 0, 'mismatched': 0, 'missing': 0, 'errors': 0, 'unverifiable': 0}
+        problems = []
+
+        def count(key, rel_path=None):
+            with self.lock:
+                stats[key] += 1
+                if rel_path is not None:
+                    problems.append((rel_path, key))
+
+        def check(rel_path, sha256):
+            try:
+                actual = compute(rel_path)
+            except FileNotFoundError:
+                count('missing', rel_path)
+                self.log(f"Falta en la copia: {rel_path}")
+                return
+            finally:
+                count('checked')
+            if actual == sha256:
+                count('ok')
+            else:
+                count('mismatched', rel_path)
+                self.log(f"Checksum distinto en la copia: {rel_path}")
+
+        def on_error(rel_path, e):
+            count('errors', rel_path)
+            self.log(f"Error verificando {rel_path}: {str(e)}")
+
+        with CopyPool(self.workers, should_stop=self.should_stop, on_error=on_error) as pool:
+            for rel_path, sha256 in expected.items():
+                if self.should_stop():
+                    break
+                if not sha256:
+                    # copied before checksums were recorded, or with them turned off
+                    count('unverifiable')
+                    continue
+                pool.submit(rel_path, check, rel_path, sha256)
+        return stats, problems